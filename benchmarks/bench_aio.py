@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Thousands of UAs in a single process with the asyncio engine (Aio.py):
+#  N UAs bound to successive UDP ports of the loopback interface, each
+#  one sending OPTIONS requests to the next one. Reports the time to
+#  start the UAs, the rate of completed OPTIONS transactions and the
+#  memory used per UA
+#
+# usage: python3 benchmarks/bench_aio.py [number of UAs] [OPTIONS per UA]
+#
+
+import sys
+import time
+import asyncio
+import resource
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Aio
+
+
+def rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+async def main(count, requests):
+    before = rss()
+    start = time.perf_counter()
+    uas = []
+    for i in range(count):
+        ua = Aio.AioUA(ua=dict(proxy='127.0.0.1:{}'.format(20000 + 2 * ((i + 1) % count))),
+                       identity=dict(aor='sip:ua{}@127.0.0.1'.format(i)),
+                       transport=dict(address='127.0.0.1', port=20000 + 2 * i, protocol='UDP'),
+                       registration=dict(autoreg=False))
+        await ua.start()
+        uas.append(ua)
+    started = time.perf_counter()
+    print("{} UAs started in {:.2f}s, {:.1f} kB per UA".format(count, started - start, (rss() - before) / count / 1024))
+
+    async def query(ua):
+        ok = 0
+        for i in range(requests):
+            if await ua.options():
+                ok += 1
+        return ok
+    start = time.perf_counter()
+    ok = sum(await asyncio.gather(*(query(ua) for ua in uas)))
+    elapsed = time.perf_counter() - start
+    print("{}/{} OPTIONS in {:.2f}s {:8.0f} /s".format(ok, count * requests, elapsed, count * requests / elapsed))
+
+    for ua in uas:
+        await ua.stop()
+
+if __name__ == '__main__':
+    for logger in ('Aio', 'UA', 'Dialog', 'Transaction'):
+        snl.loggers[logger].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(main(count, requests))
@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Cost of one message in the run loop of a TCP Transport as the number
+#  of open connections grows: N idle clients are connected to the
+#  Transport, then one more client sends OPTIONS one at a time and reads
+#  the 200 answered by the main process. The round-trip time should not
+#  depend on N
+#
+# usage: python3 benchmarks/bench_connections.py [number of exchanges]
+#
+
+import sys
+import time
+import socket
+import resource
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+
+
+OPTIONS = '\r\n'.join((
+    'OPTIONS sip:bob@127.0.0.1 SIP/2.0',
+    'Via: SIP/2.0/TCP 127.0.0.1;branch=z9hG4bK-1234',
+    'Max-Forwards: 70',
+    'From: <sip:alice@127.0.0.1>;tag=1234',
+    'To: <sip:bob@127.0.0.1>',
+    'Call-ID: 1234@127.0.0.1',
+    'CSeq: 1 OPTIONS',
+    'Content-Length: 0',
+    '',
+    '')).encode('ascii')
+
+def roundtrips(transport, client, count):
+    times = []
+    for i in range(count):
+        start = time.perf_counter()
+        client.sendall(OPTIONS)
+        request = transport.recv(2)
+        transport.send(request.response(200))
+        response = b''
+        while not response.endswith(b'\r\n\r\n'):
+            response += client.recv(65536)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[len(times) * 99 // 100]
+
+if __name__ == '__main__':
+    snl.loggers['Transport'].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    soft,hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    transport = snl.Transport(address='127.0.0.1', port=5090, protocol='TCP')
+    addr = (transport.localip, transport.localport)
+    print("{:>12} {:>10} {:>10}".format('connections', 'p50 (us)', 'p99 (us)'))
+    idle = []
+    for n in (10, 100, 1000, 4000):
+        if 2 * n + 64 > hard:
+            break
+        while len(idle) < n:
+            idle.append(socket.create_connection(addr))
+        client = socket.create_connection(addr)
+        roundtrips(transport, client, 100)
+        p50,p99 = roundtrips(transport, client, count)
+        client.close()
+        print("{:12d} {:10.1f} {:10.1f}".format(n, p50 * 1e6, p99 * 1e6))
+    for sock in idle:
+        sock.close()
+    transport.stop()
@@ -0,0 +1,139 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Framing of back-to-back messages received on a single TCP stream:
+#  -framing: SIPMessage.predecode() over a buffer holding all the
+#   messages, consuming the buffer by deleting its head after each
+#   message (previous Transport behavior) or by moving an offset
+#  -chunks of <size>: the same with the stream appended to the buffer in
+#   segments of size bytes, as recv() does, so that the buffer often
+#   ends with a partial message
+#  Both ways cost the same: CPython deletes the head of a bytearray by
+#   moving its start, without copying the rest of the buffer. The gain
+#   of the offsets is elsewhere: predecode() and finish() no longer copy
+#   the message out of the buffer
+#  -transport: messages per second delivered by Transport.recv() when
+#   the whole stream is written at once on a TCP connection
+#
+# usage: python3 benchmarks/bench_framing.py [number of messages]
+#
+
+import sys
+import time
+import socket
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Message
+
+
+MESSAGE = b'\r\n'.join((
+    b'OPTIONS sip:bob@127.0.0.1:5090 SIP/2.0',
+    b'Via: SIP/2.0/TCP 127.0.0.1:5091;branch=z9hG4bK-bench-%06d',
+    b'Max-Forwards: 70',
+    b'From: <sip:alice@127.0.0.1>;tag=bench',
+    b'To: <sip:bob@127.0.0.1>',
+    b'Call-ID: bench-%06d@127.0.0.1',
+    b'CSeq: 1 OPTIONS',
+    b'Contact: <sip:alice@127.0.0.1:5091;transport=tcp>',
+    b'Accept: application/sdp',
+    b'Content-Type: text/plain',
+    b'Content-Length: 32',
+    b'',
+    b'0123456789abcdef0123456789abcdef'))
+
+def stream(count):
+    return b''.join(MESSAGE % (i, i) for i in range(count))
+
+def framingdelete(data):
+    buf = bytearray(data)
+    count = 0
+    while True:
+        decodeinfo = Message.SIPMessage.predecode(buf)
+        if decodeinfo.status != 'OK':
+            return count
+        del buf[:decodeinfo.iend]
+        count += 1
+
+def framingoffset(data):
+    buf = bytearray(data)
+    offset = count = 0
+    while True:
+        decodeinfo = Message.SIPMessage.predecode(buf, offset)
+        if decodeinfo.status != 'OK':
+            return count
+        offset = decodeinfo.iend
+        count += 1
+
+def chunkeddelete(data, size):
+    buf = bytearray()
+    count = 0
+    for start in range(0, len(data), size):
+        buf += data[start:start+size]
+        while True:
+            decodeinfo = Message.SIPMessage.predecode(buf)
+            if decodeinfo.status != 'OK':
+                break
+            del buf[:decodeinfo.iend]
+            count += 1
+    return count
+
+# as ServiceSocketMixin.framing() and compact()
+def chunkedoffset(data, size):
+    buf = bytearray()
+    offset = count = 0
+    for start in range(0, len(data), size):
+        buf += data[start:start+size]
+        while True:
+            decodeinfo = Message.SIPMessage.predecode(buf, offset)
+            if decodeinfo.status != 'OK':
+                break
+            offset = decodeinfo.iend
+            count += 1
+        if offset == len(buf):
+            del buf[:]
+            offset = 0
+        elif offset > 65536:
+            del buf[:offset]
+            offset = 0
+    return count
+
+def transport(data, count):
+    t = snl.Transport(interface='lo', port=5090, protocol='TCP')
+    try:
+        sock = socket.create_connection((t.localip, t.localport))
+        start = time.perf_counter()
+        sock.sendall(data)
+        received = 0
+        while received < count:
+            if t.recv(5) is None:
+                break
+            received += 1
+        elapsed = time.perf_counter() - start
+        sock.close()
+        return received, elapsed
+    finally:
+        t.stop()
+
+if __name__ == '__main__':
+    snl.loggers['Transport'].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    data = stream(count)
+    print("{} messages, {} bytes".format(count, len(data)))
+
+    for name, framing in (('delete', framingdelete), ('offset', framingoffset)):
+        start = time.perf_counter()
+        n = framing(data)
+        elapsed = time.perf_counter() - start
+        print("framing {:8} {:6d} msg in {:.3f}s {:10.0f} msg/s".format(name, n, elapsed, n / elapsed))
+    for size in (1400, 65536):
+        for name, framing in (('delete', chunkeddelete), ('offset', chunkedoffset)):
+            start = time.perf_counter()
+            n = framing(data, size)
+            elapsed = time.perf_counter() - start
+            print("chunks of {:5d} {:8} {:6d} msg in {:.3f}s {:10.0f} msg/s".format(size, name, n, elapsed, n / elapsed))
+
+    n, elapsed = transport(data, count)
+    print("transport       {:6d} msg in {:.3f}s {:10.0f} msg/s".format(n, elapsed, n / elapsed))
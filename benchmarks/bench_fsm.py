@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Cost of the FSM event dispatch of the transactions:
+#  -lookup: handler found with getattr() on a name formatted at each
+#   event (previous Transaction behavior) or in the table compiled once
+#   per class
+#  -event: 1xx given to a non-INVITE client transaction in the Proceeding
+#   state with eventmessage() then taken by the TU with wait(), compared
+#   to the previous list with pop(0) under the lock of the transaction
+#  -select: an event given to one of N transactions taken with a
+#   persistent EventSelector or with waitany()
+#
+# usage: python3 benchmarks/bench_fsm.py [number of events]
+#
+
+import sys
+import time
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Transaction
+
+
+REQUEST = '\r\n'.join((
+    'OPTIONS sip:bob@127.0.0.1 SIP/2.0',
+    'Via: SIP/2.0/UDP 127.0.0.1:5070;branch=z9hG4bK-{0}',
+    'Max-Forwards: 70',
+    'From: <sip:alice@127.0.0.1>;tag=1234',
+    'To: <sip:bob@127.0.0.1>',
+    'Call-ID: {0}@127.0.0.1',
+    'CSeq: 1 OPTIONS',
+    'Content-Length: 0',
+    '',
+    ''))
+
+class NullTransport:
+    def send(self, message, addr=None):
+        pass
+
+def transaction(i=0, transactionclass=Transaction.NonINVITEclientTransaction):
+    request = snl.SIPMessage.frombytes(REQUEST.format(i).encode('ascii'))
+    # timers long enough not to fire during the measure
+    transaction = transactionclass(request, NullTransport(), T1=3600, T2=3600, T4=3600)
+    transaction.state = 'Proceeding'
+    return transaction
+
+# Transaction with the previous event list and dispatch
+class LegacyTransaction(Transaction.NonINVITEclientTransaction):
+    def init(self):
+        self.events = []
+        Transaction.NonINVITEclientTransaction.init(self)
+
+    def wait(self):
+        self.eventsemaphore.acquire()
+        with self.lock:
+            event = self.events.pop(0)
+        return event
+
+    def eventmessage(self, message):
+        with self.lock:
+            eventcb = getattr(self, '{}_{}xx'.format(self.state, message.familycode), None)
+            if eventcb:
+                state = self.state
+                self.lastresponse = message
+                if eventcb():
+                    self.events.append(message)
+                    self.eventsemaphore.release()
+                self.checkstate(state)
+
+def perevent(function, count):
+    start = time.perf_counter()
+    for i in range(count):
+        function()
+    return (time.perf_counter() - start) / count
+
+if __name__ == '__main__':
+    snl.loggers['Transaction'].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    response = transaction().request.response(180)
+
+    t = transaction()
+    getattrlookup = perevent(lambda: getattr(t, '{}_{}xx'.format(t.state, response.familycode), None), count)
+    tablelookup = perevent(lambda: t.fsm.get((t.state, response.familycode)), count)
+    print("lookup   getattr {:8.3f} us   table {:8.3f} us".format(getattrlookup * 1e6, tablelookup * 1e6))
+
+    legacy = transaction(0, LegacyTransaction)
+    def legacyevent():
+        legacy.eventmessage(response)
+        legacy.wait()
+    def event():
+        t.eventmessage(response)
+        t.wait()
+    print("event    list    {:8.3f} us   deque {:8.3f} us".format(perevent(legacyevent, count) * 1e6, perevent(event, count) * 1e6))
+
+    print("{:>12} {:>14} {:>14}".format('transactions', 'selector (us)', 'waitany (us)'))
+    for n in (10, 100, 1000):
+        transactions = [transaction(i) for i in range(n)]
+        selector = Transaction.EventSelector(transactions)
+        def selected():
+            transactions[selected.i % n].eventmessage(response)
+            selected.i += 1
+            assert len(selector.select()) == 1
+        selected.i = 0
+        def waitany():
+            transactions[waitany.i % n].eventmessage(response)
+            waitany.i += 1
+            assert Transaction.waitany(transactions) is not None
+        waitany.i = 0
+        selectortime = perevent(selected, count // 10)
+        selector.close()
+        print("{:12d} {:14.2f} {:14.2f}".format(n, selectortime * 1e6, perevent(waitany, max(10, count // n)) * 1e6))
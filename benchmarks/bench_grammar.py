@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Cost of the SIPBNF pyparsing grammars, per header type, with packrat
+#  memoization disabled and enabled
+# The URI line also shows the cost of building the Request-URI Parser
+#  on each call as URI() used to do (URI cache disabled)
+#
+# usage: python3 benchmarks/bench_grammar.py [duration per measure in seconds]
+#
+
+import sys
+import time
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from snl import SIPBNF
+
+
+SAMPLES = (
+    ('Via', SIPBNF.ViaParse, 'SIP/2.0/UDP 172.20.35.253:6064;rport;branch=z9hG4bKPjHpg0F53qjaD1TynDvA.ahs2u7dszKZlz'),
+    ('Contact', SIPBNF.ContactParse, '"coucou" <sip:+33960700014@172.20.35.253:6064;ob>;expires=3600;+sip.instance="<urn:uuid:00000000-0000-0000-0000-0000cb5e0a1a>"'),
+    ('Authorization', SIPBNF.AuthorizationParse, 'Digest username="+33960700014@sip.osk.com", realm="sip.osk.com", nonce="V0Dlfcmjen3atleWJCOm/Q==", uri="sip:sip.osk.com", response="71e01e9f07352c5423ef215b572f3ab3", algorithm=MD5, cnonce="Hf1rkJAuZ0-ukOSgnYE", qop=auth, nc=00000001'),
+    ('Security-Client', SIPBNF.Security_ClientParse, 'ipsec-3gpp; alg=hmac-md5-96; ealg=null; spi-c=1234; spi-s=5678; port-c=5062; port-s=5064, ipsec-3gpp; alg=hmac-sha-1-96; ealg=null; spi-c=1234; spi-s=5678; port-c=5062; port-s=5064'),
+    ('URI', SIPBNF.URI, 'sip:+33960700014@sip.osk.com:5060;user=phone;transport=udp'),
+)
+
+def bench(function, value, duration):
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(10):
+            res = function(value)
+            if not isinstance(res, (dict, SIPBNF.URI)):
+                list(res)
+        count += 10
+        elapsed = time.perf_counter() - start
+        if elapsed > duration:
+            return elapsed / count * 1e6
+
+def perparser(value):
+    return SIPBNF.URI(SIPBNF.URI.fields(SIPBNF.Parser('Request-URI', SIPBNF.Request_URI).parse(value)))
+
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1.
+    SIPBNF.seturicachesize(0)
+    initialsize = SIPBNF.PACKRATCACHESIZE
+    packratsize = initialsize or 128
+    print("{:20} {:>14} {:>14} {:>8}".format('grammar', 'no packrat', 'packrat', 'gain'))
+    rows = list(SAMPLES) + [('URI (Parser/call)', perparser, SAMPLES[-1][2])]
+    for name, function, value in rows:
+        times = []
+        for size in (0, packratsize):
+            SIPBNF.setpackrat(size)
+            times.append(bench(function, value, duration))
+        print("{:20} {:11.1f} us {:11.1f} us {:7.2f}x".format(name, times[0], times[1], times[0] / times[1]))
+    SIPBNF.setpackrat(initialsize)
@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Memory retained per decoded message, measured with tracemalloc, for
+#  each type of message of messages/*.txt (request method or response
+#  code). The headers are either left as received (lazy) or all parsed
+#  as after being handled by the transaction layer (parsed).
+#
+# usage: python3 benchmarks/bench_memory.py [number of copies per message]
+#
+
+import sys
+import glob
+import tracemalloc
+import collections
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+
+
+def loadmessages():
+    messages = []
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'messages', '*.txt'))):
+        with open(filename, 'rb') as f:
+            buf = f.read().replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        message = snl.SIPMessage.frombytes(buf)
+        if message is not None:
+            messages.append((messagetype(message), buf))
+    return messages
+
+def messagetype(message):
+    if isinstance(message, snl.SIPResponse):
+        return str(message.code)
+    return message.METHOD
+
+def retained(buf, count, parsed):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = []
+    for i in range(count):
+        message = snl.SIPMessage.frombytes(buf)
+        if parsed:
+            message.headers()
+        messages.append(message)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    sizes = collections.defaultdict(list)
+    for type, buf in loadmessages():
+        # warm the caches (URI cache, interned strings) before measuring
+        snl.SIPMessage.frombytes(buf).headers()
+        sizes[type].append((len(buf), retained(buf, count, False), retained(buf, count, True)))
+
+    print("{:10} {:>5} {:>10} {:>10} {:>10}".format('type', 'count', 'wire', 'lazy', 'parsed'))
+    totals = [0, 0, 0]
+    for type in sorted(sizes):
+        n = len(sizes[type])
+        means = [sum(size[i] for size in sizes[type]) / n for i in range(3)]
+        totals = [total + sum(size[i] for size in sizes[type]) for i, total in enumerate(totals)]
+        print("{:10} {:5d} {:10.0f} {:10.0f} {:10.0f}".format(type, n, *means))
+    n = sum(len(s) for s in sizes.values())
+    print("{:10} {:5d} {:10.0f} {:10.0f} {:10.0f}".format('all', n, *(total / n for total in totals)))
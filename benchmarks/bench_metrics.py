@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Cost of the instrumentation of the hot paths (see Metrics.py):
+#  -guard: test of Metrics.enabled done by the instrumented code when the
+#   registry is disabled
+#  -count, observe, countmessage: update of a counter, of a histogram and
+#   of the counters of a received message when it is enabled
+#  -recv: OPTIONS sent to a Transport (thread mode) and received, with
+#   the registry disabled then enabled
+#  -prometheus: rendering of the registry after the recv measures
+#
+# usage: python3 benchmarks/bench_metrics.py [number of operations]
+#
+
+import sys
+import time
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Metrics
+
+
+def perop(function, count):
+    start = time.perf_counter()
+    for i in range(count):
+        function()
+    return (time.perf_counter() - start) / count
+
+def guard():
+    if Metrics.enabled:
+        Metrics.count('sip_requests_sent_total', 'OPTIONS')
+
+if __name__ == '__main__':
+    snl.loggers['Transport'].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    options = snl.OPTIONS('sip:bob@127.0.0.1',
+                          'From: <sip:alice@127.0.0.1>;tag=1234',
+                          'To: <sip:bob@127.0.0.1>',
+                          'Call-ID: 1234@127.0.0.1',
+                          'CSeq: 1 OPTIONS')
+    options.enforceheaders()
+
+    print("guard        {:8.3f} us".format(perop(guard, count) * 1e6))
+    Metrics.enable()
+    print("count        {:8.3f} us".format(perop(lambda: Metrics.count('sip_requests_sent_total', 'OPTIONS'), count) * 1e6))
+    print("observe      {:8.3f} us".format(perop(lambda: Metrics.observe('sip_parse_seconds', 50e-6), count) * 1e6))
+    print("countmessage {:8.3f} us".format(perop(lambda: Metrics.countmessage('received', options), count) * 1e6))
+    Metrics.disable()
+    Metrics.reset()
+
+    a = snl.Transport(address='127.0.0.1', port=26010, protocol='UDP', mode='thread')
+    b = snl.Transport(address='127.0.0.1', port=26012, protocol='UDP', mode='thread')
+    def exchange():
+        a.send(options, ('127.0.0.1', 26012))
+        assert b.recv(2) is not None
+    disabled = perop(exchange, count // 10)
+    Metrics.enable()
+    enabled = perop(exchange, count // 10)
+    print("recv         disabled {:8.2f} us   enabled {:8.2f} us".format(disabled * 1e6, enabled * 1e6))
+    print("prometheus   {:8.2f} us".format(perop(Metrics.prometheus, 1000) * 1e6))
+    a.stop()
+    b.stop()
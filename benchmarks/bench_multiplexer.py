@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Creation of N SIPPhone instances with their own Transport process each,
+#  sharing the Transport of a Multiplexer per group, and all sharing the
+#  Transport of a single Multiplexer, then one OPTIONS from each phone of
+#  a first group to its peer of a second group. With a single
+#  Multiplexer, the OPTIONS go from the Multiplexer to itself and must
+#  reach the peer, not come back to their sender
+#
+# usage: python3 benchmarks/bench_multiplexer.py [number of phones per group]
+#
+
+import sys
+import time
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+
+
+def phones(count, name, proxy, transport):
+    return [snl.SIPPhoneClass()(ua=dict(proxy=proxy),
+                                identity=dict(aor='sip:{}{}@127.0.0.1'.format(name, i)),
+                                transport=transport(i),
+                                transaction=dict(workers=1),
+                                registration=dict(autoreg=False)) for i in range(count)]
+
+# requests delivered to the phones of the first group, that only send
+def countrequests(phone, counter):
+    deliver = phone.transport.deliver
+    def counting(message):
+        if isinstance(message, snl.SIPRequest):
+            counter[0] += 1
+        deliver(message)
+    phone.transport.deliver = counting
+
+def run(count, mode):
+    start = time.perf_counter()
+    multiplexers = []
+    if mode == 'shared':
+        muxa = snl.Multiplexer(address='127.0.0.1', port=21000, protocol='UDP')
+        muxb = snl.Multiplexer(address='127.0.0.1', port=21002, protocol='UDP')
+        multiplexers = [muxa, muxb]
+        A = phones(count, 'a', '127.0.0.1:21002', lambda i: dict(multiplexer=muxa))
+        B = phones(count, 'b', '127.0.0.1:21000', lambda i: dict(multiplexer=muxb))
+    elif mode == 'single':
+        mux = snl.Multiplexer(address='127.0.0.1', port=21004, protocol='UDP')
+        multiplexers = [mux]
+        A = phones(count, 'a', '127.0.0.1:21004', lambda i: dict(multiplexer=mux))
+        B = phones(count, 'b', '127.0.0.1:21004', lambda i: dict(multiplexer=mux))
+    else:
+        A = phones(count, 'a', None, lambda i: dict(address='127.0.0.1', port=22000 + 2 * i, protocol='UDP'))
+        B = phones(count, 'b', None, lambda i: dict(address='127.0.0.1', port=22000 + 2 * (count + i), protocol='UDP'))
+        for i,a in enumerate(A):
+            a.proxy = ('127.0.0.1', 22000 + 2 * (count + i))
+    misrouted = [0]
+    for a in A:
+        if mode != 'separate':
+            countrequests(a, misrouted)
+    created = time.perf_counter()
+    ok = sum(1 for i,a in enumerate(A) if a.options('To: <sip:b{}@127.0.0.1>'.format(i)))
+    done = time.perf_counter()
+    print("{:8} {:6d} phones created in {:6.2f}s, {}/{} OPTIONS in {:.2f}s, {} misrouted".format(mode, 2 * count, created - start, ok, count, done - created, misrouted[0]))
+    for phone in A + B:
+        phone.destroy()
+    for mux in multiplexers:
+        mux.stop()
+    return ok == count and not misrouted[0]
+
+if __name__ == '__main__':
+    for logger in ('Transport', 'UA', 'Dialog'):
+        snl.loggers[logger].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    ok = [run(count, mode) for mode in ('separate', 'shared', 'single')]
+    sys.exit(0 if all(ok) else 1)
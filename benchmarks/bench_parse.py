@@ -0,0 +1,99 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Decoding throughput (messages per second) of the sample messages
+#  of messages/*.txt with each header parsing engine:
+#  -headers: Header.Headers() on the header section only
+#  -eager/lazy: SIPMessage.frombytes() on the whole message followed by
+#   the accesses done by the transaction layer, with every header parsed
+#   at decoding time (eager) or on first access (lazy)
+# followed by the parsing rate of the header values handled by FastBNF
+#  and of the Request-URIs with and without the URI cache
+#
+# usage: python3 benchmarks/bench_parse.py [duration per engine in seconds]
+#
+
+import sys
+import glob
+import time
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Header
+from snl import Message
+from snl import SIPBNF
+from snl import FastBNF
+
+
+def loadmessages():
+    messages = []
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'messages', '*.txt'))):
+        with open(filename, 'rb') as f:
+            buf = f.read().replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        if snl.SIPMessage.frombytes(buf) is not None:
+            messages.append(buf)
+    return messages
+
+def headersection(buf):
+    decodeinfo = snl.SIPMessage.predecode(buf)
+    return buf[decodeinfo.iheaders:decodeinfo.iblank]
+
+def headervalues(messages):
+    values = {}
+    for buf in messages:
+        for header in Header.Headers(headersection(buf), strictparsing=False).list():
+            name = type(header).__name__
+            if hasattr(FastBNF, name + 'Parse'):
+                values.setdefault(name, []).append(header.tobytes().split(b':', 1)[1].strip().decode('utf-8'))
+    return values
+
+def decode(buf):
+    message = snl.SIPMessage.frombytes(buf)
+    message.branch, message.CseqMETHOD, message.callid, message.fromtag, message.totag
+    return message
+
+def bench(function, samples, duration):
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for sample in samples:
+            function(sample)
+        count += len(samples)
+        elapsed = time.perf_counter() - start
+        if elapsed > duration:
+            return count / elapsed
+
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3.
+    messages = loadmessages()
+    print("{} sample messages".format(len(messages)))
+    headers = [headersection(buf) for buf in messages]
+    results = {}
+    for engine in ('pyparsing', 'fast'):
+        Header.setparsingengine(engine)
+        results[engine] = [bench(lambda raw: Header.Headers(raw, strictparsing=False), headers, duration)]
+        for lazy in (False, True):
+            Message.DecodeInfo.lazyheaders = lazy
+            results[engine].append(bench(decode, messages, duration))
+    print("{:10} {:>12} {:>12} {:>12}".format('engine', 'headers', 'eager', 'lazy'))
+    for engine, rates in results.items():
+        print("{:10}".format(engine) + ''.join("{:8.0f} msg/s".format(rate) for rate in rates))
+    print("{:10}".format('speedup') + ''.join("{:12.2f}x".format(f/p) for f,p in zip(results['fast'], results['pyparsing'])))
+    print()
+    print("{:15} {:>16} {:>16} {:>8}".format('header', 'SIPBNF', 'FastBNF', 'speedup'))
+    for name, values in sorted(headervalues(messages).items()):
+        rates = [bench(lambda value: list(parse(value)), values, duration / 10)
+                 for parse in (getattr(SIPBNF, name + 'Parse'), getattr(FastBNF, name + 'Parse'))]
+        print("{:15} {:10.0f} val/s {:10.0f} val/s {:7.1f}x".format(name, rates[0], rates[1], rates[1] / rates[0]))
+    print()
+    uris = [buf.split(b' ', 2)[1].decode('ascii') for buf in messages if not buf.startswith(b'SIP/2.0')]
+    cachesize = SIPBNF.URICACHE.size
+    rates = []
+    for size in (0, cachesize):
+        SIPBNF.seturicachesize(size)
+        SIPBNF.URICACHE.clear()
+        rates.append(bench(SIPBNF.URI, uris, duration / 5))
+    print("{:15} {:10.0f} uri/s {:10.0f} uri/s {:7.1f}x  {}".format('URI (no cache/cache)', rates[0], rates[1], rates[1] / rates[0], SIPBNF.uricachestats()))
@@ -0,0 +1,122 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Throughput of the local UAS stand-ins answering 200 to OPTIONS:
+#  -responder: stateless Responder, with and without batched UDP I/O
+#  -standin: Load.StandIn, server transactions run in an event loop
+#  -manager: TransactionManager, server transactions and a handler run
+#   by the worker threads
+# CLIENTS processes keep up to WINDOW requests of distinct Call-IDs in
+#  flight for the given duration
+#
+# usage: python3 benchmarks/bench_responder.py [duration in seconds]
+#
+
+import sys
+import time
+import socket
+import asyncio
+import multiprocessing
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Transaction
+from snl import Load
+
+
+CLIENTS = 2
+WINDOW = 32
+PORT = 25000
+REQUEST = '\r\n'.join((
+    'OPTIONS sip:bob@127.0.0.1 SIP/2.0',
+    'Via: SIP/2.0/UDP 127.0.0.1;rport;branch=z9hG4bK-%d',
+    'Max-Forwards: 70',
+    'From: <sip:alice@127.0.0.1>;tag=1234',
+    'To: <sip:bob@127.0.0.1>',
+    'Call-ID: %d@127.0.0.1',
+    'CSeq: 1 OPTIONS',
+    'Content-Length: 0',
+    '',
+    '')).encode('ascii')
+
+def client(addr, duration, first, results):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.2)
+    counter = first
+    def send():
+        nonlocal counter
+        counter += 1
+        sock.sendto(REQUEST % (counter, counter), addr)
+    for i in range(WINDOW):
+        send()
+    responses = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        try:
+            sock.recv(65536)
+            responses += 1
+        except socket.timeout:
+            # lost requests: fill the window again
+            for i in range(WINDOW):
+                send()
+            continue
+        send()
+    sock.close()
+    results.put(responses)
+
+def throughput(addr, duration):
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=client, args=(addr, duration, i * 10**8, results)) for i in range(CLIENTS)]
+    for process in clients:
+        process.start()
+    responses = sum(results.get() for process in clients)
+    for process in clients:
+        process.join()
+    return responses / duration
+
+# servers run in their own process until stopped is set
+def standin(ready, stopped):
+    snl.loggers['Aio'].setLevel('WARNING')
+    async def main():
+        standin = Load.StandIn(address='127.0.0.1', port=PORT)
+        await standin.start()
+        ready.set()
+        while not stopped.is_set():
+            await asyncio.sleep(.1)
+        standin.destroy()
+    asyncio.run(main())
+
+class OPTIONSManager(Transaction.TransactionManager):
+    def OPTIONS_handler(self, options):
+        return options.response(200)
+
+def manager(ready, stopped):
+    manager = OPTIONSManager(transport=dict(address='127.0.0.1', port=PORT, protocol='UDP'))
+    ready.set()
+    stopped.wait()
+    manager.destroy()
+
+def inprocess(target, duration):
+    ready = multiprocessing.Event()
+    stopped = multiprocessing.Event()
+    server = multiprocessing.Process(target=target, args=(ready, stopped))
+    server.start()
+    ready.wait()
+    rate = throughput(('127.0.0.1', PORT), duration)
+    stopped.set()
+    server.join()
+    return rate
+
+if __name__ == '__main__':
+    snl.loggers['Transport'].setLevel('WARNING')
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3.
+    print("{} clients, window {}".format(CLIENTS, WINDOW))
+    for batch in (True, False):
+        responder = snl.Responder(address='127.0.0.1', port=PORT, batch=batch)
+        rate = throughput(('127.0.0.1', PORT), duration)
+        responder.stop()
+        print("{:24} {:10.0f} requests/s".format('responder' if batch else 'responder (no batch)', rate))
+    for name,target in (('standin', standin), ('manager', manager)):
+        print("{:24} {:10.0f} requests/s".format(name, inprocess(target, duration)))
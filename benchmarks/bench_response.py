@@ -0,0 +1,50 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Building responses from a received INVITE with SIPRequest.response(),
+#  which copies the Via, From, To, Call-ID and CSeq headers of the
+#  request, and ACKs with INVITE.ack()
+#
+# usage: python3 benchmarks/bench_response.py [number of responses]
+#
+
+import sys
+import time
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+
+
+INVITE = b'\r\n'.join((
+    b'INVITE sip:bob@biloxi.example.com SIP/2.0',
+    b'Via: SIP/2.0/UDP pc33.atlanta.example.com:5060;branch=z9hG4bK776asdhds;rport',
+    b'Via: SIP/2.0/UDP proxy.atlanta.example.com;branch=z9hG4bK74bf9;received=10.1.3.3',
+    b'Max-Forwards: 70',
+    b'To: Bob <sip:bob@biloxi.example.com>',
+    b'From: Alice <sip:alice@atlanta.example.com>;tag=1928301774',
+    b'Call-ID: a84b4c76e66710@pc33.atlanta.example.com',
+    b'CSeq: 314159 INVITE',
+    b'Contact: <sip:alice@pc33.atlanta.example.com;transport=udp>',
+    b'Content-Length: 0',
+    b'',
+    b''))
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    invite = snl.SIPMessage.frombytes(INVITE)
+
+    start = time.perf_counter()
+    for i in range(count):
+        invite.response(180)
+    elapsed = time.perf_counter() - start
+    print("response {:7d} in {:.3f}s {:10.0f} /s".format(count, elapsed, count / elapsed))
+
+    ok = invite.response(200, 'Contact: <sip:bob@192.0.2.4>')
+    count //= 10
+    start = time.perf_counter()
+    for i in range(count):
+        invite.ack(ok)
+    elapsed = time.perf_counter() - start
+    print("ack      {:7d} in {:.3f}s {:10.0f} /s".format(count, elapsed, count / elapsed))
@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Framing of a TCP stream received in small segments:
+#  -predecode: SIPMessage.predecode() run again from the start of the
+#   pending message after each segment (previous Transport behavior)
+#  -framer: Message.StreamFramer resuming its scan where it stopped
+# over two streams:
+#  -small: OPTIONS without body received 1 byte at a time
+#  -large: MESSAGE with a 64KB body received in segments of 1460 bytes
+#
+# usage: python3 benchmarks/bench_segmentation.py [number of messages]
+#
+
+import sys
+import time
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from snl import Message
+
+
+HEADERS = b'\r\n'.join((
+    b'%s sip:bob@127.0.0.1:5090 SIP/2.0',
+    b'Via: SIP/2.0/TCP 127.0.0.1:5091;branch=z9hG4bK-bench-%06d',
+    b'Max-Forwards: 70',
+    b'From: <sip:alice@127.0.0.1>;tag=bench',
+    b'To: <sip:bob@127.0.0.1>',
+    b'Call-ID: bench-%06d@127.0.0.1',
+    b'CSeq: 1 %s',
+    b'Contact: <sip:alice@127.0.0.1:5091;transport=tcp>',
+    b'Content-Type: text/plain',
+    b'Content-Length: %d',
+    b'',
+    b''))
+
+def stream(count, method, bodysize):
+    body = b'x' * bodysize
+    return b''.join(HEADERS % (method, i, i, method, bodysize) + body for i in range(count))
+
+def predecode(data, segment):
+    buf = bytearray()
+    offset = count = 0
+    for start in range(0, len(data), segment):
+        buf += data[start:start+segment]
+        while True:
+            decodeinfo = Message.SIPMessage.predecode(buf, offset)
+            if decodeinfo.status != 'OK':
+                break
+            offset = decodeinfo.iend
+            count += 1
+        if offset == len(buf):
+            del buf[:]
+            offset = 0
+    return count
+
+def framer(data, segment):
+    framer = Message.StreamFramer()
+    count = 0
+    for start in range(0, len(data), segment):
+        framer.feed(data[start:start+segment])
+        while framer.next() is not None:
+            count += 1
+    return count
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for name,data,segment in (('small', stream(count, b'OPTIONS', 0), 1),
+                              ('large', stream(count, b'MESSAGE', 65536), 1460)):
+        print("{}: {} messages, {} bytes, segments of {} bytes".format(name, count, len(data), segment))
+        for method in (predecode, framer):
+            start = time.perf_counter()
+            n = method(data, segment)
+            elapsed = time.perf_counter() - start
+            assert n == count, n
+            print("  {:10} {:8.3f} s {:10.0f} msg/s {:8.1f} MB/s".format(method.__name__, elapsed, n / elapsed, len(data) / elapsed / 1e6))
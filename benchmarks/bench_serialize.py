@@ -0,0 +1,55 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Serialization cost of the sample messages of messages/*.txt:
+#  -uncached: bytes(message) after a modification of the message
+#   (equivalent to the serialization done before the cache existed)
+#  -cached: bytes(message) of an unmodified message, as done by
+#   Transport.send for the UDP size check, the pipe and each
+#   retransmission
+#
+# usage: python3 benchmarks/bench_serialize.py [duration in seconds]
+#
+
+import sys
+import glob
+import time
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+
+
+def loadmessages():
+    messages = []
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'messages', '*.txt'))):
+        with open(filename, 'rb') as f:
+            buf = f.read().replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        message = snl.SIPMessage.frombytes(buf)
+        if message is not None:
+            # parse every header, as after a transaction layer round trip
+            message.headers()
+            messages.append(message)
+    return messages
+
+def rate(messages, duration, invalidate):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for message in messages:
+            if invalidate:
+                message._changed()
+            bytes(message)
+        count += len(messages)
+    return count / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2.
+    messages = loadmessages()
+    print("{} sample messages".format(len(messages)))
+    uncached = rate(messages, duration, True)
+    cached = rate(messages, duration, False)
+    print("uncached {:12.0f} msg/s".format(uncached))
+    print("cached   {:12.0f} msg/s".format(cached))
+    print("speedup  {:11.1f}x".format(cached / uncached))
@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Throughput of a ShardedTransport answering 200 to OPTIONS (Responder)
+#  with 1, 2, 4 and 8 workers: CLIENTS processes, each with its own UDP
+#  socket (so that the kernel spreads them over the workers), keep up to
+#  WINDOW requests of distinct Call-IDs in flight for the given duration.
+#  The requests received by a worker which does not own their Call-ID are
+#  forwarded to their owner: the share of forwarded requests is shown
+#
+# The throughput can only scale with the number of cores available
+#
+# usage: python3 benchmarks/bench_sharding.py [duration in seconds]
+#
+
+import sys
+import os
+import time
+import socket
+import multiprocessing
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+
+
+CLIENTS = 4
+WINDOW = 32
+REQUEST = '\r\n'.join((
+    'OPTIONS sip:bob@127.0.0.1 SIP/2.0',
+    'Via: SIP/2.0/UDP 127.0.0.1;branch=z9hG4bK-%d',
+    'Max-Forwards: 70',
+    'From: <sip:alice@127.0.0.1>;tag=1234',
+    'To: <sip:bob@127.0.0.1>',
+    'Call-ID: %d@127.0.0.1',
+    'CSeq: 1 OPTIONS',
+    'Content-Length: 0',
+    '',
+    '')).encode('ascii')
+
+def client(addr, duration, first, results):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.2)
+    counter = first
+    def send():
+        nonlocal counter
+        counter += 1
+        sock.sendto(REQUEST % (counter, counter), addr)
+    for i in range(WINDOW):
+        send()
+    responses = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        try:
+            sock.recv(65536)
+            responses += 1
+        except socket.timeout:
+            # lost requests: fill the window again
+            for i in range(WINDOW):
+                send()
+            continue
+        send()
+    sock.close()
+    results.put(responses)
+
+def throughput(workers, duration):
+    transport = snl.Responder(address='127.0.0.1', port=0, workers=workers)
+    addr = (transport.localip, transport.localport)
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=client, args=(addr, duration, i * 10**8, results)) for i in range(CLIENTS)]
+    for process in clients:
+        process.start()
+    responses = sum(results.get() for process in clients)
+    for process in clients:
+        process.join()
+    stats = transport.stop()
+    handled = sum(s['handled'] for s in stats)
+    forwarded = sum(s['forwarded'] for s in stats)
+    return responses / duration, forwarded / max(1, handled), [s['handled'] for s in stats]
+
+if __name__ == '__main__':
+    snl.loggers['Transport'].setLevel('WARNING')
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3.
+    print("{} cores, {} clients, window {}".format(os.cpu_count(), CLIENTS, WINDOW))
+    print("{:>8} {:>12} {:>10}  {}".format('workers', 'requests/s', 'forwarded', 'handled per worker'))
+    for workers in (1, 2, 4, 8):
+        rate, forwarded, handled = throughput(workers, duration)
+        print("{:8d} {:12.0f} {:9.0f}%  {}".format(workers, rate, forwarded * 100, handled))
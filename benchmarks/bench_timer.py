@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Timer.arm()/Timer.unarm() throughput and firing accuracy:
+#  -arm/unarm: N timers armed (durations of 30 to 60 s as Timer B, F, H
+#   or K) then cancelled, as done for the transactions completing before
+#   their timers expire
+#  -drift: delay between the target time and the call of the callback
+#   for N timers expiring randomly within 2 seconds
+#
+# usage: python3 benchmarks/bench_timer.py [number of timers]
+#
+
+import sys
+import time
+import random
+import threading
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from snl import Timer
+
+
+def armunarm(count):
+    durations = [random.uniform(30., 60.) for i in range(count)]
+    start = time.perf_counter()
+    timers = [Timer.arm(duration, None) for duration in durations]
+    armed = time.perf_counter()
+    for timer in timers:
+        Timer.unarm(timer)
+    cancelled = time.perf_counter()
+    return (armed - start) / count, (cancelled - armed) / count
+
+def drift(count):
+    drifts = []
+    done = threading.Event()
+    def fired(targettime):
+        drifts.append(time.monotonic() - targettime)
+        if len(drifts) == count:
+            done.set()
+    for i in range(count):
+        duration = random.uniform(0.1, 2.)
+        Timer.arm(duration, fired, time.monotonic() + duration)
+    done.wait(30)
+    drifts.sort()
+    return [drifts[int(len(drifts) * q)] for q in (0.5, 0.99)] + [drifts[-1]]
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    arm, unarm = armunarm(count)
+    print("{} timers".format(count))
+    print("arm     {:8.2f} us".format(arm * 1e6))
+    print("unarm   {:8.2f} us".format(unarm * 1e6))
+    p50, p99, maximum = drift(count // 10)
+    print("drift of {} timers: p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(count // 10, p50 * 1e3, p99 * 1e3, maximum * 1e3))
@@ -0,0 +1,95 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Cost of the TLS connections of a Transport to a server that closes the
+#  connection after each answer, so that each request reconnects:
+#  -full: the server sends no session ticket, every handshake is a full one
+#  -resumed: the server sends session tickets, the Transport resumes the
+#   session of the previous connection
+# The duration of the handshakes is taken from Transport.tlsstats(). The
+#  time to build an SSLContext (the CA file being loaded), paid once per
+#  process with the shared contexts, is shown as well
+#
+# A self-signed certificate is generated with the openssl command
+#
+# usage: python3 benchmarks/bench_tls.py [number of connections]
+#
+
+import sys
+import ssl
+import time
+import socket
+import tempfile
+import threading
+import subprocess
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+
+
+def certificate(directory):
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key, '-out', cert,
+                    '-days', '1', '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+# TLS server answering 200 to each request, then closing the connection
+def server(sslcontext, listening):
+    while True:
+        try:
+            sock = sslcontext.wrap_socket(listening.accept()[0], server_side=True)
+            data = b''
+            while b'\r\n\r\n' not in data:
+                data += sock.recv(65536)
+            response = snl.SIPMessage.frombytes(data).response(200)
+            response.length = 0
+            sock.sendall(bytes(response))
+            sock.close()
+        except OSError:
+            pass
+
+def connections(transport, addr, count):
+    request = snl.OPTIONS('sip:bob@127.0.0.1',
+                          'From: <sip:alice@127.0.0.1>;tag=1234',
+                          'To: <sip:bob@127.0.0.1>',
+                          'Call-ID: 1234@127.0.0.1',
+                          'CSeq: 1 OPTIONS')
+    request.enforceheaders()
+    for i in range(count):
+        transport.send(request, addr)
+        assert transport.recv(2) is not None
+        # let the transport see the end of the connection
+        time.sleep(0.02)
+    return transport.tlsstats()
+
+if __name__ == '__main__':
+    snl.loggers['Transport'].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    with tempfile.TemporaryDirectory() as directory:
+        cert,key = certificate(directory)
+        for name,cafile in (('CA file', cert), ('system CAs', None)):
+            start = time.perf_counter()
+            for i in range(10):
+                ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH, cafile=cafile)
+            print("SSLContext creation ({}) {:.2f} ms".format(name, (time.perf_counter() - start) / 10 * 1e3))
+
+        print("{:>8} {:>10} {:>14} {:>8} {:>14}".format('server', 'full', 'full (ms)', 'resumed', 'resumed (ms)'))
+        for name,tickets in (('full', 0), ('resumed', 2)):
+            sslcontext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            sslcontext.load_cert_chain(cert, key)
+            sslcontext.num_tickets = tickets
+            listening = socket.socket()
+            listening.bind(('127.0.0.1', 0))
+            listening.listen()
+            threading.Thread(target=server, args=(sslcontext, listening), daemon=True).start()
+            transport = snl.Transport(address='127.0.0.1', port=5062, protocol='TLS', cafile=cert, hostname='localhost')
+            stats = connections(transport, listening.getsockname(), count)
+            transport.stop()
+            listening.close()
+            print("{:>8} {:>10d} {:14.2f} {:8d} {:14.2f}".format(name,
+                stats['handshakes'], stats['handshaketime'] / max(1, stats['handshakes']) * 1e3,
+                stats['resumed'], stats['resumedtime'] / max(1, stats['resumed']) * 1e3))
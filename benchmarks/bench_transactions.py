@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Cost of TransactionManager.transactionmatching() as the number of live
+#  transactions grows: retransmissions of requests are matched against
+#  N non-INVITE server transactions, with the indexes of the manager
+#  and with the linear scan over all transactions done previously
+#
+# usage: python3 benchmarks/bench_transactions.py [number of matches]
+#
+
+import sys
+import time
+import threading
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Transaction
+
+
+REQUEST = '\r\n'.join((
+    'OPTIONS sip:bob@127.0.0.1 SIP/2.0',
+    'Via: SIP/2.0/UDP 127.0.0.1:5070;branch=z9hG4bK-{0:08d}',
+    'Max-Forwards: 70',
+    'From: <sip:alice@127.0.0.1>;tag={0}',
+    'To: <sip:bob@127.0.0.1>',
+    'Call-ID: {0}@127.0.0.1',
+    'CSeq: 1 OPTIONS',
+    'Content-Length: 0',
+    '',
+    '')).encode('ascii')
+
+# Transport given to the manager through the 'klass' key: nothing is
+#  received, nothing is sent
+class IdleTransport:
+    def __init__(self, **kwargs):
+        self.stopped = threading.Event()
+    def recv(self):
+        self.stopped.wait()
+    def send(self, message, addr=None):
+        pass
+    def stop(self):
+        self.stopped.set()
+
+def linearmatching(manager, message):
+    for transaction in manager.transactions:
+        if transaction.id == transaction.identifier(message):
+            return transaction
+
+def rate(matching, manager, messages, count):
+    start = time.perf_counter()
+    for i in range(count):
+        message = messages[i * len(messages) // count]
+        assert matching(manager, message) is not None
+    return (time.perf_counter() - start) / count
+
+if __name__ == '__main__':
+    snl.loggers['Transaction'].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print("{:>12} {:>14} {:>14}".format('transactions', 'indexed (us)', 'linear (us)'))
+    for n in (10, 100, 1000, 10000):
+        manager = Transaction.TransactionManager(transport=dict(klass=IdleTransport))
+        for i in range(n):
+            manager.newservertransaction(snl.SIPMessage.frombytes(REQUEST.replace(b'{0:08d}', b'%08d' % i).replace(b'{0}', b'%d' % i)))
+        # retransmissions spread over all the transactions
+        messages = [snl.SIPMessage.frombytes(REQUEST.replace(b'{0:08d}', b'%08d' % i).replace(b'{0}', b'%d' % i)) for i in range(0, n, max(1, n // 100))]
+        indexed = rate(Transaction.TransactionManager.transactionmatching, manager, messages, count)
+        linear = rate(linearmatching, manager, messages, max(10, count * 10 // n))
+        print("{:12d} {:14.1f} {:14.1f}".format(n, indexed * 1e6, linear * 1e6))
+        manager.destroy()
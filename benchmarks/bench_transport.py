@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Round-trip latency and throughput between two UDP Transports of the
+#  same process for each mode of Transport:
+#  -process: run loop in a child process, messages pickled over pipes
+#  -shm: run loop in a child process, messages packed in rings of shared memory
+#  -thread: run loop in a thread, messages passed as is
+#  -latency: one OPTIONS sent by A, received by B, its 200 sent by B and
+#   received by A, repeated N times
+#  -throughput: same exchanges with up to WINDOW requests in flight
+#
+# usage: python3 benchmarks/bench_transport.py [number of exchanges]
+#
+
+import sys
+import time
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+
+
+WINDOW = 64
+OPTIONS = snl.OPTIONS('sip:bob@127.0.0.1',
+                      'From: <sip:alice@127.0.0.1>;tag=1234',
+                      'To: <sip:bob@127.0.0.1>',
+                      'Call-ID: 1234@127.0.0.1',
+                      'CSeq: 1 OPTIONS')
+OPTIONS.enforceheaders()
+
+def exchange(a, b, addr, count):
+    for i in range(count):
+        a.send(OPTIONS, addr)
+    for i in range(count):
+        request = b.recv(2)
+        b.send(request.response(200))
+    return sum(1 for i in range(count) if a.recv(2) is not None)
+
+def latency(a, b, addr, count):
+    times = []
+    for i in range(count):
+        start = time.perf_counter()
+        exchange(a, b, addr, 1)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * .99)]
+
+def throughput(a, b, addr, count):
+    start = time.perf_counter()
+    received = 0
+    for i in range(0, count, WINDOW):
+        received += exchange(a, b, addr, min(WINDOW, count - i))
+    return received, 2 * received / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    snl.loggers['Transport'].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for mode in ('process', 'shm', 'thread'):
+        a = snl.Transport(address='127.0.0.1', port=23000, protocol='UDP', mode=mode)
+        b = snl.Transport(address='127.0.0.1', port=23002, protocol='UDP', mode=mode)
+        addr = ('127.0.0.1', 23002)
+        exchange(a, b, addr, 10)
+        p50, p99 = latency(a, b, addr, count // 5)
+        received, rate = throughput(a, b, addr, count)
+        print("{:8} round trip p50 {:6.1f} us p99 {:6.1f} us, {}/{} exchanges {:8.0f} messages/s".format(mode, p50 * 1e6, p99 * 1e6, received, count, rate))
+        a.stop()
+        b.stop()
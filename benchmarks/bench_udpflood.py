@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# UDP flood of the main socket of a Transport, with and without batched
+#  I/O (Transport(batch=True), see Mmsg):
+#  -receive: a generator process sends N OPTIONS datagrams as fast as
+#   possible to the transport, which receives them until it is idle for
+#   one second. Reports the received count and rate
+#  -send: N OPTIONS sent with Transport.send() to a sink process that
+#   counts them until it is idle for one second
+#
+# usage: python3 benchmarks/bench_udpflood.py [number of datagrams]
+#
+
+import sys
+import time
+import socket
+import multiprocessing
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Mmsg
+
+
+OPTIONS = snl.OPTIONS('sip:bob@127.0.0.1',
+                      'From: <sip:alice@127.0.0.1>;tag=1234',
+                      'To: <sip:bob@127.0.0.1>',
+                      'Call-ID: 1234@127.0.0.1',
+                      'CSeq: 1 OPTIONS')
+OPTIONS.enforceheaders()
+
+def generator(addr, count):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    packets = [(bytes(OPTIONS), addr)] * Mmsg.Batch().count
+    batch = Mmsg.Batch()
+    for i in range(0, count, len(packets)):
+        batch.send(sock, packets[:count - i])
+
+def sink(sock, result):
+    received = 0
+    sock.settimeout(1)
+    try:
+        while True:
+            sock.recv(65536)
+            received += 1
+            if received == 1:
+                start = time.perf_counter()
+            end = time.perf_counter()
+    except socket.timeout:
+        pass
+    result.send((received, end - start if received else 0))
+
+def receive(mode, batch, count):
+    transport = snl.Transport(address='127.0.0.1', port=24000, protocol='UDP', mode=mode, batch=batch)
+    flood = multiprocessing.Process(target=generator, args=(('127.0.0.1', 24000), count))
+    flood.start()
+    received = 0
+    start = end = time.perf_counter()
+    while transport.recv(1) is not None:
+        received += 1
+        end = time.perf_counter()
+    flood.join()
+    transport.stop()
+    return received, received / (end - start)
+
+def send(mode, batch, count):
+    transport = snl.Transport(address='127.0.0.1', port=24002, protocol='UDP', mode=mode, batch=batch)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 24004))
+    result,childresult = multiprocessing.Pipe()
+    counter = multiprocessing.Process(target=sink, args=(sock, childresult))
+    counter.start()
+    for i in range(count):
+        transport.send(OPTIONS, ('127.0.0.1', 24004))
+    received,elapsed = result.recv()
+    counter.join()
+    transport.stop()
+    return received, received / elapsed if elapsed else 0
+
+if __name__ == '__main__':
+    snl.loggers['Transport'].setLevel('WARNING')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    for mode in ('process', 'thread'):
+        for batch in (False, True):
+            received,rate = receive(mode, batch, count)
+            print("{:7} batch={!s:5} receive {:6d}/{} datagrams {:8.0f} /s".format(mode, batch, received, count, rate))
+            received,rate = send(mode, batch, count)
+            print("{:7} batch={!s:5} send    {:6d}/{} datagrams {:8.0f} /s".format(mode, batch, received, count, rate))
@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Request handlers of a TransactionManager blocking its worker pool:
+#  WORKERS handlers wait until released, then fast requests are
+#  dispatched. They are answered once the pool has been stalled for
+#  WorkerPool.stalltime seconds and a spare thread has been started,
+#  instead of waiting for the blocked handlers or being rejected with a
+#  503 when the queue fills up
+#
+# usage: python3 benchmarks/bench_workers.py [number of fast requests]
+#
+
+import sys
+import time
+import threading
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Transaction
+from bench_transactions import IdleTransport, REQUEST
+
+
+WORKERS = 4
+
+# Transport keeping the final responses sent by the server transactions
+class CollectingTransport(IdleTransport):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.responses = {}
+        self.answered = threading.Condition()
+    def send(self, message, addr=None):
+        if isinstance(message, snl.SIPResponse) and message.familycode != 1:
+            with self.answered:
+                self.responses[message.callid] = (message.code, time.monotonic())
+                self.answered.notify_all()
+
+class SlowManager(Transaction.TransactionManager):
+    def __init__(self, **kwargs):
+        self.released = threading.Event()
+        super().__init__(**kwargs)
+    def OPTIONS_handler(self, request):
+        if request.fromtag.startswith('slow'):
+            self.released.wait()
+        return request.response(200)
+
+def request(i, tag):
+    return snl.SIPMessage.frombytes(REQUEST.replace(b'{0:08d}', b'%08d' % i).replace(b'tag={0}', tag.encode('ascii')).replace(b'{0}', b'%d' % i))
+
+if __name__ == '__main__':
+    snl.loggers['Transaction'].setLevel('ERROR')
+    fast = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    manager = SlowManager(transport=dict(klass=CollectingTransport), workers=WORKERS)
+    transport = manager.transport
+    for i in range(WORKERS):
+        manager.dispatch(request(i, 'tag=slow{}'.format(i)))
+    start = time.monotonic()
+    for i in range(WORKERS, WORKERS + fast):
+        manager.dispatch(request(i, 'tag=fast{}'.format(i)))
+    with transport.answered:
+        transport.answered.wait_for(lambda: len(transport.responses) >= fast, timeout=10)
+    codes = [code for code,answertime in transport.responses.values()]
+    last = max((answertime for code,answertime in transport.responses.values()), default=start)
+    print("{} blocked handlers, {} fast requests: {} answered ({} 200, {} 503) in {:.3f}s (stalltime {}s)".format(
+        WORKERS, fast, len(codes), codes.count(200), codes.count(503), last - start, Transaction.WorkerPool.stalltime))
+    print(manager.workers.stats())
+    manager.released.set()
+    time.sleep(.1)
+    manager.destroy()
+    sys.exit(0 if codes.count(200) == fast else 1)
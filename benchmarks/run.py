@@ -0,0 +1,262 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+#
+# Benchmark suite of the hot paths, storing the results as JSON so that
+#  they can be compared between commits:
+#  -parse/<file>: SIPMessage.frombytes() of each message of messages/
+#  -header/<type>: Header.parse() of a header of each type found in
+#   the messages
+#  -tobytes/<file>: serialization of each message after a modification
+#  -response/<code>: SIPRequest.response() of an INVITE
+#  -digest/<qop>: Security.digest()
+#  -milenage/f2345: Milenage.f2345() (needs pycryptodome)
+#  -matching/<N>: TransactionManager.transactionmatching() among N live
+#   transactions
+#  -timer/arm-unarm, timer/fire: Timer.arm() then unarm(), and a timer
+#   of 0 second armed then fired in the timer thread
+#  -roundtrip/<protocol>: OPTIONS sent by a Transport (thread mode) to
+#   another one on the loopback interface and its 200 back
+# Each benchmark is calibrated to run for at least MINTIME seconds, then
+#  run REPEATS times: the median, min, mean and standard deviation of
+#  the time per operation are stored
+#
+# usage: python3 benchmarks/run.py [results.json] [name prefix...]
+#        python3 benchmarks/run.py compare old.json new.json [threshold in %]
+#  the comparison shows the ratio new/old of the median times and exits
+#  with status 1 when a benchmark is slower than the threshold (5%)
+#
+
+import sys
+import glob
+import json
+import time
+import platform
+import statistics
+import subprocess
+import threading
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import snl
+from snl import Header
+from snl import Security
+from snl import Timer
+from snl import Transaction
+import bench_transactions
+
+
+MINTIME = .05
+REPEATS = 5
+THRESHOLD = 5.
+
+# Benchmarks: generator functions yielding (name, function) for each
+#  case, function running one operation
+BENCHMARKS = []
+def benchmark(function):
+    BENCHMARKS.append(function)
+    return function
+
+def messages():
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'messages', '*.txt'))):
+        with open(filename, 'rb') as f:
+            buf = f.read().replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        if snl.SIPMessage.frombytes(buf) is not None:
+            yield os.path.splitext(os.path.basename(filename))[0], buf
+
+@benchmark
+def parse():
+    for name,buf in messages():
+        yield 'parse/' + name, lambda buf=buf: snl.SIPMessage.frombytes(buf)
+
+@benchmark
+def header():
+    raws = {}
+    for name,buf in messages():
+        decodeinfo = snl.SIPMessage.predecode(buf)
+        section = Header.Header.UNFOLDING_RE.sub(b' ', buf[decodeinfo.iheaders:decodeinfo.iblank])
+        for raw in section.split(b'\r\n'):
+            try:
+                headers = Header.Header.parse(raw)
+            except Exception:
+                continue
+            if headers:
+                raws.setdefault(type(headers[0]).__name__, raw)
+    for name,raw in sorted(raws.items()):
+        yield 'header/' + name, lambda raw=raw: Header.Header.parse(raw)
+
+@benchmark
+def tobytes():
+    for name,buf in messages():
+        message = snl.SIPMessage.frombytes(buf)
+        message.headers()
+        def serialize(message=message):
+            message._changed()
+            return bytes(message)
+        yield 'tobytes/' + name, serialize
+
+INVITE = b'\r\n'.join((
+    b'INVITE sip:bob@biloxi.example.com SIP/2.0',
+    b'Via: SIP/2.0/UDP pc33.atlanta.example.com:5060;branch=z9hG4bK776asdhds;rport',
+    b'Max-Forwards: 70',
+    b'To: Bob <sip:bob@biloxi.example.com>',
+    b'From: Alice <sip:alice@atlanta.example.com>;tag=1928301774',
+    b'Call-ID: a84b4c76e66710@pc33.atlanta.example.com',
+    b'CSeq: 314159 INVITE',
+    b'Contact: <sip:alice@pc33.atlanta.example.com;transport=udp>',
+    b'Content-Length: 0',
+    b'',
+    b''))
+
+@benchmark
+def response():
+    invite = snl.SIPMessage.frombytes(INVITE)
+    for code in (180, 200, 486):
+        yield 'response/{}'.format(code), lambda code=code: invite.response(code)
+
+@benchmark
+def digest():
+    invite = snl.SIPMessage.frombytes(INVITE)
+    for qop in (None, 'auth'):
+        yield 'digest/{}'.format(qop or 'none'), lambda qop=qop: Security.digest(
+            request=invite, realm='biloxi.example.com', nonce='dcd98b7102dd2f0e8b11d0f600bfb0c093', algorithm='MD5',
+            cnonce='0a4f113b', qop=qop, nc=1, username='alice', password='secret')
+
+@benchmark
+def milenage():
+    try:
+        from snl import Milenage
+    except ImportError as e:
+        yield 'milenage/f2345', e
+        return
+    milenage = Milenage.Milenage(OP=bytes(range(16)))
+    K = bytes(range(16, 32))
+    RAND = bytes(range(32, 48))
+    yield 'milenage/f2345', lambda: milenage.f2345(K, RAND)
+
+@benchmark
+def matching():
+    REQUEST = bench_transactions.REQUEST
+    for n in (10, 1000):
+        manager = Transaction.TransactionManager(transport=dict(klass=bench_transactions.IdleTransport))
+        for i in range(n):
+            manager.newservertransaction(snl.SIPMessage.frombytes(REQUEST.replace(b'{0:08d}', b'%08d' % i).replace(b'{0}', b'%d' % i)))
+        message = snl.SIPMessage.frombytes(REQUEST.replace(b'{0:08d}', b'%08d' % (n // 2)).replace(b'{0}', b'%d' % (n // 2)))
+        yield 'matching/{}'.format(n), lambda manager=manager: manager.transactionmatching(message)
+        manager.destroy()
+
+@benchmark
+def timer():
+    def nothing():
+        pass
+    yield 'timer/arm-unarm', lambda: Timer.unarm(Timer.arm(60, nothing))
+    fired = threading.Event()
+    def fire():
+        Timer.arm(0, fired.set)
+        fired.wait()
+        fired.clear()
+    yield 'timer/fire', fire
+
+@benchmark
+def roundtrip():
+    options = snl.OPTIONS('sip:bob@127.0.0.1',
+                          'From: <sip:alice@127.0.0.1>;tag=1234',
+                          'To: <sip:bob@127.0.0.1>',
+                          'Call-ID: 1234@127.0.0.1',
+                          'CSeq: 1 OPTIONS')
+    options.enforceheaders()
+    for protocol,port in (('UDP', 26000), ('TCP', 26004)):
+        a = snl.Transport(address='127.0.0.1', port=port, protocol=protocol, mode='thread')
+        b = snl.Transport(address='127.0.0.1', port=port + 2, protocol=protocol, mode='thread')
+        def exchange(a=a, b=b, addr=('127.0.0.1', port + 2)):
+            a.send(options, addr)
+            request = b.recv(2)
+            b.send(request.response(200))
+            assert a.recv(2) is not None
+        yield 'roundtrip/' + protocol, exchange
+        a.stop()
+        b.stop()
+
+def measure(function):
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(loops):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MINTIME:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(MINTIME / elapsed) + 1))
+    times = []
+    for repeat in range(REPEATS):
+        start = time.perf_counter()
+        for i in range(loops):
+            function()
+        times.append((time.perf_counter() - start) / loops)
+    return dict(median=statistics.median(times), min=min(times), mean=statistics.mean(times),
+                stdev=statistics.stdev(times), loops=loops, repeats=REPEATS)
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, check=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(output, prefixes):
+    results = {}
+    skipped = {}
+    for bench in BENCHMARKS:
+        for name,function in bench():
+            if prefixes and not any(name.startswith(prefix) for prefix in prefixes):
+                continue
+            if isinstance(function, Exception):
+                skipped[name] = str(function)
+                print("{:36} skipped: {}".format(name, function))
+                continue
+            result = results[name] = measure(function)
+            print("{:36} {:12.2f} us +- {:5.1f}%".format(name, result['median'] * 1e6, result['stdev'] / result['mean'] * 100))
+    report = dict(commit=commit(), date=time.strftime('%Y-%m-%dT%H:%M:%S'), python=platform.python_version(),
+                  platform=platform.platform(), results=results, skipped=skipped)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        print("results stored in {}".format(output))
+    return report
+
+def compare(old, new, threshold):
+    with open(old) as f:
+        old = json.load(f)
+    with open(new) as f:
+        new = json.load(f)
+    print("{:36} {:>12} {:>12} {:>8}".format('', (old['commit'] or old['date'])[:12], (new['commit'] or new['date'])[:12], 'ratio'))
+    regressions = 0
+    for name in sorted(set(old['results']) | set(new['results'])):
+        before = old['results'].get(name)
+        after = new['results'].get(name)
+        if before is None or after is None:
+            print("{:36} {:>12} {:>12}".format(name, '-' if before is None else '{:.2f}'.format(before['median'] * 1e6),
+                                               '-' if after is None else '{:.2f}'.format(after['median'] * 1e6)))
+            continue
+        ratio = after['median'] / before['median']
+        if ratio > 1 + threshold / 100:
+            verdict = 'slower'
+            regressions += 1
+        elif ratio < 1 - threshold / 100:
+            verdict = 'faster'
+        else:
+            verdict = ''
+        print("{:36} {:12.2f} {:12.2f} {:8.2f} {}".format(name, before['median'] * 1e6, after['median'] * 1e6, ratio, verdict))
+    print("{} benchmarks slower by more than {}%".format(regressions, threshold))
+    return regressions
+
+if __name__ == '__main__':
+    for logger in ('Transport', 'Transaction', 'Security', 'Message', 'Header'):
+        snl.loggers[logger].setLevel('WARNING')
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        if len(sys.argv) < 4:
+            sys.exit("usage: {} compare old.json new.json [threshold in %]".format(sys.argv[0]))
+        threshold = float(sys.argv[4]) if len(sys.argv) > 4 else THRESHOLD
+        sys.exit(1 if compare(sys.argv[2], sys.argv[3], threshold) else 0)
+    output = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1].endswith('.json') else None
+    run(output, sys.argv[2 if output else 1:])
@@ -0,0 +1,560 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+#
+# asyncio engine, in parallel with the threaded one:
+#  -AioTransport: UDP (DatagramProtocol) and TCP (Protocol) transport
+#   running in the event loop instead of a separate process
+#  -AioTransactionManager: transaction layer whose transactions are
+#   awaited (await transaction.wait()) and whose timers are armed with
+#   loop.call_later
+#  -AioUA: UA with coroutines sendmessage/options/register/invite/bye
+#
+# Everything runs in the thread of the event loop so that a single
+#  process can run thousands of UAs:
+#
+#     async def main():
+#         ua = Aio.AioUA(ua=dict(proxy='192.0.2.1'), identity=dict(aor='sip:alice@example.com'))
+#         await ua.start()
+#         session = await ua.invite('sip:bob@example.com')
+#         await ua.bye(session)
+#         await ua.stop()
+#     asyncio.run(main())
+#
+
+import asyncio
+import socket
+import itertools
+import functools
+import time
+import weakref
+import logging
+log = logging.getLogger('Aio')
+
+from . import Message
+from . import Header
+from . import Transaction
+from .Transport import Transport, localcandidates, preparemessage
+from . import Dialog
+from . import UA
+from . import Metrics
+
+
+class AioTransport:
+    instances = weakref.WeakSet()
+    # service TCP connections idle for more than 64*T1 sec are closed
+    IDLETIME = 32
+    def __init__(self, *, interface=None, address=None, port=None, behindnat=None, protocol='UDP+TCP', maxudp=1300, errorcb=None, sendcb=None, recvcb=None, messagecb=None):
+        self.protocol = protocol.upper()
+        if self.protocol == 'TLS':
+            log.logandraise(Exception("TLS is not supported by AioTransport"))
+        if not self.protocol in ('UDP', 'TCP', 'UDP+TCP'):
+            log.logandraise(Exception("bad value for protocol transport: {}".format(protocol)))
+
+        # bind the sockets to the first candidate not already used by
+        #  another transport instance (threaded or not) and not in use
+        #  by another process
+        self.localip = self.localport = None
+        self.udpsock = self.tcpsock = None
+        candidates,default = localcandidates(interface, address, port, self.protocol)
+        reserved = set((t.localport, t.localip) for t in itertools.chain(Transport.instances, AioTransport.instances))
+        error = None
+        for candidate in candidates:
+            if candidate in reserved:
+                continue
+            try:
+                self.bind(*candidate)
+                break
+            except OSError as err:
+                error = "cannot bind to {1}:{0}. {2}".format(*candidate, err.strerror)
+        else:
+            log.logandraise(Exception(error or "cannot bind to {1}:{0}. already used".format(*default)))
+        AioTransport.instances.add(self)
+
+        if isinstance(behindnat, str):
+            if ':' in behindnat:
+                nat = behindnat.split(':', 1)
+                self.behindnat = (nat[0], int(nat[1]))
+            else:
+                self.behindnat = (behindnat, None)
+        else:
+            self.behindnat = behindnat
+        self.maxudp = maxudp
+        self.errorcb = errorcb
+        self.sendcb = sendcb
+        self.recvcb = recvcb
+        self.messagecb = messagecb
+        self.udp = self.server = None
+        # TCP connections indexed by file descriptor and by remote address
+        self.connections = {}
+        self.connectionsbyaddr = {}
+        self.cleanuptimer = None
+
+    def __str__(self):
+        return "{}:{}".format(self.localip, self.localport)
+
+    def bind(self, port, ip):
+        udpsock = tcpsock = None
+        try:
+            if 'UDP' in self.protocol:
+                udpsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                udpsock.bind((ip, port))
+            if 'TCP' in self.protocol:
+                tcpsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                tcpsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                tcpsock.bind((ip, port))
+                tcpsock.listen()
+        except OSError:
+            for sock in (udpsock, tcpsock):
+                if sock:
+                    sock.close()
+            raise
+        self.udpsock,self.tcpsock = udpsock,tcpsock
+        self.localport,self.localip = port,ip
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.udpsock:
+            self.udp,protocol = await loop.create_datagram_endpoint(functools.partial(DatagramProtocol, self), sock=self.udpsock)
+            log.info("UDP listening on %s:%d (fd=%d)", self.localip, self.localport, self.udpsock.fileno())
+        if self.tcpsock:
+            self.server = await loop.create_server(functools.partial(StreamProtocol, self), sock=self.tcpsock)
+            log.info("TCP listening on %s:%d (fd=%d)", self.localip, self.localport, self.tcpsock.fileno())
+            self.cleanuptimer = loop.call_later(self.IDLETIME, self.cleanup)
+
+    def stop(self):
+        AioTransport.instances.discard(self)
+        if self.cleanuptimer:
+            self.cleanuptimer.cancel()
+        for connection in list(self.connections.values()) + list(self.connectionsbyaddr.values()):
+            connection.close()
+        if self.server:
+            self.server.close()
+        elif self.tcpsock:
+            self.tcpsock.close()
+        if self.udp:
+            self.udp.close()
+        elif self.udpsock:
+            self.udpsock.close()
+        self.udp = self.server = self.udpsock = self.tcpsock = None
+        log.info("%s stopped", self)
+
+    def send(self, message, addr=None):
+        fd,addr,packet = preparemessage(self, log, message, addr)
+        if self.udpsock and fd == self.udpsock.fileno():
+            try:
+                self.udp.sendto(packet, addr)
+            except Exception as err:
+                self.error(addr, str(err), packet)
+        else:
+            self.connection(addr, fd).write(packet)
+
+    # Socket where to send a message (see Transport.preparemessage)
+    def sendsocket(self, protocol, dstip, dstport, fd, isresponse):
+        if protocol == 'TCP':
+            connection = self.connection((dstip, dstport), fd)
+            return connection.fd, connection.localport or 0, self.localport, protocol
+        if protocol == 'UDP':
+            return self.udpsock.fileno(), self.localport, self.localport, protocol
+        log.logandraise(Exception("cannot send over {}: AioTransport supports UDP and TCP only".format(protocol)))
+
+    # TCP connection where to send a message: the one the request was
+    #  received on, one already established with the remote address or a
+    #  new one (the packets are sent when it is established)
+    def connection(self, addr, fd=None):
+        connection = self.connections.get(fd)
+        if connection is None:
+            connection = self.connectionsbyaddr.get(addr)
+        if connection is None:
+            connection = StreamProtocol(self, addr)
+            self.connectionsbyaddr[addr] = connection
+            loop = asyncio.get_running_loop()
+            connect = loop.create_task(loop.create_connection(lambda: connection, *addr, local_addr=(self.localip, 0)))
+            connect.add_done_callback(connection.connected)
+        return connection
+
+    def connectionmade(self, connection):
+        self.connections[connection.fd] = connection
+        self.connectionsbyaddr[connection.addr] = connection
+        log.info("%s: new service socket fd=%s", self, connection.fd)
+
+    def connectionlost(self, connection):
+        if self.connections.get(connection.fd) is connection:
+            del self.connections[connection.fd]
+        if self.connectionsbyaddr.get(connection.addr) is connection:
+            del self.connectionsbyaddr[connection.addr]
+
+    def cleanup(self):
+        currenttime = time.monotonic()
+        for connection in list(self.connections.values()):
+            if currenttime - connection.touchtime > self.IDLETIME:
+                log.info("%s: service socket fd=%s closed for inactivity", self, connection.fd)
+                connection.close()
+        self.cleanuptimer = asyncio.get_running_loop().call_later(self.IDLETIME, self.cleanup)
+
+    def received(self, protocol, addr, fd, decodeinfo):
+        srcip,srcport = addr[:2]
+        if Metrics.enabled:
+            start = time.perf_counter()
+            message = decodeinfo.finish()
+            Metrics.observe('sip_parse_seconds', time.perf_counter() - start)
+        else:
+            message = decodeinfo.finish()
+        if message is None:
+            return
+        message.fd = fd
+        if isinstance(message, Message.SIPRequest):
+            via = message.header('via')
+            if via:
+                if via.host != srcip:
+                    via.params['received'] = srcip
+                if 'rport' in via.params:
+                    via.params['received'] = srcip
+                    via.params['rport'] = srcport
+        log.info("%s:%s <-%s-- %s:%d (fd=%d)\n%s", self.localip, self.localport, protocol, srcip, srcport, fd, message)
+        if Metrics.enabled:
+            Metrics.countmessage('received', message)
+        if self.recvcb:
+            self.recvcb(message)
+        if self.messagecb:
+            self.messagecb(message)
+
+    def error(self, addr, err, packet):
+        message = Message.SIPMessage.frombytes(packet)
+        if message:
+            log.info("%s <-ERR-- %s:%d %s\n%s", self, *addr, err, message)
+            if self.errorcb:
+                self.errorcb(message, err)
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, transport):
+        self.aiotransport = transport
+
+    def datagram_received(self, data, addr):
+        decodeinfo = Message.SIPMessage.predecode(data)
+        # Discard inconsistent messages
+        if decodeinfo.status != 'OK':
+            return
+        self.aiotransport.received('UDP', addr, self.aiotransport.udpsock.fileno(), decodeinfo)
+
+    def error_received(self, exc):
+        log.info("%s <-ERR-- %s", self.aiotransport, exc)
+
+#
+# TCP connection, accepted or connected by the transport
+# The received bytes are framed with a Message.StreamFramer, as in
+#  Transport.ServiceSocketMixin
+#
+class StreamProtocol(asyncio.Protocol):
+    def __init__(self, transport, addr=None):
+        self.aiotransport = transport
+        self.transport = None
+        self.addr = addr
+        self.fd = -1
+        self.localport = None
+        self.pending = []
+        self.framer = Message.StreamFramer()
+        self.touchtime = time.monotonic()
+
+    def connected(self, connect):
+        # done callback of the connection task
+        if connect.cancelled() or connect.exception() is None:
+            return
+        err = "cannot connect to {}:{}. {}".format(*self.addr, connect.exception())
+        self.aiotransport.connectionlost(self)
+        for packet in self.pending:
+            self.aiotransport.error(self.addr, err, packet)
+        self.pending = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.fd = transport.get_extra_info('socket').fileno()
+        self.addr = transport.get_extra_info('peername')[:2]
+        self.localport = transport.get_extra_info('sockname')[1]
+        self.aiotransport.connectionmade(self)
+        for packet in self.pending:
+            transport.write(packet)
+        self.pending = []
+
+    def connection_lost(self, exc):
+        log.info("%s: service socket fd=%s closed after EOF", self.aiotransport, self.fd)
+        self.aiotransport.connectionlost(self)
+
+    def write(self, packet):
+        self.touchtime = time.monotonic()
+        if self.transport is None:
+            self.pending.append(packet)
+        else:
+            self.transport.write(packet)
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+        self.aiotransport.connectionlost(self)
+
+    def data_received(self, data):
+        self.touchtime = time.monotonic()
+        self.framer.feed(data)
+        while True:
+            decodeinfo = self.framer.next()
+            if decodeinfo is None:
+                break
+
+            # Erroneous messages or messages missing a Content-Length make the stream desynchronized
+            if decodeinfo.status == 'ERROR':
+                self.close()
+                return
+
+            self.aiotransport.received('TCP', self.addr, self.fd, decodeinfo)
+        self.framer.crlf = b''
+
+
+#
+# Transactions running in the event loop: timers are armed with
+#  loop.call_later and the TU awaits the events with wait()
+#
+class AioTransaction:
+    semaphoreclass = asyncio.Semaphore
+
+    def armtimer(self, name, duration):
+        asyncio.get_running_loop().call_later(duration, self.eventtimer, name, self.state)
+
+    async def wait(self):
+        await self.eventsemaphore.acquire()
+        return self.events.popleft()
+
+class AioINVITEclientTransaction(AioTransaction, Transaction.INVITEclientTransaction):
+    pass
+class AioACKclientTransaction(AioTransaction, Transaction.ACKclientTransaction):
+    pass
+class AioNonINVITEclientTransaction(AioTransaction, Transaction.NonINVITEclientTransaction):
+    pass
+class AioINVITEserverTransaction(AioTransaction, Transaction.INVITEserverTransaction):
+    pass
+class AioNonINVITEserverTransaction(AioTransaction, Transaction.NonINVITEserverTransaction):
+    pass
+
+class AioACKWaiter(Transaction.ACKWaiter):
+    def arm(self, duration, cb, **kwargs):
+        return asyncio.get_running_loop().call_later(duration, functools.partial(cb, **kwargs))
+
+#
+# Transaction layer fed by an AioTransport
+# Request handlers are either functions, called in the event loop, or
+#  coroutine functions, run in their own task
+#
+class AioTransactionManager(Transaction.TransactionLayer):
+    ACKWaiter = AioACKWaiter
+    INVITEclientTransaction = AioINVITEclientTransaction
+    ACKclientTransaction = AioACKclientTransaction
+    NonINVITEclientTransaction = AioNonINVITEclientTransaction
+    INVITEserverTransaction = AioINVITEserverTransaction
+    NonINVITEserverTransaction = AioNonINVITEserverTransaction
+    def __init__(self, transport, T1=None, T2=None, T4=None):
+        transportclass = transport.pop('klass', AioTransport)
+        super().__init__(transportclass(**transport, errorcb=self.transporterror, sendcb=self.modifybeforesend, recvcb=self.modifyafterreceive, messagecb=self.dispatch), T1, T2, T4)
+        self.tasks = set()
+
+    async def start(self):
+        await self.transport.start()
+
+    def destroy(self):
+        for task in self.tasks:
+            task.cancel()
+        self.transport.stop()
+
+    def spawn(self, coroutinefunction, *args, **kwargs):
+        # keep a reference on the task until it is done
+        task = asyncio.get_running_loop().create_task(coroutinefunction(*args, **kwargs))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def handle(self, handler):
+        if asyncio.iscoroutinefunction(handler.handler):
+            self.spawn(self.runhandler, handler)
+            return
+        try:
+            handler.run()
+        except Exception:
+            log.exception("request handler failed")
+
+    async def runhandler(self, handler):
+        try:
+            handler.respond(await handler.handler(handler.request))
+        except Exception:
+            log.exception("request handler failed")
+
+
+class AioUAbase(AioTransactionManager):
+    extensions = frozenset()
+    Result = UA.UAbase.Result
+    configure = UA.UAbase.configure
+    __str__ = UA.UAbase.__str__
+    OPTIONS_handler = UA.UAbase.OPTIONS_handler
+    def __init__(self, ua={}, identity={}, transport={}, transaction={}):
+        super().__init__(dict(transport), **transaction)
+        self.configure(ua, identity)
+
+    # Asynchronous generator of the (result, event) of a request. 401 and
+    #  407 responses are answered once with Digest authentication
+    async def sendmessage(self, message):
+        authenticated = False
+        transaction = self.newclienttransaction(message, self.proxy)
+        while True:
+            event = await transaction.wait()
+            if event is None:
+                return
+            result = self.Result(event)
+            if result.error and event.code in (401, 407) and not authenticated:
+                log.info("%s %d retrying %s with authentication", self, event.code, message.METHOD)
+                auth = message.authenticationheader(event, **self.identity)
+                if auth.header is None:
+                    error = Exception(auth.error)
+                    yield self.Result(error),error
+                    return
+                message.addheaders(auth.header, replace=True)
+                message.seq = message.seq + 1
+                authenticated = True
+                transaction = self.newclienttransaction(message, self.proxy)
+                continue
+            yield result,event
+            if not result.provisional:
+                return
+
+    def send(self, message):
+        self.transport.send(message, self.proxy)
+
+    async def options(self, *headers):
+        log.info("%s querying for capabilities", self)
+        options = Message.OPTIONS(self.domain, *headers)
+        options.addheaders(
+            Header.From(self.addressofrecord),
+            Header.To(self.addressofrecord),
+            Header.Content_Type('application/sdp'),
+            ifmissing=True
+        )
+        async for result,event in self.sendmessage(options):
+            if result.success:
+                log.info("%s query ok", self)
+                return event
+            elif result.error:
+                log.info("%s querying failed: %d %s", self, event.code, event.reason)
+                return
+            elif result.exception:
+                log.info("%s querying failed: %s", self, event)
+                return
+
+class AioUA(UA.SessionManager, UA.CancelationManager, AioUAbase):
+    configureregistration = UA.RegistrationManager.configureregistration
+    registerrequest = UA.RegistrationManager.registerrequest
+    def __init__(self, registration={}, **kwargs):
+        self.configureregistration(registration)
+        super().__init__(**kwargs)
+        self.registered = False
+        self.registermessage = None
+        self.regtimer = None
+
+    async def start(self):
+        await super().start()
+        if self.autoreg and self.addressofrecord:
+            await self.register()
+
+    async def stop(self):
+        if self.regtimer:
+            self.regtimer.cancel()
+        if self.autounreg and self.registered:
+            await self.register(0)
+        self.destroy()
+
+    async def register(self, expires=None, *headers):
+        expires = expires if expires is not None else self.expires
+        if self.regtimer:
+            self.regtimer.cancel()
+            self.regtimer = None
+
+        if expires > 0:
+            log.info("%s %s for %ds", self, 're-registering' if self.registermessage else 'registering', expires)
+        else:
+            log.info("%s unregistering", self)
+
+        self.registerrequest(expires, *headers)
+        async for result,event in self.sendmessage(self.registermessage):
+            if result.success:
+                gotexpires = 0
+                expiresheader = event.header('Expires')
+                if expiresheader:
+                    gotexpires = expiresheader.delta
+                contactheader = event.header('Contact')
+                if contactheader:
+                    gotexpires = contactheader.params.get('expires')
+                if gotexpires > 0:
+                    self.registered = True
+                    log.info("%s registered for %ds", self, gotexpires)
+                    if self.reregister:
+                        self.regtimer = asyncio.get_running_loop().call_later(gotexpires*self.reregister, self.spawn, self.register, expires, *headers)
+                    self.associateduris = [h.address for h in event.headers('P-Associated-URI')]
+                    return True
+                else:
+                    self.registered = False
+                    self.registermessage = None
+                    log.info("%s unregistered", self)
+                    return False
+
+            elif result.error:
+                if event.code == 423:
+                    minexpires = event.header('Min-Expires')
+                    log.info("%s registering failed: %s %s, %r", self, event.code, event.reason, minexpires)
+                    if minexpires:
+                        return await self.register(minexpires.delta, *headers)
+                self.registermessage = None
+                log.info("%s registering failed: %s %s", self, event.code, event.reason)
+                return False
+
+            elif result.exception:
+                self.registermessage = None
+                log.info("%s registering failed: %s", self, event)
+                return False
+
+    async def invite(self, touri, *headers):
+        invite,media = self.inviterequest(touri, *headers)
+        async for result,event in self.sendmessage(invite):
+            if result.success:
+                log.info("%s invitation ok", self)
+                session = Dialog.Session(invite, event, uac=True)
+                self.addsession(session, media)
+                try:
+                    if not media.setremoteoffer(event.body):
+                        log.info("%s incompatible codecs -> bying", self)
+                        await self.bye(session)
+                        return
+                    return session
+                except Exception as exc:
+                    log.info("%s %s -> bying", self, exc)
+                    await self.bye(session)
+                    return
+
+            elif result.error:
+                log.info("%s invitation failed: %s %s", self, event.code, event.reason)
+                return
+
+            elif result.exception:
+                log.info("%s invitation failed: %s", self, event)
+                return
+
+    async def bye(self, key):
+        bye = self.byerequest(key)
+        if bye is None:
+            return
+        async for result,event in self.sendmessage(bye):
+            if result.success:
+                log.info("%s closing ok", self)
+                return
+
+            elif result.error:
+                log.info("%s closing failed: %s %s", self, event.code, event.reason)
+                return
+
+            elif result.exception:
+                log.info("%s closing failed: %s", self, event)
+                return
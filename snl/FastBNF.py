@@ -0,0 +1,385 @@
+#coding: utf-8
+
+#
+# Hand-written scanners for the headers present in (almost) every SIP
+#  message: Via, From, To, Contact, Route, CSeq, Call-ID, Content-Length
+#  and Max-Forwards.
+#
+# Each <Name>Parse function returns exactly what its SIPBNF counterpart
+#  returns (same keys, same case folding, same types) for the common
+#  syntax, using a few precompiled regexes instead of the pyparsing
+#  grammar. Anything these scanners are not sure about (escaped chars,
+#  URI headers, passwords, IPv6, non-SIP schemes, quoted-pairs...) is
+#  handed over to the SIPBNF grammar which stays the reference.
+#
+
+import re
+
+from . import SIPBNF
+from .Utils import unquote,ParameterDict
+
+
+class Fallback(Exception):
+    pass
+
+
+TOKEN = r"[A-Za-z0-9\-.!%*_+`'~]+"
+QUOTED = r'"[^"\\\r\n]*"'
+HOSTNAME = r'(?:[A-Za-z0-9][A-Za-z0-9\-]*\.)*[A-Za-z][A-Za-z0-9\-]*'
+IPV4 = r'[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}'
+HOST = r'(?:{}|{})'.format(HOSTNAME, IPV4)
+USERCHARS = r"[A-Za-z0-9\-_.!~*'()&=+$,;?/]"
+PASSWORDCHARS = r"[A-Za-z0-9\-_.!~*'()&=+$,]"
+PARAMCHARS = r"[A-Za-z0-9\-_.!~*'()\[\]/:&+$]"
+URIPARAM = r'{p}+(?:={p}+)?'.format(p=PARAMCHARS)
+SWS = r'[ \t]*'
+
+URI_RE = re.compile(r'(sips?):(?:({u}+)(?::({p}*))?@)?({h})(?::([0-9]+))?((?:;{up})*)'.format(u=USERCHARS, p=PASSWORDCHARS, h=HOST, up=URIPARAM), re.IGNORECASE)
+URIPARAM_RE = re.compile(r';({p}+)(?:=({p}+))?'.format(p=PARAMCHARS))
+TOKEN_RE = re.compile(TOKEN)
+HOST_RE = re.compile(HOST)
+IPV4_RE = re.compile(IPV4)
+NAMEADDR_RE = re.compile(r'(?:({q}){s}|([A-Za-z0-9\-.!%*_+`\'~ \t]*))<([^>]*)>{s}'.format(q=QUOTED, s=SWS))
+HPARAM_RE = re.compile(r'{s};{s}({t})(?:{s}={s}(?:({t})|({q})))?'.format(s=SWS, t=TOKEN, q=QUOTED))
+COMMA_RE = re.compile(r'{s},{s}'.format(s=SWS))
+VIA_RE = re.compile(r'SIP{s}/{s}2\.0{s}/{s}({t})[ \t]+({h})(?:{s}:{s}([0-9]+))?(?=$|[ \t;,])'.format(s=SWS, t=TOKEN, h=HOST), re.IGNORECASE)
+CSEQ_RE = re.compile(r'([0-9]+)[ \t]+({})'.format(TOKEN))
+WORD = r"[A-Za-z0-9\-.!%*_+`'~()<>:\\\"/\[\]?{}]+"
+CALLID_RE = re.compile(r'{w}(?:@{w})?'.format(w=WORD))
+DIGITS_RE = re.compile(r'[0-9]+')
+
+
+#
+# URI parameters are folded the way SIPBNF.uri_parameter does it: the
+#  well-known names become lowercase and some values are normalized.
+#  The ambiguous cases where the grammar would fail or behave in a
+#  surprising way are left to it.
+#
+def uriparam(k, v):
+    lk = k.lower()
+    if lk.startswith('lr'):
+        if lk == 'lr' and v is None:
+            return 'lr', None
+        raise Fallback()
+    if v is None:
+        return k, v
+    if lk in ('transport', 'user', 'method'):
+        if not TOKEN_RE.fullmatch(v):
+            raise Fallback()
+        if lk == 'transport' and v.lower() in ('udp', 'tcp', 'sctp', 'tls'):
+            v = v.lower()
+        elif lk == 'user' and v.lower() in ('phone', 'ip'):
+            v = v.lower()
+        return lk, v
+    if lk == 'ttl':
+        if '0' <= v[0] <= '9':
+            if len(v) > 3 or not DIGITS_RE.fullmatch(v):
+                raise Fallback()
+            return lk, int(v)
+        return k, v
+    if lk == 'maddr':
+        if not HOST_RE.fullmatch(v):
+            raise Fallback()
+        return lk, v
+    return k, v
+
+#
+# Scan a SIP/SIPS URI starting at pos
+# Returns the URI fields (see SIPBNF.URI.fields) and the position
+#  following it
+#
+def scanuri(string, pos, endpos=None):
+    if endpos is None:
+        m = URI_RE.match(string, pos)
+    else:
+        m = URI_RE.fullmatch(string, pos, endpos)
+    if m is None:
+        raise Fallback()
+    scheme, user, password, host, port, paramstr = m.groups()
+    if password is not None:
+        raise Fallback()
+    params = []
+    if paramstr:
+        for k,v in URIPARAM_RE.findall(paramstr):
+            params.extend(uriparam(k, v or None))
+    return SIPBNF.URI.fields(dict(scheme=scheme.lower(), user=user, host=host, port=port, params=params)), m.end()
+
+#
+# URI of a name-addr, shared with SIPBNF.URI through the URI cache
+#
+def nameaddruri(uri):
+    fields = SIPBNF.URICACHE.get(uri)
+    if fields is None:
+        fields, _ = scanuri(uri, 0, len(uri))
+        SIPBNF.URICACHE.put(uri, fields)
+    return SIPBNF.URI(fields)
+
+#
+# Scan the header parameters following a name-addr or addr-spec
+#  (*(SEMI generic-param)). 'special' maps lowercase names to a function
+#  called with the token value; it returns the (key, value) pair or None
+#  when the generic rule applies.
+#
+def scanhparams(string, pos, special):
+    params = []
+    while True:
+        m = HPARAM_RE.match(string, pos)
+        if m is None:
+            return params, pos
+        k, tokenvalue, quotedvalue = m.groups()
+        pos = m.end()
+        kv = None
+        if tokenvalue is not None:
+            handler = special.get(k.lower())
+            if handler:
+                kv = handler(tokenvalue)
+        if kv is None:
+            if quotedvalue is not None:
+                kv = (k, unquote(quotedvalue))
+            else:
+                kv = (k, tokenvalue)
+        params.extend(kv)
+
+def tagparam(v):
+    return 'tag', v
+
+def qparam(v):
+    if v in ('0', '1'):
+        return 'q', int(v)
+    if v[0] in '01':
+        raise Fallback()
+
+def expiresparam(v):
+    if DIGITS_RE.fullmatch(v):
+        return 'expires', int(v)
+    if '0' <= v[0] <= '9':
+        raise Fallback()
+
+FROMPARAMS = dict(tag=tagparam)
+CONTACTPARAMS = dict(q=qparam, expires=expiresparam)
+ROUTEPARAMS = {}
+
+#
+# Scan one (name-addr / addr-spec) *(SEMI param) element
+#
+def scanaddr(string, pos, special, addrspec=True):
+    m = NAMEADDR_RE.match(string, pos)
+    if m:
+        quoteddisplay, display, uri = m.groups()
+        if quoteddisplay is not None:
+            display = unquote(quoteddisplay)
+        elif not display:
+            display = None
+        address = nameaddruri(uri)
+        params, pos = scanhparams(string, m.end(), special)
+        params = ParameterDict(zip(params[0::2], params[1::2]))
+    elif addrspec:
+        fields, pos = scanuri(string, pos)
+        address = SIPBNF.URI(fields)
+        if pos < len(string) and string[pos] != ',':
+            raise Fallback()
+        display = None
+        params = ParameterDict()
+        params.update(address.params)
+        address.params = ParameterDict()
+    else:
+        raise Fallback()
+    return dict(display=display, address=address, params=params), pos
+
+def scanlist(string, scan):
+    pos = 0
+    while True:
+        args, pos = scan(string, pos)
+        yield args
+        if pos == len(string):
+            return
+        m = COMMA_RE.match(string, pos)
+        if m is None:
+            raise Fallback()
+        pos = m.end()
+
+def withfallback(fastparse, ppparse, multiple=False):
+    if multiple:
+        def parse(headervalue):
+            try:
+                return list(fastparse(headervalue))
+            except Fallback:
+                return ppparse(headervalue)
+    else:
+        def parse(headervalue):
+            try:
+                return fastparse(headervalue)
+            except Fallback:
+                return ppparse(headervalue)
+    parse.__name__ = ppparse.__name__
+    return parse
+
+
+def fastContact(headervalue):
+    if '%' in headervalue or headervalue == '*':
+        raise Fallback()
+    return scanlist(headervalue, lambda string, pos: scanaddr(string, pos, CONTACTPARAMS))
+ContactParse = withfallback(fastContact, SIPBNF.ContactParse, multiple=True)
+
+def fastFrom(headervalue):
+    if '%' in headervalue:
+        raise Fallback()
+    args, pos = scanaddr(headervalue, 0, FROMPARAMS)
+    if pos != len(headervalue):
+        raise Fallback()
+    return args
+FromParse = withfallback(fastFrom, SIPBNF.FromParse)
+ToParse = withfallback(fastFrom, SIPBNF.ToParse)
+
+def fastRoute(headervalue):
+    if '%' in headervalue:
+        raise Fallback()
+    return scanlist(headervalue, lambda string, pos: scanaddr(string, pos, ROUTEPARAMS, addrspec=False))
+RouteParse = withfallback(fastRoute, SIPBNF.RouteParse, multiple=True)
+
+def scanvia(string, pos):
+    m = VIA_RE.match(string, pos)
+    if m is None:
+        raise Fallback()
+    protocol, host, port = m.groups()
+    if protocol.upper() in ('UDP', 'TCP', 'TLS', 'SCTP'):
+        protocol = protocol.upper()
+    if port is not None:
+        port = int(port)
+    params, pos = scanhparams(string, m.end(), {})
+    paramdict = ParameterDict()
+    for i in range(0, len(params), 2):
+        k = params[i]; v = params[i+1]
+        lk = k.lower()
+        if lk in VIAPARAMS:
+            # via-ttl, via-maddr, via-received and via-branch lowercase
+            #  their name and restrict their value: check the value
+            #  and leave the unusual cases to the grammar
+            if k != lk or (v is not None and not VIAPARAMS[lk].fullmatch(v)):
+                raise Fallback()
+        paramdict[k] = v
+    return dict(protocol=protocol, host=host, port=port, params=paramdict), pos
+VIAPARAMS = dict(ttl=re.compile('[0-9]{1,3}'), maddr=HOST_RE, received=IPV4_RE, branch=TOKEN_RE)
+
+def fastVia(headervalue):
+    return scanlist(headervalue, scanvia)
+ViaParse = withfallback(fastVia, SIPBNF.ViaParse, multiple=True)
+
+def fastCSeq(headervalue):
+    m = CSEQ_RE.fullmatch(headervalue)
+    if m is None:
+        raise Fallback()
+    return dict(seq=int(m.group(1)), method=m.group(2))
+CSeqParse = withfallback(fastCSeq, SIPBNF.CSeqParse)
+
+def fastCall_ID(headervalue):
+    if CALLID_RE.fullmatch(headervalue) is None:
+        raise Fallback()
+    return dict(callid=headervalue)
+Call_IDParse = withfallback(fastCall_ID, SIPBNF.Call_IDParse)
+
+def fastContent_Length(headervalue):
+    if DIGITS_RE.fullmatch(headervalue) is None:
+        raise Fallback()
+    return dict(length=int(headervalue))
+Content_LengthParse = withfallback(fastContent_Length, SIPBNF.Content_LengthParse)
+
+def fastMax_Forwards(headervalue):
+    if DIGITS_RE.fullmatch(headervalue) is None:
+        raise Fallback()
+    return dict(max=int(headervalue))
+Max_ForwardsParse = withfallback(fastMax_Forwards, SIPBNF.Max_ForwardsParse)
+
+
+if __name__ == '__main__':
+    import sys
+    import glob
+    import os.path
+    from . import Header
+
+    #
+    # Differential test: every header value handled by this module must
+    #  give the same result as the SIPBNF grammar (or the same error)
+    #
+    def run(parse, value):
+        try:
+            res = parse(value)
+            if not isinstance(res, dict):
+                res = list(res)
+            return repr(res)
+        except Exception as e:
+            return type(e).__name__
+
+    def values(rawmessage):
+        rawheaders = rawmessage.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n').split(b'\r\n\r\n')[0]
+        for rawheader in Header.Headers.HEADERSEP_RE.split(rawheaders)[1:]:
+            m = Header.Header.HEADER_RE.match(rawheader)
+            if m:
+                name, value = m.groups()
+                yield name.decode('utf-8'), Header.Header.UNFOLDING_RE.sub(b' ', value.strip()).decode('utf-8')
+
+    extraheaders = (
+        'Via: SIP /2.0/UDP 172.20.35.253:6064;rport;branch=z9hG4bKPjHpg0F53qjaD1TynDvA.ahs2u7dszKZlz, SIP/2.0/UDP 172.20.35.253:6064;rport;branch=z9hG4bKPjHpg0F53qjaD1TynDvA.ahs2u7dszKZlz',
+        'Via: SIP/2.0/udp 1.2.3.4 ; Branch=z ; received = 5.6.7.8;ttl=12;maddr=a.b;rport',
+        'Via: SIP/2.0/tcpx h : 5060;received=abc;x="a b"',
+        'Via: SIP/2.0/UDP [::1]:5060',
+        'Route: une route bien droite <sip:172.20.56.7;lr>',
+        'Route: "une route" <sip:172.20.56.7;lr>, "deuxième route" <sip:172.20.56.7>   ,   \t "et de trois" <sip:172.20.56.7>,<sip:172.20.56.7>',
+        'Route: <sip:h;lr=on>',
+        'Route: <sip:h;lrx>',
+        'From: <sip:alice@toto.com>;tag',
+        'From: sip:alice@toto.com;lr',
+        'From: sip:alice@toto.com ;tag=1',
+        'From: "with quote \\" and backslash \\\\." <sip:172.20.56.7;lr>',
+        'From: "bbbbb cccc èèè ሴ噸骼" <sip:+33960700014@sip.osk.com:1;lr>;tag=dd;toto',
+        'From: <sip:0960700011@sip.osk.com;user=Phone;Transport=UDP;method=INVITE;ttl=5;maddr=1.2.3.4>;TAG=4lQ1i4QM',
+        'From: <sip:a:pw@h>',
+        'From: <sip:a%40b@h>',
+        'From: <sip:a@h?subject=x>',
+        'From: <tel:+3312345678>',
+        'From: sip:a@example.com.',
+        'To: abc <sip:a@b>;Tag=1;TAG',
+        'Contact: *',
+        'Contact: <sip:+33960700014@172.20.35.253:6064>,"coucou" <sip:+33960700014@172.20.35.253:6064;ob>,sip:+33960700014@172.20.35.253:6064;ob',
+        'Contact: <sip:a@b>;q=0;Expires=60;x="y z";y=\'z\'',
+        'Contact: <sip:a@b>;q=0.5',
+        'Contact: <sip:a@b>;q=2;expires=soon',
+        'Contact: <sip:a@b>;expires=60s',
+        'Contact: sip:a@b;expires=60;ttl=1;transport=TLS',
+        'Contact: sip:h1,sip:c@d',
+        'CSeq: 60011 REGISTER',
+        'CSeq: 1\tINVITE',
+        'CSeq: a INVITE',
+        'Call-ID: HrbWx6Jsr2g57PkBrkQwweCZyXCyM7xb@[1.2.3.4]',
+        'Call-ID: a b',
+        'Content-Length: 0',
+        'Content-Length: -1',
+        'Max-Forwards: 70',
+    )
+
+    samples = []
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'messages', '*.txt'))):
+        with open(filename, 'rb') as f:
+            samples.extend(values(f.read()))
+    for string in extraheaders:
+        name, value = string.split(':', 1)
+        samples.append((name, value.strip()))
+
+    errors = checked = 0
+    for name, value in samples:
+        cls = Header.Header.SIPheaderclasses.get(name.lower())
+        if cls is None:
+            continue
+        fastparse = globals().get(cls.__name__ + 'Parse')
+        if fastparse is None:
+            continue
+        checked += 1
+        expected = run(getattr(SIPBNF, cls.__name__ + 'Parse'), value)
+        got = run(fastparse, value)
+        if got != expected:
+            errors += 1
+            print("{}: {}".format(name, value))
+            print("  SIPBNF : {}".format(expected))
+            print("  FastBNF: {}".format(got))
+    print("{} header values checked, {} differences".format(checked, errors))
+    sys.exit(1 if errors else 0)
@@ -1,65 +1,98 @@
 #coding: utf-8
 
 import re
-import copy
 import logging
 import itertools
+import threading
 log = logging.getLogger('Header')
 
 from . import SIPBNF
+from . import FastBNF
 from . import Utils
 
 
    
 #
 # Ordered collection of headers in a SIP message
-class Headers:
+#
+# In lazy mode, header lines given as bytes or str are only split and
+#  indexed by name: each one is kept as a Rawheader until first(), list()
+#  or pop() needs that name, and untouched ones are serialized with
+#  their original bytes.
+# Adding or removing headers, as well as modifying one of them, is
+#  notified to the message owning the collection (see Utils.Owned).
+class Headers(Utils.Owned):
     HEADERSEP_RE = re.compile(b'\r\n(?![ \t])')
+    HEADERNAME_RE = re.compile(b'([a-zA-Z-.!%*_+`\'~]+)[ \t]*:')
     firstnames = ['via', 'route', 'from', 'to', 'contact', 'expires', 'call-id', 'cseq', 'max-forward']
     lastnames = ['allow', 'content-type', 'content-length']
     
-    def __init__(self, *headers, strictparsing=True):
+    def __init__(self, *headers, strictparsing=True, lazy=False):
         self._headers = {}
+        self._raw = set()
+        self.lazy = lazy
         self.add(*headers, strictparsing=strictparsing)
         
     def add(self, *headers, strictparsing=True):
-        headers = Headers.parse(*headers, strictparsing=strictparsing)
+        headers = Headers.parse(*headers, strictparsing=strictparsing, lazy=self.lazy)
         for header in headers:
-            self._headers.setdefault(header._indexname, []).append(header)
+            self._headers.setdefault(header._indexname, []).append(self._adopt(header))
+            if isinstance(header, Rawheader):
+                self._raw.add(header._indexname)
+        if headers:
+            self._changed()
 
     def addifmissing(self, *headers, strictparsing=True):
         headers = Headers.parse(*headers, strictparsing=strictparsing)
         for header in headers:
-            l = self._headers.setdefault(header._indexname, [])
-            if len(l) == 0:
-                l.append(header)
+            l = self._resolve(header._indexname)
+            if not l:
+                self._headers[header._indexname] = [self._adopt(header)]
+                self._changed()
 
     def replaceoradd(self, *headers, strictparsing=True):
         headers = Headers.parse(*headers, strictparsing=strictparsing)
-        replaced = set()
+        replacing = {}
         for header in headers:
-            index = header._indexname
-            if not index in replaced:
-                self._headers[index] = []
-                replaced.add(index)
-            self._headers[index].append(header)
+            replacing.setdefault(header._indexname, []).append(self._adopt(header))
+        for index,replacement in replacing.items():
+            self._headers[index] = replacement
+            self._raw.discard(index)
+        if headers:
+            self._changed()
+
+    def _adopt(self, header):
+        if isinstance(header, Header):
+            return header._adoptedby(self)
+        return header
+
+    # the lock of _resolve() is neither copied nor pickled
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_resolvelock', None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        for headers in self._headers.values():
+            headers[:] = [self._adopt(header) for header in headers]
 
     @staticmethod
-    def parse(*headers, strictparsing):
+    def parse(*headers, strictparsing, lazy=False):
         newheaders = []
         for header in headers:
             #
             # Already formed Headers are copied and added to the list
             #
             if isinstance(header, Header):
-                newheaders.append(copy.deepcopy(header))
+                newheaders.append(header.copy())
                 continue
 
             
             #
             # Other are bytes sequence that must be decoded
             #
-            if isinstance(header, (bytes, bytearray)):
+            if isinstance(header, (bytes, bytearray, memoryview)):
                 headerbytes = bytes(header)
             elif isinstance(header, str):
                 headerbytes = header.encode('utf-8')
@@ -72,43 +105,99 @@ class Headers:
             for rawheader in Headers.HEADERSEP_RE.split(b'\r\n' + headerbytes):
                 if not rawheader: continue
 
+                #
+                # In lazy mode, only find the header name
+                #
+                if lazy:
+                    m = Headers.HEADERNAME_RE.match(rawheader)
+                    if m:
+                        newheaders.append(Rawheader(rawheader, Header.index(m.group(1).decode('ascii')), strictparsing))
+                        continue
+
                 #
                 # Parse the header
                 #
-                try:
-                    newheaders.extend(Header.parse(rawheader))
-                except Exception as error:
-                    if strictparsing:
-                        raise
-                    else:
-                        log.warning(error)
+                newheaders.extend(Headers.parseraw(rawheader, strictparsing))
         return newheaders
 
-    def list(self, *names):
+    @staticmethod
+    def parseraw(rawheader, strictparsing):
+        try:
+            return Header.parse(rawheader)
+        except Exception as error:
+            if strictparsing:
+                raise
+            else:
+                log.warning(error)
+                return []
+
+    #
+    # Parse the Rawheaders stored under index
+    # Returns the list of headers, None if there is none
+    # A message is read by several threads (transaction manager, workers,
+    #  timers): the Rawheaders are parsed under a lock of the collection,
+    #  created (atomically, with dict.setdefault) by the first thread
+    #  needing it, and the name leaves _raw only once the parsed headers
+    #  are in place
+    #
+    def _resolve(self, index):
+        if index in self._raw:
+            lock = self.__dict__.get('_resolvelock')
+            if lock is None:
+                lock = self.__dict__.setdefault('_resolvelock', threading.Lock())
+            with lock:
+                if index in self._raw:
+                    headers = []
+                    for header in self._headers[index]:
+                        if isinstance(header, Rawheader):
+                            headers.extend(self._adopt(parsed) for parsed in Headers.parseraw(header.raw, header.strictparsing))
+                        else:
+                            headers.append(header)
+                    if headers:
+                        self._headers[index] = headers
+                    else:
+                        del self._headers[index]
+                    self._raw.discard(index)
+        return self._headers.get(index)
+
+    def _ordered(self, names):
         if not names:
             names = list(self._headers.keys())
         else:
-            names = [Header.index(name) for name in names if Header.index(name) in self._headers.keys()]
-        firstnames = [Header.index(name) for name in Headers.firstnames if Header.index(name) in names]
-        lastnames = [Header.index(name) for name in Headers.lastnames if Header.index(name) in names]
-        return list(itertools.chain(*itertools.chain([self._headers[name] for name in firstnames]),
-                                    *itertools.chain([self._headers[name] for name in names if name not in firstnames and name not in lastnames]),
-                                    *itertools.chain([self._headers[name] for name in lastnames])))
+            names = [index for index in map(Header.index, names) if index in self._headers]
+        # firstnames and lastnames are already index names
+        firstnames = [name for name in Headers.firstnames if name in names]
+        lastnames = [name for name in Headers.lastnames if name in names]
+        return firstnames + [name for name in names if name not in firstnames and name not in lastnames] + lastnames
+
+    def list(self, *names):
+        headers = []
+        for name in self._ordered(names):
+            headers.extend(self._resolve(name) or ())
+        return headers
 
     def first(self, name):
-        return self._headers.get(Header.index(name), [None])[0]
+        return (self._resolve(Header.index(name)) or [None])[0]
 
     def pop(self, name):
         index = Header.index(name)
-        l = self._headers.get(index)
+        l = self._resolve(index)
         if l is None:
             return None
         if len(l) == 1:
             del self._headers[index]
+        self._changed()
         return l.pop(0)
+
+    def tolines(self, headerform='nominal'):
+        if headerform == 'short':
+            headers = self.list()
+        else:
+            headers = itertools.chain(*(self._headers[name] for name in self._ordered(())))
+        return [header.tobytes(headerform) for header in headers]
  
     def tobytes(self, headerform='nominal'):
-        return b'\r\n'.join([header.tobytes(headerform) for header in self._headers] + [b''])
+        return b'\r\n'.join(self.tolines(headerform) + [b''])
 
 #
 # Metaclass that automatically adds the attributes
@@ -120,8 +209,13 @@ class Headers:
 #   -_display
 #  to each Header subclass based on the definition in SIPBNF.py
 #
+# The attributes listed in _args are stored in __slots__
+#
 # And collect all headers in dict Header.SIPheaderclasses
 #
+# _parse is taken from the current parsing engine (see setparsingengine)
+#  or from SIPBNF.py for the headers the engine does not handle
+#
 # Exemple:
 #  class Content_Length(Header):
 #      pass
@@ -129,18 +223,39 @@ class Headers:
 #  assert cl._name == 'Content-Length'
 #  assert cl._args == SIPBNF.Content_LengthArgs
 #  assert cl._alias == SIPBNF.Content_LengthAlias or None
-#  assert cl._parse == SIPBNF.Content_LengthParse
+#  assert cl._parse == FastBNF.Content_LengthParse (or SIPBNF.Content_LengthParse)
 #  assert cl._multiple == SIPBNF.Content_LengthMultiple or False
 #  assert cl._display == SIPBNF.Content_LengthDisplay
+PARSINGENGINES = dict(fast=FastBNF, pyparsing=SIPBNF)
+PARSINGENGINE = 'fast'
+def parsefunction(name):
+    return getattr(PARSINGENGINES[PARSINGENGINE], name + 'Parse', None) or getattr(SIPBNF, name + 'Parse')
+
+#
+# Select the engine used to parse header values:
+#  -'fast': hand-written scanners of FastBNF.py for the most common
+#           headers, falling back to the grammar on unusual syntax
+#  -'pyparsing': the SIPBNF.py grammar only
+#
+def setparsingengine(engine):
+    global PARSINGENGINE
+    if engine not in PARSINGENGINES:
+        raise ValueError("unknown parsing engine {!r}, expecting one of {}".format(engine, ', '.join(PARSINGENGINES)))
+    PARSINGENGINE = engine
+    for cls in set(Header.SIPheaderclasses.values()):
+        cls._parse = staticmethod(parsefunction(cls.__name__))
+
 class HeaderMeta(type):
     def __new__(cls, name, bases, dikt):
         if name != 'Header':
             dikt['_args'] = getattr(SIPBNF, name + 'Args')
-            dikt['_parse'] = staticmethod(getattr(SIPBNF, name + 'Parse'))
+            dikt['_parse'] = staticmethod(parsefunction(name))
             dikt['_display'] = getattr(SIPBNF, name + 'Display')
             dikt['_multiple'] = getattr(SIPBNF, name + 'Multiple', False)
             dikt['_name'] = name.replace('_', '-')
             dikt['_indexname'] = dikt['_name'].lower()
+            inherited = set(Header.__slots__)
+            dikt.setdefault('__slots__', tuple(arg for arg in dikt['_args'] if arg not in inherited))
         return super(HeaderMeta, cls).__new__(cls, name, bases, dikt)
     def __init__(cls, name, bases, dikt):
         if name != 'Header':
@@ -153,15 +268,28 @@ class HeaderMeta(type):
         super(HeaderMeta, cls).__init__(name, bases, dikt)
 
 class Byteheader():
+    __slots__ = ('raw',)
     _indexname = None
     def __init__(self, raw):
         self.raw = raw
     def tobytes(self, headerform=None):
         return self.raw
+
+# Header line not parsed yet (lazy Headers)
+class Rawheader():
+    __slots__ = ('raw', '_indexname', 'strictparsing')
+    def __init__(self, raw, indexname, strictparsing):
+        self.raw = raw
+        self._indexname = indexname
+        self.strictparsing = strictparsing
+    def tobytes(self, headerform=None):
+        return self.raw
     
         
 # Base class of SIP headers
-class Header(metaclass=HeaderMeta):
+class Header(Utils.Owned, metaclass=HeaderMeta):
+    # _name and _indexname are class attributes of the subclasses
+    __slots__ = ('_name', '_indexname', '_originalname', 'value')
     SIPheaderclasses = {}
     SIPAliases = {}
 
@@ -171,18 +299,33 @@ class Header(metaclass=HeaderMeta):
         return Header.SIPAliases.get(name, name)
     
     def __init__(self, name=None, **kwargs):
+        setattr = object.__setattr__
         if not getattr(self, '_name', False):
             assert name
-            self._name = name
-            self._indexname = Header.index(name)
-        self._originalname = name or self._name
-        if getattr(self, '_args', False):
-            if not set(self._args) == set(kwargs.keys()):
-                raise ValueError("Expected parameters for {!r} constructor are {!r}, got {!r}".format(self._name, self._args, tuple(kwargs.keys())))
-        else:
-            self._args = kwargs.keys()
-        self.__dict__.update(kwargs)
-        log.debug("New header {}".format(self))
+            setattr(self, '_name', name)
+            setattr(self, '_indexname', Header.index(name))
+        setattr(self, '_originalname', name or self._name)
+        if not set(self._args) == set(kwargs.keys()):
+            raise ValueError("Expected parameters for {!r} constructor are {!r}, got {!r}".format(self._name, self._args, tuple(kwargs.keys())))
+        for key, value in kwargs.items():
+            setattr(self, key, value._adoptedby(self) if isinstance(value, Utils.Owned) else value)
+        log.debug("New header %s", self)
+
+    # Faster than Owned.copy: the values of a header are its _args
+    def copy(self):
+        cls = self.__class__
+        header = cls.__new__(cls)
+        setattr = object.__setattr__
+        if cls is Header:
+            setattr(header, '_name', self._name)
+            setattr(header, '_indexname', self._indexname)
+        setattr(header, '_originalname', self._originalname)
+        for name in self._args:
+            value = Utils.Owned.copyvalue(getattr(self, name))
+            if isinstance(value, Utils.Owned):
+                value = value._adoptedby(header)
+            setattr(header, name, value)
+        return header
 
     HEADER_RE = re.compile(b'^([a-zA-Z-.!%*_+`\'~]+)[ \t]*:(.*)$', flags=re.DOTALL)
     UNFOLDING_RE = re.compile(b'[ \t]*\r\n[ \t]+')
@@ -192,7 +335,7 @@ class Header(metaclass=HeaderMeta):
         # A line starting with a # becomes an unparsed Byte Header
         #
         if rawheader[0] == b'#'[0]:
-            log.debug("{!r} --> Byteheader".format(rawheader))
+            log.debug("%r --> Byteheader", rawheader)
             return [Byteheader(rawheader[1:])]
 
         #
@@ -243,7 +386,7 @@ class Header(metaclass=HeaderMeta):
                 raise
         else:
             headers = [Header(name=name, value=value)]
-        log.debug("{!r} --> {}".format(rawheader, headers))
+        log.debug("%r --> %s", rawheader, headers)
         return headers
         
     def __str__(self):
@@ -307,6 +450,7 @@ class Call_ID(Header):
 #    pass
 
 class CFT: # common constructor to Contact From To
+    __slots__ = ()
     def __init__(self, address, display=None, params={}, name=None):
         if not isinstance(address, SIPBNF.URI):
             address = SIPBNF.URI(address)
@@ -0,0 +1,324 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+#
+# Load generator, in the manner of SIPp: a Scenario (a call flow made of
+#  REGISTER, INVITE/ACK/BYE and OPTIONS steps) is run by a pool of
+#  simulated UAs at a target rate of calls per second
+#  -the UAs are AioUAs (Aio.py) running in one event loop, each bound to
+#   its own UDP port (port, port+1, ...) so that a single process drives
+#   thousands of them. A UA runs one call at a time: their number is
+#   the maximum number of concurrent calls
+#  -a call is started every 1/rate second on an idle UA. When all the
+#   UAs are busy, the start is delayed (the calls are not queued)
+#  -a call fails at its first step not ending with a 2xx response
+#  -the offers and answers are static SDPs (NullMedia): no RTP is sent
+# The result is a LoadStats with the number of calls started, succeeded
+#  and failed (by reason), the rate of calls and the histograms of the
+#  response times per method and of the call durations.
+#
+# The load can be run on the loopback interface against a Responder
+#  (stateless, see Responder.py) or a StandIn (the same canned responses
+#  sent by server transactions, over UDP or TCP):
+#
+#     async def main():
+#         responder = Responder(address='127.0.0.1', port=5060)
+#         generator = Load.LoadGenerator(Load.SCENARIOS['call'], proxy='127.0.0.1:5060', rate=50, concurrency=200, calls=1000)
+#         print(await generator.run())
+#         responder.stop()
+#     asyncio.run(main())
+#
+
+import time
+import random
+import asyncio
+import collections
+import logging
+log = logging.getLogger('Load')
+
+from . import Aio
+from . import Utils
+from .Responder import Responder, CannedResponses
+
+
+#
+# Media exchanging a static offer/answer (see Media.Media)
+#
+class NullMedia:
+    def __init__(self, *, ua, **kwargs):
+        self.ua = ua
+
+    def getlocaloffer(self):
+        sdplines = ['v=0',
+                    'o=- {0} {0} IN IP4 {1}'.format(random.randint(0,0xffffffff), self.ua.transport.localip),
+                    's=-',
+                    'c=IN IP4 {}'.format(self.ua.transport.localip),
+                    't=0 0',
+                    'm=audio 9 RTP/AVP 8',
+                    'a=rtpmap:8 PCMA/8000',
+                    'a=sendrecv',
+                    '']
+        return ('\r\n'.join(sdplines), 'application/sdp')
+
+    def setremoteoffer(self, sdp):
+        return True
+
+    def stop(self):
+        pass
+
+
+#
+# Call flow: list of steps, each one a name or a tuple (name, argument)
+#  -'register' (argument: expires, default 3600), 'unregister'
+#  -'invite' (argument: request URI, default the target of the generator)
+#  -'bye': ends the session established by the last 'invite'
+#  -'options'
+#  -'pause' (argument: duration in seconds)
+#
+class Scenario:
+    STEPS = ('register', 'unregister', 'invite', 'bye', 'options', 'pause')
+    def __init__(self, *steps, name=None):
+        self.steps = []
+        for item in steps:
+            step,argument = (item, None) if isinstance(item, str) else item
+            if step not in Scenario.STEPS:
+                raise ValueError('unknown scenario step {!r}. Expecting one of {}'.format(step, Scenario.STEPS))
+            if step == 'pause' and not isinstance(argument, (int, float)):
+                raise TypeError('expecting a duration for pause not {!r}'.format(argument))
+            self.steps.append((step, argument))
+        self.name = name or '-'.join(step for step,argument in self.steps)
+
+    def __str__(self):
+        return self.name
+
+SCENARIOS = dict(
+    register=Scenario('register', 'unregister', name='register'),
+    options=Scenario('options', name='options'),
+    call=Scenario('invite', ('pause', 1), 'bye', name='call'),
+    registeredcall=Scenario('register', 'invite', ('pause', 1), 'bye', 'unregister', name='registeredcall'),
+)
+
+
+#
+# AioUA keeping the final result of the last request it sent:
+#  (method, result, event, response time)
+#
+class LoadUA(Aio.AioUA):
+    async def sendmessage(self, message):
+        self.final = None
+        start = time.monotonic()
+        async for result,event in super().sendmessage(message):
+            if not result.provisional:
+                self.final = (message.METHOD, result, event, time.monotonic() - start)
+            yield result,event
+
+
+class LoadStats:
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.started = self.succeeded = self.failed = 0
+        self.failures = collections.Counter()
+        self.responsetimes = collections.defaultdict(Utils.Histogram)
+        self.calltimes = Utils.Histogram()
+        self.start = time.monotonic()
+        self.laststart = self.end = None
+
+    @property
+    def elapsed(self):
+        return (self.end or time.monotonic()) - self.start
+
+    # rate of the calls started (while starting calls) and of the calls
+    #  succeeded (until the end of the last call)
+    @property
+    def cps(self):
+        return self.started / max(1e-9, (self.laststart or time.monotonic()) - self.start)
+    @property
+    def successcps(self):
+        return self.succeeded / self.elapsed
+
+    def __str__(self):
+        lines = ["scenario {}: {} calls started in {:.2f}s ({:.1f} cps), {} succeeded ({:.1f} cps), {} failed".format(
+                     self.scenario, self.started, self.elapsed, self.cps, self.succeeded, self.successcps, self.failed)]
+        for reason,count in self.failures.most_common():
+            lines.append("  {:6d} {}".format(count, reason))
+        lines.append("  {:10} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format('(ms)', 'count', 'mean', 'p50', 'p90', 'p99', 'max'))
+        for name,histogram in sorted(self.responsetimes.items()) + [('call', self.calltimes)]:
+            if histogram.count:
+                summary = histogram.summary()
+                lines.append("  {:10} {:7d} {:9.2f} {:9.2f} {:9.2f} {:9.2f} {:9.2f}".format(name, summary['count'],
+                    *(summary[key] * 1e3 for key in ('mean', 'p50', 'p90', 'p99', 'max'))))
+        return '\n'.join(lines)
+
+
+#
+# Runs a scenario with concurrency UAs whose addresses of record are
+#  users.format(index) in the domain, for a number of calls or a duration
+#
+class LoadGenerator:
+    def __init__(self, scenario, *, proxy, domain=None, target=None, users='sip:user{:05d}@{}', password=None,
+                 rate=10., concurrency=100, calls=None, duration=None, address='127.0.0.1', port=20000, transaction={}):
+        if calls is None and duration is None:
+            raise ValueError('expecting a number of calls or a duration')
+        if rate <= 0:
+            raise ValueError('expecting a positive rate not {!r}'.format(rate))
+        self.scenario = scenario if isinstance(scenario, Scenario) else SCENARIOS[scenario]
+        self.proxy = proxy
+        host = proxy.split(':', 1)[0] if isinstance(proxy, str) else proxy[0]
+        self.domain = domain or host
+        self.target = target or 'sip:service@{}'.format(self.domain)
+        self.users = users
+        self.password = password
+        self.rate = rate
+        self.concurrency = concurrency
+        self.calls = calls
+        self.duration = duration
+        self.address = address
+        self.port = port
+        self.transaction = transaction
+        self.uas = []
+        self.stats = None
+
+    async def startuas(self):
+        for index in range(self.concurrency):
+            identity = dict(aor=self.users.format(index, self.domain), domain='sip:{}'.format(self.domain))
+            if self.password:
+                identity['password'] = self.password
+            ua = LoadUA(ua=dict(proxy=self.proxy), identity=identity,
+                        transport=dict(address=self.address, port=self.port + index, protocol='UDP'),
+                        transaction=self.transaction,
+                        registration=dict(autoreg=False, reregister=0),
+                        session=dict(media=NullMedia))
+            await ua.start()
+            self.uas.append(ua)
+        log.info("%s: %d UAs started", self, len(self.uas))
+
+    def __str__(self):
+        return "Load {}".format(self.scenario)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        await self.startuas()
+        idle = asyncio.Queue()
+        for ua in self.uas:
+            idle.put_nowait(ua)
+        self.stats = LoadStats(self.scenario)
+        calls = set()
+        end = None if self.duration is None else loop.time() + self.duration
+        nextstart = loop.time()
+        log.info("%s: %.1f cps, %d UAs", self, self.rate, len(self.uas))
+        try:
+            while self.calls is None or self.stats.started < self.calls:
+                delay = nextstart - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if end is not None and loop.time() >= end:
+                    break
+                ua = await idle.get()
+                # a late start is not caught up by a burst of calls
+                nextstart = max(nextstart, loop.time()) + 1 / self.rate
+                self.stats.started += 1
+                self.stats.laststart = time.monotonic()
+                call = loop.create_task(self.call(ua, idle))
+                calls.add(call)
+                call.add_done_callback(calls.discard)
+            if calls:
+                await asyncio.wait(calls)
+        finally:
+            self.stats.end = time.monotonic()
+            for call in calls:
+                call.cancel()
+            for ua in self.uas:
+                ua.destroy()
+            self.uas = []
+            # let the event loop close the sockets
+            await asyncio.sleep(0)
+        log.info("%s: %d calls succeeded, %d failed", self, self.stats.succeeded, self.stats.failed)
+        return self.stats
+
+    async def call(self, ua, idle):
+        start = time.monotonic()
+        session = None
+        try:
+            for step,argument in self.scenario.steps:
+                if step == 'pause':
+                    await asyncio.sleep(argument)
+                    continue
+                ua.final = None
+                if step == 'register':
+                    await ua.register(argument)
+                elif step == 'unregister':
+                    await ua.register(0)
+                elif step == 'options':
+                    await ua.options()
+                elif step == 'invite':
+                    session = await ua.invite(argument or self.target)
+                elif step == 'bye':
+                    if session is None:
+                        self.failure('BYE without session')
+                        return
+                    await ua.bye(session)
+                    session = None
+                if ua.final is None:
+                    self.failure('{} without final response'.format(step.upper()))
+                    return
+                method,result,event,elapsed = ua.final
+                self.stats.responsetimes[method].record(elapsed)
+                if result.error:
+                    self.failure('{} {} {}'.format(method, event.code, event.reason))
+                    return
+                if result.exception:
+                    self.failure('{} {}'.format(method, event))
+                    return
+            self.stats.succeeded += 1
+            self.stats.calltimes.record(time.monotonic() - start)
+        except Exception as e:
+            log.exception("%s: %s call failed", self, ua)
+            self.failure(str(e))
+        finally:
+            # a session left by a failed call is forgotten
+            if session is not None:
+                try:
+                    ua.popsession(session)
+                except KeyError:
+                    pass
+            idle.put_nowait(ua)
+
+    def failure(self, reason):
+        self.stats.failed += 1
+        self.stats.failures[reason] += 1
+
+
+#
+# Local server sending the responses of Responder.CannedResponses
+#  through server transactions
+#
+class StandIn(Aio.AioTransactionManager):
+    def __init__(self, *, address='127.0.0.1', port=5060, protocol='UDP', transaction={}):
+        super().__init__(dict(address=address, port=port, protocol=protocol), **transaction)
+        self.canned = CannedResponses(contact='sip:standin@{}:{}'.format(self.transport.localip, self.transport.localport))
+
+    def __str__(self):
+        return "StandIn {}".format(self.transport)
+
+    def REGISTER_handler(self, request):
+        return self.canned.respond(request)
+    INVITE_handler = BYE_handler = OPTIONS_handler = REGISTER_handler
+
+
+if __name__ == '__main__':
+    import sys
+    import snl
+    snl.loggers['UA'].setLevel('WARNING')
+    snl.loggers['Aio'].setLevel('WARNING')
+    snl.loggers['Dialog'].setLevel('WARNING')
+
+    scenario = sys.argv[1] if len(sys.argv) > 1 else 'registeredcall'
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 50.
+    calls = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    async def main():
+        responder = Responder(address='127.0.0.1', port=5060)
+        generator = LoadGenerator(scenario, proxy='127.0.0.1:5060', rate=rate, concurrency=100, calls=calls)
+        stats = await generator.run()
+        responder.stop()
+        print(stats)
+    asyncio.run(main())
@@ -11,13 +11,27 @@ from . import SIPBNF
 from . import Header
 from . import Tags
 from . import Security
+from . import Utils
 
 CRLF = b'\r\n'
 STATUS_LINE_RE = re.compile(b'SIP/2.0 (?P<code>[1-7]\d\d) (?P<reason>.+)\r\n', re.IGNORECASE)
 REQUEST_LINE_RE = re.compile(b'''(?P<method>[A-Za-z0-9.!%*_+`'~-]+) (?P<requesturi>[^ ]+) SIP/2.0\r\n''', re.IGNORECASE)
 CONTENT_LENGTH_RE = re.compile(b'\r\n(?:Content-length|l)[ \t]*:\s*(?P<length>\d+)\s*\r\n', re.IGNORECASE)
+CALL_ID_RE = re.compile(b'\r\n(?:Call-ID|i)[ \t]*:\s*(?P<callid>[^\s]+)', re.IGNORECASE)
 UNFOLDING_RE = re.compile(b'[ \t]*\r\n[ \t]+')
+LEADINGCRLF_RE = re.compile(b'(?:\r\n)*')
+CRLF_RE = re.compile(b'\r\n')
+ENDOFHEADERS_RE = re.compile(b'\r\n\r\n')
+
+#
+# Result of SIPMessage.predecode: offsets of the message parts in buf
+#  which can be a bytes, a bytearray or a memoryview and may contain more
+#  than one message. Only the bytes of the message are pickled.
+#
 class DecodeInfo:
+    # Parse header values only when they are accessed (see Header.Headers)
+    lazyheaders = True
+
     def __init__(self, buf):
         self.buf = buf
         self.status = None
@@ -28,25 +42,126 @@ class DecodeInfo:
 
     def __str__(self):
         if self.istart is not None and self.iend is not None:
-            displaybuf = bytes(self.buf[self.istart:self.istart+12] + b'...' +  self.buf[self.iend-12:self.iend])
+            displaybuf = bytes(self.buf[self.istart:self.istart+12]) + b'...' +  bytes(self.buf[self.iend-12:self.iend])
         else:
             displaybuf = b''
         return "decodeinfo: status={0.status} error={0.error} class={0.klass} start={0.istart} headers={0.iheaders} blank={0.iblank} body={0.ibody} end={0.iend} {1}".format(self, displaybuf)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        start = self.istart or 0
+        end = self.iend if self.iend is not None else len(self.buf)
+        state['buf'] = bytes(self.buf[start:end])
+        for index in ('istart', 'iheaders', 'iblank', 'ibody', 'iend'):
+            if state[index] is not None:
+                state[index] -= start
+        return state
+
+    # Copy holding only the bytes of the message, independent of buf
+    def detach(self):
+        decodeinfo = DecodeInfo.__new__(DecodeInfo)
+        decodeinfo.__dict__.update(self.__getstate__())
+        return decodeinfo
+
+    # Call-ID found in the raw headers, without parsing them
+    def callid(self):
+        m = CALL_ID_RE.search(self.buf, self.iheaders-2, self.iblank)
+        if m:
+            return bytes(m.group('callid'))
+
     def finish(self):
-        rawheaders=self.buf[self.iheaders:self.iblank]
-        body=self.buf[self.ibody:self.iend]
-        if isinstance(self.buf, bytearray):
-            del self.buf[:self.iend]
-        headers = Header.Headers(rawheaders, strictparsing=False)
+        buf = memoryview(self.buf)
+        rawheaders = buf[self.iheaders:self.iblank]
+        body = buf[self.ibody:self.iend]
         if self.klass == SIPResponse:
-            return SIPResponse(self.code, *headers.list(), reason=self.reason, body=body)
+            message = SIPResponse(self.code, reason=self.reason, body=body)
         elif self.klass == SIPRequest:
-            return SIPRequest(self.requesturi, *headers.list(), body=body, method=self.method)
+            message = SIPRequest(self.requesturi, body=body, method=self.method)
         else:
-            return self.klass(self.requesturi, *headers.list(), body=body, method=self.method)
+            message = self.klass(self.requesturi, body=body, method=self.method)
+        message._headers = Header.Headers(rawheaders, strictparsing=False, lazy=self.lazyheaders)
+        return message
+
+#
+# Incremental framing of the messages of a stream (TCP, TLS): the bytes
+#  received are given to feed() and next() returns the DecodeInfo of each
+#  message as soon as it is complete. The framer remembers where the search
+#  for the end of the headers stopped and, once the headers are decoded,
+#  where the body ends, so that the bytes are scanned once whatever the
+#  segmentation of the stream
+#  -next() returns None when more bytes are needed, a DecodeInfo of status
+#   'OK' for each message, or a DecodeInfo of status 'ERROR' when the
+#   stream is desynchronized (erroneous message or message without
+#   Content-Length)
+#  -the CRLF between messages (keepalives) are skipped and stored in crlf
+#  -the DecodeInfo returned reference buf: they must be finished or
+#   detached before the next call to feed()
+#
+class StreamFramer:
+    COMPACTSIZE = 65536
+    def __init__(self):
+        self.buf = bytearray()
+        self.offset = 0
+        self.scan = 0
+        self.startline = False
+        self.pending = None
+        self.crlf = b''
+
+    def feed(self, data):
+        # the consumed part is removed when no message is pending
+        if self.pending is None and (self.offset == len(self.buf) or self.offset > self.COMPACTSIZE):
+            del self.buf[:self.offset]
+            self.scan -= self.offset
+            self.offset = 0
+        self.buf += data
+
+    def next(self):
+        buf = self.buf
+        if self.pending is None:
+            start = LEADINGCRLF_RE.match(buf, self.offset).end()
+            if start > self.offset:
+                self.crlf += bytes(buf[self.offset:start])
+                self.offset = self.scan = start
+            if start == len(buf):
+                return None
+
+            endofheaders = ENDOFHEADERS_RE.search(buf, max(self.offset, self.scan - 3))
+            if not endofheaders:
+                # check the start line as soon as it is complete
+                if not self.startline and CRLF_RE.search(buf, max(self.offset, self.scan - 1)):
+                    decodeinfo = SIPMessage.predecode(buf, self.offset)
+                    if decodeinfo.status == 'ERROR':
+                        return decodeinfo
+                    self.startline = True
+                self.scan = len(buf)
+                return None
+
+            decodeinfo = SIPMessage.predecode(buf, self.offset)
+            if decodeinfo.status == 'ERROR' or not decodeinfo.framing:
+                decodeinfo.status = 'ERROR'
+                decodeinfo.error = decodeinfo.error or "missing Content-Length"
+                return decodeinfo
+            self.pending = decodeinfo
+
+        decodeinfo = self.pending
+        end = decodeinfo.ibody + decodeinfo.contentlength
+        if len(buf) < end:
+            return None
+        decodeinfo.status = 'OK'
+        decodeinfo.iend = end
+        self.pending = None
+        self.offset = self.scan = end
+        self.startline = False
+        return decodeinfo
+
+#
+# The serialization of a message is cached until the message or one of
+#  its parts is modified (see Utils.Owned)
+#
+class SIPMessage(Utils.Owned):
+    _bytes = None
+    UNTRACKED = frozenset(('fd', 'familycode', 'responsetotag'))
 
-class SIPMessage(object):
     @staticmethod
     def frombytes(buf):
         decodeinfo = SIPMessage.predecode(buf)
@@ -54,15 +169,17 @@ class SIPMessage(object):
             return decodeinfo.finish()
         return None
     
+    #
+    # Find the boundaries of the first message found in buf after offset
+    #  without copying it
+    #
     @staticmethod
-    def predecode(buf):
+    def predecode(buf, offset=0):
         log.debug("predecode(%r)", buf)
         decodeinfo = DecodeInfo(buf)
 
         # Ignore leading CRLF
-        offset = 0
-        while buf[offset:].startswith(CRLF):
-            offset += 2
+        offset = LEADINGCRLF_RE.match(buf, offset).end()
 
         if offset == len(buf):
             decodeinfo.status = 'EMPTY'
@@ -70,7 +187,7 @@ class SIPMessage(object):
             return decodeinfo
 
         # Is there at least one line?
-        if CRLF not in buf[offset:]:
+        if not CRLF_RE.search(buf, offset):
             decodeinfo.status = 'TRUNCATED'
             log.debug(decodeinfo)
             return decodeinfo
@@ -120,10 +237,10 @@ class SIPMessage(object):
             decodeinfo.klass = SIPRequest.SIPrequestclasses.get(decodeinfo.method.upper(), SIPRequest)
         
         # Separating Headers from Body
-        endofheaders = buf.find(CRLF+CRLF, decodeinfo.istart)
-        if endofheaders != -1:
+        endofheaders = ENDOFHEADERS_RE.search(buf, decodeinfo.istart)
+        if endofheaders:
             decodeinfo.status = 'OK'
-            decodeinfo.iblank = endofheaders+2
+            decodeinfo.iblank = endofheaders.start()+2
             decodeinfo.ibody = decodeinfo.iblank+2
             decodeinfo.iend = len(buf)
 
@@ -135,6 +252,7 @@ class SIPMessage(object):
                 if not b'\r' in contentheader and not b'\n' in contentheader:
                     contentlength = int(m.group('length'))
                     decodeinfo.framing = True
+                    decodeinfo.contentlength = contentlength
                     if contentlength > decodeinfo.iend - decodeinfo.ibody:
                         decodeinfo.status = 'TRUNCATED'
                     else:
@@ -153,13 +271,15 @@ class SIPMessage(object):
             self.body = b''
         elif isinstance(body, str):
             self.body = body.encode('utf8')
-        elif isinstance(body, (bytes,bytearray)):
+        elif isinstance(body, (bytes,bytearray,memoryview)):
             self.body = bytes(body)
         else:
             raise TypeError("body should be of type str or bytes")
         if contenttype:
             self.addheaders('c:{}'.format(contenttype))
 
+    # The Header instances given are copied: modifying them afterwards does
+    #  not modify the message
     def addheaders(self, *headers, replace=False, ifmissing=False):
         if replace and ifmissing:
             raise Exception("can't add headers with both replace=True and ifmissing=True")
@@ -299,13 +419,19 @@ class SIPMessage(object):
 
     def tolines(self, headerform='nominal'):
         ret = [self.startline()]
-        for header in self.headers():
-            ret.append(header.tobytes(headerform))
+        ret.extend(self._headers.tolines(headerform))
         ret.append(b'')
         return ret
 
     def tobytes(self, headerform='nominal'):
-        return b'\r\n'.join(self.tolines(headerform) + [self.body])
+        if headerform != 'nominal':
+            return b'\r\n'.join(self.tolines(headerform) + [self.body])
+        if self._bytes is None:
+            self._bytes = b'\r\n'.join(self.tolines() + [self.body])
+        return self._bytes
+
+    def _changed(self):
+        self._bytes = None
 
     def __bytes__(self):
         return self.tobytes()
@@ -322,9 +448,11 @@ class SIPMessage(object):
 class SIPResponse(SIPMessage):
     defaultreasons = {100:'Trying', 180:'Ringing', 181:'Call is Being Forwarded', 182:'Queued', 183:'Session in Progress', 199:'Early Dialog Terminated', 200:'OK', 202:'Accepted', 204:'No Notification', 300:'Multiple Choices', 301:'Moved Permanently', 302:'Moved Temporarily', 305:'Use Proxy', 380:'Alternative Service', 400:'Bad Request', 401:'Unauthorized', 402:'Payment Required', 403:'Forbidden', 404:'Not Found', 405:'Method Not Allowed', 406:'Not Acceptable', 407:'Proxy Authentication Required', 408:'Request Timeout', 409:'Conflict', 410:'Gone', 411:'Length Required', 412:'Conditional Request Failed', 413:'Request Entity Too Large', 414:'Request-URI Too Long', 415:'Unsupported Media Type', 416:'Unsupported URI Scheme', 417:'Unknown Resource-Priority', 420:'Bad Extension', 421:'Extension Required', 422:'Session Interval Too Small', 423:'Interval Too Brief', 424:'Bad Location Information', 428:'Use Identity Header', 429:'Provide Referrer Identity', 430:'Flow Failed', 433:'Anonymity Disallowed', 436:'Bad Identity-Info', 437:'Unsupported Certificate', 438:'Invalid Identity Header', 439:'First Hop Lacks Outbound Support', 470:'Consent Needed', 480:'Temporarily Unavailable', 481:'Call/Transaction Does Not Exist', 482:'Loop Detected.', 483:'Too Many Hops', 484:'Address Incomplete', 485:'Ambiguous', 486:'Busy Here', 487:'Request Terminated', 488:'Not Acceptable Here', 489:'Bad Event', 491:'Request Pending', 493:'Undecipherable', 494:'Security Agreement Required', 500:'Server Internal Error', 501:'Not Implemented', 502:'Bad Gateway', 503:'Service Unavailable', 504:'Server Time-out', 505:'Version Not Supported', 513:'Message Too Large', 580:'Precondition Failure', 600:'Busy Everywhere', 603:'Decline', 604:'Does Not Exist Anywhere', 606:'Not Acceptable'}
     def __init__(self, code, *headers, body=None, reason=None, **kw):
-        self.code = code
-        self.familycode = code // 100
-        self.reason = reason if reason is not None else self.defaultreasons.get(code, '')
+        # nothing is serialized yet: the attributes are set without notification
+        setattr = object.__setattr__
+        setattr(self, 'code', code)
+        setattr(self, 'familycode', code // 100)
+        setattr(self, 'reason', reason if reason is not None else self.defaultreasons.get(code, ''))
         log.debug("New response: code={} reason={}".format(self.code, self.reason))
         SIPMessage.__init__(self, *headers, body=body)
 
@@ -349,10 +477,11 @@ class SIPRequest(SIPMessage, metaclass=RequestMeta):
         log.debug("New request: method={} uri={}".format(method, uri))
         SIPMessage.__init__(self, *headers, body=body)
         self.uri = uri if isinstance(uri, SIPBNF.URI) else SIPBNF.URI(uri)
+        setattr = object.__setattr__
         if method is not None:
-            self.method = method
-            self.METHOD = method.upper()
-        self.responsetotag = None
+            setattr(self, 'method', method)
+            setattr(self, 'METHOD', method.upper())
+        setattr(self, 'responsetotag', None)
 
     def enforceheaders(self):
         self.addheaders(
@@ -360,7 +489,7 @@ class SIPRequest(SIPMessage, metaclass=RequestMeta):
                 protocol='???',
                 host='0.0.0.0',
                 port=None,
-                params={}
+                params=Utils.ParameterDict()
             ),
             Header.From(display=None, address=self.uri, params={}),
             Header.To(display=None, address=self.uri, params={}),
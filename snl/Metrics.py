@@ -0,0 +1,167 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+#
+# Registry of the metrics of the hot paths, disabled by default:
+#  -counters: messages sent and received per method and status code,
+#   retransmissions
+#  -histograms (Utils.Histogram, log-linear buckets): transaction
+#   durations per type, timer lag, parse time
+#  -gauges: computed by a collector when a snapshot is taken (depth of
+#   the queues of received messages of the Transports)
+# The instrumented code tests the module attribute enabled before
+#  calling count() or observe(), so that a disabled registry costs one
+#  attribute lookup:
+#
+#     if Metrics.enabled:
+#         Metrics.count('sip_requests_sent_total', message.METHOD)
+#
+# The values are the ones of the current process: the child processes of
+#  the Transports and ShardedTransports have their own registry.
+# snapshot() returns {name: {labels: value}}, labels being the tuple of
+#  the label values and the value of a histogram its summary().
+# serve() exposes the registry in the Prometheus text format on
+#  http://127.0.0.1:9100/metrics, the histograms as summaries:
+#
+#     Metrics.enable()
+#     server = Metrics.serve(9100)
+#     ...
+#     server.shutdown()
+#
+
+import threading
+import http.server
+import logging
+log = logging.getLogger('Metrics')
+
+from . import Message
+from . import Utils
+
+
+# name -> (type, help, label names)
+METRICS = {
+    'sip_requests_received_total':      ('counter', 'SIP requests received', ('method',)),
+    'sip_requests_sent_total':          ('counter', 'SIP requests sent', ('method',)),
+    'sip_responses_received_total':     ('counter', 'SIP responses received', ('method', 'code')),
+    'sip_responses_sent_total':         ('counter', 'SIP responses sent', ('method', 'code')),
+    'sip_retransmissions_total':        ('counter', 'requests and responses sent again by the transactions', ('cause',)),
+    'sip_requests_retransmitted_total': ('counter', 'retransmitted requests absorbed by the server transactions', ('method',)),
+    'sip_transaction_duration_seconds': ('histogram', 'time from the creation of a transaction to its Terminated state', ('type',)),
+    'sip_timer_lag_seconds':            ('histogram', 'delay between the target time of a timer of the Timer thread and its callback', ()),
+    'sip_parse_seconds':                ('histogram', 'time to build a message from its predecoded bytes', ()),
+    'sip_transport_queue_depth':        ('gauge', 'received messages waiting for Transport.recv()', ('transport',)),
+}
+# quantiles of the summaries: (quantile, key of Histogram.summary())
+QUANTILES = ((0.5, 'p50'), (0.9, 'p90'), (0.99, 'p99'))
+
+enabled = False
+lock = threading.Lock()
+values = {name: {} for name in METRICS}
+collectors = {}
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with lock:
+        for metric in values.values():
+            metric.clear()
+
+# a missing label value (a response without CSeq) is recorded as ''
+def count(name, *labels, value=1):
+    if None in labels:
+        labels = tuple('' if label is None else label for label in labels)
+    metric = values[name]
+    with lock:
+        metric[labels] = metric.get(labels, 0) + value
+
+def observe(name, value, *labels):
+    if None in labels:
+        labels = tuple('' if label is None else label for label in labels)
+    metric = values[name]
+    with lock:
+        histogram = metric.get(labels)
+        if histogram is None:
+            histogram = metric[labels] = Utils.Histogram()
+        histogram.record(value)
+
+# A gauge is computed by a function returning {labels: value}, called
+#  by snapshot()
+def collect(name, function):
+    if METRICS[name][0] != 'gauge':
+        log.logandraise(Exception("{} is not a gauge".format(name)))
+    collectors[name] = function
+
+# direction: 'sent' or 'received'
+def countmessage(direction, message):
+    if isinstance(message, Message.SIPResponse):
+        count('sip_responses_{}_total'.format(direction), message.CseqMETHOD, str(message.code))
+    elif isinstance(message, Message.SIPRequest):
+        count('sip_requests_{}_total'.format(direction), message.METHOD)
+
+def snapshot():
+    snapshot = {}
+    with lock:
+        for name,metric in values.items():
+            if METRICS[name][0] == 'histogram':
+                snapshot[name] = {labels: histogram.summary() for labels,histogram in metric.items()}
+            else:
+                snapshot[name] = dict(metric)
+    for name,function in collectors.items():
+        try:
+            snapshot[name] = dict(function())
+        except Exception as e:
+            log.warning("collector of %s failed: %s", name, e)
+    return snapshot
+
+def labelstring(names, labels, extra=()):
+    pairs = list(zip(names, labels)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name,value in pairs) + '}'
+
+def prometheus():
+    lines = []
+    current = snapshot()
+    for name,(kind,help,labelnames) in METRICS.items():
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, 'summary' if kind == 'histogram' else kind))
+        for labels,value in sorted(current.get(name, {}).items(), key=lambda item: tuple(map(str, item[0]))):
+            if kind == 'histogram':
+                for quantile,key in QUANTILES:
+                    lines.append('{}{} {!r}'.format(name, labelstring(labelnames, labels, [('quantile', quantile)]), value[key]))
+                lines.append('{}_sum{} {!r}'.format(name, labelstring(labelnames, labels), value['mean'] * value['count']))
+                lines.append('{}_count{} {}'.format(name, labelstring(labelnames, labels), value['count']))
+            else:
+                lines.append('{}{} {}'.format(name, labelstring(labelnames, labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("%s %s", self.address_string(), format % args)
+
+# HTTP server answering GET /metrics in a daemon thread, stopped with
+#  shutdown(). Bound to the loopback interface unless told otherwise
+def serve(port=9100, address='127.0.0.1'):
+    server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='Metrics', daemon=True).start()
+    log.info("metrics served on http://%s:%d/metrics", *server.server_address[:2])
+    return server
@@ -0,0 +1,165 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+#
+# Batched I/O on non-blocking UDP sockets: all the ready datagrams are
+#  received and the pending packets are sent with one system call using
+#  recvmmsg/sendmmsg (Linux) through ctypes, or with a loop of
+#  recvfrom/sendto when they are not available
+#
+
+import os
+import socket
+import select
+import ctypes
+import ctypes.util
+import errno
+import logging
+log = logging.getLogger('Transport')
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port', ctypes.c_uint16),
+                ('sin_addr', ctypes.c_ubyte * 4),
+                ('sin_zero', ctypes.c_ubyte * 8)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    recvmmsg = libc.recvmmsg
+    recvmmsg.argtypes = (ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p)
+    sendmmsg = libc.sendmmsg
+    sendmmsg.argtypes = (ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int)
+except Exception as e:
+    log.warning("cannot load recvmmsg/sendmmsg (%s). Batched UDP I/O uses recvfrom/sendto", e)
+    recvmmsg = sendmmsg = None
+
+
+#
+# Batch of count messages of at most size bytes
+#  -recv(sock) returns the list of (datagram, address) ready on sock, at
+#   most maxbatches * count of them so that a flood does not keep the
+#   caller from its other file descriptors (the selectors being level
+#   triggered, the rest is received at the next wakeup)
+#  -send(sock, packets) sends the list of (packet, address) and returns
+#   the list of (packet, address, error) that could not be sent
+#
+class Batch:
+    maxbatches = 4
+    def __init__(self, count=32, size=65536):
+        self.count = count
+        self.size = size
+        self.mmsg = bool(recvmmsg)
+        if not self.mmsg:
+            return
+        self.buffers = ctypes.create_string_buffer(count * size)
+        self.addresses = (sockaddr_in * count)()
+        self.iovecs = (iovec * count)()
+        self.headers = (mmsghdr * count)()
+        base = ctypes.addressof(self.buffers)
+        for i in range(count):
+            self.iovecs[i].iov_base = base + i * size
+            self.iovecs[i].iov_len = size
+            header = self.headers[i].msg_hdr
+            header.msg_name = ctypes.addressof(self.addresses[i])
+            header.msg_iov = ctypes.pointer(self.iovecs[i])
+            header.msg_iovlen = 1
+
+    def recv(self, sock):
+        if not self.mmsg:
+            return self.recvloop(sock)
+        datagrams = []
+        for batch in range(self.maxbatches):
+            for i in range(self.count):
+                self.headers[i].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+            n = recvmmsg(sock.fileno(), self.headers, self.count, socket.MSG_DONTWAIT, None)
+            if n < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return datagrams
+                raise OSError(err, errno.errorcode.get(err, str(err)))
+            base = ctypes.addressof(self.buffers)
+            for i in range(n):
+                address = self.addresses[i]
+                datagrams.append((ctypes.string_at(base + i * self.size, self.headers[i].msg_len),
+                                  (socket.inet_ntoa(bytes(address.sin_addr)), socket.ntohs(address.sin_port))))
+            if n < self.count:
+                break
+        return datagrams
+
+    def recvloop(self, sock):
+        datagrams = []
+        for i in range(self.maxbatches * self.count):
+            try:
+                datagrams.append(sock.recvfrom(self.size))
+            except (BlockingIOError, InterruptedError):
+                break
+        return datagrams
+
+    def send(self, sock, packets):
+        if not self.mmsg:
+            return self.sendloop(sock, packets)
+        failed = []
+        for start in range(0, len(packets), self.count):
+            chunk = packets[start:start+self.count]
+            # keep a reference on the buffers until they are sent
+            buffers = [ctypes.create_string_buffer(packet, len(packet)) for packet,address in chunk]
+            for i,(packet,(ip,port)) in enumerate(chunk):
+                address = self.addresses[i]
+                address.sin_family = socket.AF_INET
+                address.sin_port = socket.htons(port)
+                address.sin_addr[:] = socket.inet_aton(ip)
+                self.iovecs[i].iov_base = ctypes.addressof(buffers[i])
+                self.iovecs[i].iov_len = len(chunk[i][0])
+                self.headers[i].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+            sent = 0
+            while sent < len(chunk):
+                n = sendmmsg(sock.fileno(), ctypes.byref(self.headers[sent]), len(chunk) - sent, 0)
+                if n < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.EINTR:
+                        continue
+                    if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        select.select([], [sock], [])
+                        continue
+                    # the first message cannot be sent: skip it
+                    failed.append((*chunk[sent], os.strerror(err)))
+                    n = 1
+                sent += n
+        # restore the receive buffers
+        base = ctypes.addressof(self.buffers)
+        for i in range(self.count):
+            self.iovecs[i].iov_base = base + i * self.size
+            self.iovecs[i].iov_len = self.size
+        return failed
+
+    def sendloop(self, sock, packets):
+        failed = []
+        for packet,address in packets:
+            while True:
+                try:
+                    sock.sendto(packet, address)
+                except (BlockingIOError, InterruptedError):
+                    select.select([], [sock], [])
+                    continue
+                except Exception as e:
+                    failed.append((packet, address, str(e)))
+                break
+        return failed
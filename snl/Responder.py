@@ -0,0 +1,110 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+#
+# Stateless responder (RFC 3261 8.2.7): a local UAS stand-in answering
+#  each UDP request with a canned response built by SIPRequest.response,
+#  without any transaction
+#  -REGISTER: 200 with the Expires asked (3600 by default) and the
+#   Contact of the request
+#  -INVITE: 200 with a Contact and a static SDP answer. The 200 is not
+#   retransmitted: a retransmitted INVITE is answered again with the
+#   same To tag (derived from the request), the ACK matching both
+#  -OPTIONS, BYE: 200
+#  -ACK: ignored, as required for a stateless UAS
+#  -CANCEL: 481, the INVITE being already answered
+#  -other methods: 405
+# The codes can be changed with responses (dict method -> code).
+#  No provisional response is sent.
+# It runs on the batched UDP path of the ShardedTransport workers
+#  (recvmmsg/sendmmsg, see Mmsg), the headers of the requests being
+#  parsed only when accessed:
+#
+#   responder = Responder(address='127.0.0.1', port=5060)
+#   ...
+#   responder.stop()
+#
+# CannedResponses can also be used by a stateful UAS (see Load.StandIn)
+#
+
+import functools
+import logging
+log = logging.getLogger('Transport')
+
+from . import Header
+from . import Tags
+from .Shard import ShardedTransport
+
+
+class CannedResponses:
+    RESPONSES = dict(REGISTER=200, INVITE=200, OPTIONS=200, BYE=200, CANCEL=481)
+    ALLOW = 'Allow: ACK, {}'
+    def __init__(self, responses=None, contact=None):
+        self.responses = dict(CannedResponses.RESPONSES)
+        self.responses.update(responses or {})
+        self.allow = CannedResponses.ALLOW.format(', '.join(sorted(self.responses)))
+        self.contact = contact
+        self.sdps = {}
+
+    # handler of the ShardedTransport workers
+    def __call__(self, request, addr):
+        response = self.respond(request)
+        if response is None:
+            return ()
+        response.length = len(response.body)
+        return (response,)
+
+    def respond(self, request):
+        method = request.METHOD
+        if method == 'ACK':
+            return None
+        code = self.responses.get(method, 405)
+        if request.responsetotag is None:
+            request.responsetotag = Tags.hashed(request.callid, request.fromtag, request.branch)
+        if code == 405:
+            return request.response(405, self.allow)
+        if code // 100 != 2:
+            return request.response(code)
+        if method == 'REGISTER':
+            return self.register(request, code)
+        if method == 'INVITE':
+            return self.invite(request, code)
+        return request.response(code)
+
+    def register(self, request, code):
+        expires = request.header('Expires')
+        expires = expires.delta if expires else 3600
+        response = request.response(code, 'Expires: {}'.format(expires))
+        contact = request.header('Contact')
+        if contact and expires:
+            response.addheaders(Header.Contact(contact.address, params=dict(expires=expires)))
+        return response
+
+    # the Contact and the address of the SDP are the ones of the
+    #  Request-URI, unless a contact was given
+    def invite(self, request, code):
+        host = request.uri.host
+        contact = self.contact or 'sip:{}{}'.format(host, ':{}'.format(request.uri.port) if request.uri.port else '')
+        response = request.response(code, 'Contact: <{}>'.format(contact))
+        sdp = self.sdps.get(host)
+        if sdp is None:
+            sdp = self.sdps[host] = '\r\n'.join(('v=0',
+                                                 'o=- 0 0 IN IP4 {}'.format(host),
+                                                 's=-',
+                                                 'c=IN IP4 {}'.format(host),
+                                                 't=0 0',
+                                                 'm=audio 9 RTP/AVP 8',
+                                                 'a=rtpmap:8 PCMA/8000',
+                                                 'a=sendrecv',
+                                                 ''))
+        response.setbody(sdp, 'application/sdp')
+        return response
+
+
+class Responder(ShardedTransport):
+    def __init__(self, *, address='127.0.0.1', port=5060, workers=1, responses=None, contact=None, batch=True):
+        super().__init__(address=address, port=port, workers=workers, batch=batch, parseheaders=False,
+                         handler=functools.partial(CannedResponses, responses, contact))
+
+    def __str__(self):
+        return "Responder {}".format(ShardedTransport.__str__(self))
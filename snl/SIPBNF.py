@@ -1,8 +1,35 @@
 #coding: utf-8
 
+import threading
+import collections
 import pyparsing as pp
 
-from .Utils import quote,unquote,ParameterDict
+from .Utils import quote,unquote,ParameterDict,Owned
+
+
+#
+# pyparsing packrat memoization (global to pyparsing)
+# size is the bound of the memoization cache: None for an unbounded
+#  cache, 0 to disable packrat
+# Disabled by default: with pyparsing 3 the memoization costs more than
+#  it saves on these grammars (see benchmarks/bench_grammar.py)
+#
+PACKRATCACHESIZE = 0
+def setpackrat(size):
+    global PACKRATCACHESIZE
+    PACKRATCACHESIZE = size
+    if size == 0:
+        if hasattr(pp.ParserElement, 'disable_memoization'):
+            pp.ParserElement.disable_memoization()
+        else:
+            pp.ParserElement._packratEnabled = False
+            pp.ParserElement._parse = pp.ParserElement._parseNoCache
+    else:
+        try:
+            pp.ParserElement.enablePackrat(size, force=True)
+        except TypeError:
+            pp.ParserElement._packratEnabled = False
+            pp.ParserElement.enablePackrat(size)
 
 class ParseException(Exception):
     def __init__(self, name, value, pos):
@@ -312,32 +339,128 @@ hier_part = pp.Combine((net_path ^ abs_path) + pp.Optional(pp.Literal('?') + que
 scheme = pp.Word(pp.alphas, pp.alphanums+'+-.')
 absoluteURI = scheme('scheme') + pp.Suppress(pp.Literal(':')) + (hier_part ^ opaque_part)('opaque')
 Request_URI = SIP_SIPS_URI | absoluteURI
+RequestURI = Parser('Request-URI', Request_URI)
+
+#
+# Bounded LRU cache of URI parsing results keyed by the URI string
+# Values are immutable tuples of fields (see URI.fields) that are shared
+#  by all the URI instances built from the same string
+#
+class URICache:
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            fields = self._entries.get(key)
+            if fields is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return fields
+
+    def put(self, key, fields):
+        if not self.size:
+            return
+        with self._lock:
+            self._entries[key] = fields
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return dict(size=self.size, entries=len(self._entries), hits=self.hits, misses=self.misses)
+
+URICACHE = URICache(1024)
+
+# 0 disables the cache
+def seturicachesize(size):
+    URICACHE.resize(size)
+
+def uricachestats():
+    return URICACHE.stats()
 
-class URI:
+#
+# params and headers of URI instances are built from the shared fields
+#  on first access only (copy-on-write), then belong to the instance
+#
+class URI(Owned):
+    __slots__ = ('scheme', 'user', 'password', 'host', 'port', 'opaque', '_paramitems', '_headeritems', '_params', '_headers')
+    FIELDS = ('scheme', 'user', 'password', 'host', 'port', '_paramitems', '_headeritems', 'opaque')
     def __init__(self, value):
         if isinstance(value, str):
-            res = Parser('Request-URI', Request_URI).parse(value)
+            fields = URICACHE.get(value)
+            if fields is None:
+                fields = URI.fields(RequestURI.parse(value))
+                URICACHE.put(value, fields)
+        elif isinstance(value, tuple):
+            fields = value
         else:
-            res = value
-
-        self.scheme = res['scheme']
-        self.user = res.get('user')
-        self.password = res.get('password')
-        self.host = res.get('host')
-        self.port = res.get('port')
+            fields = URI.fields(value)
+        setattr = object.__setattr__
+        for name, field in zip(URI.FIELDS, fields):
+            setattr(self, name, field)
+        setattr(self, '_params', None)
+        setattr(self, '_headers', None)
+
+    # Materialized params and headers go back to immutable items
+    def copy(self):
+        paramitems = self._paramitems if self._params is None else tuple(self._params.items())
+        headeritems = self._headeritems if self._headers is None else tuple(self._headers.items())
+        return URI((self.scheme, self.user, self.password, self.host, self.port, paramitems, headeritems, self.opaque))
+
+    # Parsing result (dict or pp.ParseResults) --> tuple of fields
+    @staticmethod
+    def fields(res):
         params = res.get('params')
         if params:
             ks = list(params)[0::2]; vs = list(params)[1::2]
-            self.params = ParameterDict(zip(ks,vs))
+            params = tuple(ParameterDict(zip(ks,vs)).items())
         else:
-            self.params = ParameterDict()
+            params = ()
         headers = res.get('headers')
         if headers:
             ks = headers[0::2]; vs = headers[1::2]
-            self.headers = ParameterDict(zip(ks,vs))
+            headers = tuple(ParameterDict(zip(ks,vs)).items())
         else:
-            self.headers = ParameterDict()
-        self.opaque = res.get('opaque')
+            headers = ()
+        return (res['scheme'], res.get('user'), res.get('password'), res.get('host'), res.get('port'), params, headers, res.get('opaque'))
+
+    @property
+    def params(self):
+        if self._params is None:
+            self._params = ParameterDict(self._paramitems)
+        return self._params
+    @params.setter
+    def params(self, params):
+        self._params = params
+        self._changed()
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = ParameterDict(self._headeritems)
+        return self._headers
+    @headers.setter
+    def headers(self, headers):
+        self._headers = headers
+        self._changed()
+
     @property
     def userinfo(self):
         if self.user is None and self.password is None:
@@ -353,11 +476,13 @@ class URI:
             return '{}:{}'.format(self.host, self.port)
     @property
     def paramstr(self):
-        return ''.join((';{}{}'.format(k, '={}'.format(v) if v is not None else '') for k,v in self.params.items()))
+        params = self._paramitems if self._params is None else self._params.items()
+        return ''.join((';{}{}'.format(k, '={}'.format(v) if v is not None else '') for k,v in params))
     @property
     def headerstr(self):
-        if self.headers:
-            return '?' + '&'.join(('{}={}'.format(k, v) for k,v in self.headers.items()))
+        headers = self._headeritems if self._headers is None else tuple(self._headers.items())
+        if headers:
+            return '?' + '&'.join(('{}={}'.format(k, v) for k,v in headers))
         return ''
     def __str__(self):
         if self.scheme.startswith('sip'):
@@ -365,7 +490,7 @@ class URI:
         else:
             return "{}:{}".format(self.scheme, self.opaque)
     def __repr__(self):
-        return "URI({})".format(", ".join(["{}={!r}".format(k,v) for k,v in self.__dict__.items()]))
+        return "URI({})".format(", ".join(["{}={!r}".format(k, getattr(self, k)) for k in ('scheme', 'user', 'password', 'host', 'port', 'params', 'headers', 'opaque')]))
 
 
 #SIP-Version    =  "SIP" "/" 1*DIGIT "." 1*DIGIT
@@ -576,6 +701,8 @@ Authorization = Parser('(Proxy-)Authorization header', token + pp.Suppress(LWS)
 AuthorizationArgs = ('scheme', 'params')
 AuthorizationQuotedparams = ('username', 'realm', 'nonce', 'uri', 'response', 'cnonce', 'opaque')
 AuthorizationUnquotedparams = ('algorithm', 'qop', 'nc')
+LHEX32 = pp.Word(LHEX, exact=32)
+LHEX8 = pp.Word(LHEX, exact=8)
 def AuthorizationParse(headervalue):
     res = Authorization.parse(headervalue)
     scheme = res.pop(0)
@@ -591,7 +718,7 @@ def AuthorizationParse(headervalue):
                     v = v[1:-1]
                     if v: # Empty response are often seen but should not. BNF says: 32LHEX
                         try:
-                            v = pp.Word(LHEX, exact=32).parseString(v)[0]
+                            v = LHEX32.parseString(v)[0]
                         except:
                             raise Exception("32 lowercase hexa digits expected in response")
                 else:
@@ -600,7 +727,7 @@ def AuthorizationParse(headervalue):
                 if v.startswith('"') or v.endswith('"'):
                     raise Exception("unexpected quotes around {} value".format(k))
                 if k.lower() == 'nc':
-                    v = int(pp.Word(LHEX, exact=8).parseString(v)[0], 16)
+                    v = int(LHEX8.parseString(v)[0], 16)
         params[k] = v
     return dict(scheme=scheme, params=params)
 def AuthorizationDisplay(authorization):
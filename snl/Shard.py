@@ -0,0 +1,213 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+#
+# Receive sharding: the datagrams sent to one UDP address are received by
+#  N worker processes whose sockets are bound to it with SO_REUSEPORT, so
+#  that predecoding and parsing are spread over N cores
+#  -the kernel spreads the datagrams by source address, whereas all the
+#   messages of a Call-ID (its transactions and its dialog) have to be
+#   handled by the same worker: the owner of a message is the worker of
+#   index crc32(Call-ID) % N. A datagram received by another worker is
+#   forwarded to its owner, with its source address, over a unix datagram
+#   socket (and dropped if the owner is overloaded, as UDP would)
+#  -each worker calls handler() once to get its own callable, then calls
+#   it with each (message, source address) it owns, the headers of the
+#   message being parsed (or left to be parsed on access when
+#   parseheaders is False). The messages it returns (responses) are
+#   sent back to the source address
+#
+# Example: responding 200 to all OPTIONS on 4 cores
+#   def optionshandler():
+#       return lambda message, addr: [message.response(200)]
+#   transport = ShardedTransport(address='0.0.0.0', port=5060, workers=4, handler=optionshandler)
+#
+
+import socket
+import struct
+import signal
+import errno
+import zlib
+import multiprocessing
+import multiprocessing.connection
+import logging
+log = logging.getLogger('Transport')
+
+from . import Message
+from . import Mmsg
+
+
+# header of a forwarded datagram: source ip and port
+FORWARD = struct.Struct('!4sH')
+
+class ShardedTransport:
+    def __init__(self, *, address='127.0.0.1', port=5060, workers=4, handler, batch=True, parseheaders=True):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            log.logandraise(Exception("SO_REUSEPORT is not available on this system"))
+
+        # All the sockets are bound before starting the workers: with port 0
+        #  the next sockets are bound to the port chosen for the first one
+        sockets = []
+        for i in range(workers):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            try:
+                sock.bind((address, port))
+            except OSError as err:
+                sock.close()
+                for sock in sockets:
+                    sock.close()
+                log.logandraise(Exception("cannot bind UDP socket to {}:{}. errno={}".format(address, port, errno.errorcode[err.errno])))
+            port = sock.getsockname()[1]
+            sockets.append(sock)
+        self.localip = address
+        self.localport = port
+
+        inboxes = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for i in range(workers)]
+        self.workers = []
+        for index,sock in enumerate(sockets):
+            pipe,childpipe = multiprocessing.Pipe()
+            worker = ShardWorker(index, sock, inboxes, childpipe, handler, batch, parseheaders)
+            worker.start()
+            childpipe.close()
+            self.workers.append((worker, pipe))
+        for sock in sockets:
+            sock.close()
+        for reader,writer in inboxes:
+            reader.close()
+            writer.close()
+        log.info("%s: %d workers started", self, workers)
+
+    def __str__(self):
+        return "UDP/{}:{} x{}".format(self.localip, self.localport, len(self.workers))
+
+    # Counters of each worker: received, forwarded, dropped, handled, sent, errors
+    def stats(self):
+        return self.command('stats')
+
+    # Stop the workers and return their counters
+    def stop(self):
+        if not self.workers:
+            return []
+        stats = self.command('stop')
+        for worker,pipe in self.workers:
+            worker.join()
+            pipe.close()
+        self.workers = []
+        log.info("%s: stopped", self)
+        return stats
+
+    def command(self, *args):
+        for worker,pipe in self.workers:
+            pipe.send(args)
+        return [pipe.recv() for worker,pipe in self.workers]
+
+
+class ShardWorker(multiprocessing.Process):
+    def __init__(self, index, sock, inboxes, pipe, handler, batch, parseheaders):
+        multiprocessing.Process.__init__(self, daemon=True)
+        self.index = index
+        self.sock = sock
+        self.inboxes = inboxes
+        self.pipe = pipe
+        self.handler = handler
+        self.batch = batch
+        self.parseheaders = parseheaders
+
+    def owner(self, decodeinfo):
+        if len(self.inboxes) == 1:
+            return self.index
+        callid = decodeinfo.callid()
+        if callid is None:
+            return self.index
+        return zlib.crc32(callid) % len(self.inboxes)
+
+    def run(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # keep the reading end of the inbox of this worker and the
+        #  writing ends of the inboxes of the others
+        inbox = self.inboxes[self.index][0]
+        outboxes = []
+        for index,(reader,writer) in enumerate(self.inboxes):
+            if index != self.index:
+                reader.close()
+            writer.setblocking(False)
+            outboxes.append(writer)
+        inbox.setblocking(False)
+        sock = self.sock
+        batch = Mmsg.Batch() if self.batch else None
+        if batch:
+            sock.setblocking(False)
+        handle = self.handler()
+        stats = dict(received=0, forwarded=0, dropped=0, handled=0, sent=0, errors=0)
+
+        while True:
+            for obj in multiprocessing.connection.wait([self.pipe, sock, inbox]):
+                # Command comming from main process
+                if obj == self.pipe:
+                    command = self.pipe.recv()
+                    self.pipe.send(dict(stats))
+                    if command[0] == 'stop':
+                        sock.close()
+                        inbox.close()
+                        for outbox in outboxes:
+                            outbox.close()
+                        self.pipe.close()
+                        return
+                    continue
+
+                # Datagrams given by the kernel or forwarded by other workers
+                if obj == sock:
+                    datagrams = batch.recv(sock) if batch else [sock.recvfrom(65536)]
+                    stats['received'] += len(datagrams)
+                    forwarded = False
+                else:
+                    datagrams = []
+                    while True:
+                        try:
+                            data = inbox.recv(FORWARD.size + 65536)
+                        except BlockingIOError:
+                            break
+                        ip,port = FORWARD.unpack_from(data)
+                        datagrams.append((data[FORWARD.size:], (socket.inet_ntoa(ip), port)))
+                    forwarded = True
+
+                responses = []
+                for buf,remoteaddr in datagrams:
+                    decodeinfo = Message.SIPMessage.predecode(buf)
+                    # Discard inconsistent messages
+                    if decodeinfo.status != 'OK':
+                        continue
+                    if not forwarded:
+                        owner = self.owner(decodeinfo)
+                        if owner != self.index:
+                            try:
+                                outboxes[owner].send(FORWARD.pack(socket.inet_aton(remoteaddr[0]), remoteaddr[1]) + buf)
+                                stats['forwarded'] += 1
+                            except OSError:
+                                stats['dropped'] += 1
+                            continue
+                    message = decodeinfo.finish()
+                    if self.parseheaders:
+                        message.headers()
+                    stats['handled'] += 1
+                    try:
+                        for response in handle(message, remoteaddr) or ():
+                            responses.append((bytes(response), remoteaddr))
+                    except Exception as e:
+                        log.warning("worker %d: handler failed: %s", self.index, e)
+                        stats['errors'] += 1
+
+                if batch:
+                    failed = batch.send(sock, responses)
+                else:
+                    failed = []
+                    for packet,remoteaddr in responses:
+                        try:
+                            sock.sendto(packet, remoteaddr)
+                        except OSError as e:
+                            failed.append((packet, remoteaddr, str(e)))
+                for packet,remoteaddr,err in failed:
+                    log.warning("worker %d: cannot send to %s:%s: %s", self.index, *remoteaddr, err)
+                stats['sent'] += len(responses) - len(failed)
+                stats['errors'] += len(failed)
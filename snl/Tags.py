@@ -2,6 +2,7 @@
 
 import random
 import string
+import zlib
 
 _branchtemplate = 'z9hG4bK_{}'
 
@@ -24,6 +25,11 @@ def branch(tag=None):
 
 def fromto():
     return randomstr()
+
+# tag derived from the given strings: a stateless UAS gives the same
+#  To tag to the retransmissions of a request (RFC 3261 8.2.7)
+def hashed(*strings):
+    return '{}_{:08x}{}'.format(_prefix, zlib.crc32('\x00'.join(map(str, strings)).encode('utf-8')), _suffix)
     
 callnum = 0
 def callid():
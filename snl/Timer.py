@@ -1,94 +1,94 @@
 #! /usr/bin/python3
 # coding: utf-8
 
-import multiprocessing
 import threading
 import time
+import heapq
+import itertools
 import logging
-import signal
 log = logging.getLogger('Timer')
 
+from . import Metrics
+
 
 def arm(duration, cb, *args, **kwargs):
     return MANAGER.arm(duration, cb, *args, **kwargs)
 
 def unarm(timer):
     MANAGER.unarm(timer)
-    
+
+#
+# Timers are kept in a heap of [targettime, idt, cb, args, kwargs]
+#  entries ordered by target time, and indexed by idt in a dict
+#  -arm pushes an entry in the heap: O(log n)
+#  -unarm clears the callback of the entry that stays in the heap
+#   until its target time or the next compaction: O(1)
+#  -the thread pops all the expired entries at once and calls their
+#   callbacks outside of the lock
+#
 class TimerManager(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self, daemon=True)
-        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.heap = []
         self.timers = {}
-        self.pipe,childpipe = multiprocessing.Pipe()
-        self.process = multiprocessing.Process(target=TimerManager.processloop, args=(childpipe,), daemon=True)
-        self.process.start()
+        self.cancelled = 0
+        self.counter = itertools.count(1)
         self.start()
 
     def arm(self, duration, cb, *args, **kwargs):
-        timer = (cb, args, kwargs)
-        idt = id(timer)
-        with self.lock:
-            self.timers[idt] = timer
-        self.pipe.send((duration, idt))
+        idt = next(self.counter)
+        entry = [time.monotonic() + duration, idt, cb, args, kwargs]
+        with self.condition:
+            self.timers[idt] = entry
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                self.condition.notify()
         return idt
 
     def unarm(self, timer):
-        with self.lock:
-            self.timers.pop(timer, None)
+        with self.condition:
+            entry = self.timers.pop(timer, None)
+            if entry is None:
+                return
+            entry[2] = None
+            self.cancelled += 1
+            # drop the cancelled entries when they make up most of the heap
+            if self.cancelled > 1024 and self.cancelled * 2 > len(self.heap):
+                self.heap = [entry for entry in self.heap if entry[2] is not None]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+
+    def expired(self):
+        # Wait for the first timer and pop all the expired ones
+        with self.condition:
+            while True:
+                currenttime = time.monotonic()
+                if self.heap and self.heap[0][0] <= currenttime:
+                    break
+                self.condition.wait(self.heap[0][0] - currenttime if self.heap else None)
+            entries = []
+            while self.heap and self.heap[0][0] <= currenttime:
+                entry = heapq.heappop(self.heap)
+                if entry[2] is None:
+                    self.cancelled -= 1
+                else:
+                    del self.timers[entry[1]]
+                    entries.append(entry)
+            return entries
 
     # Thread loop
     def run(self):
         log.debug("Starting timer thread")
         while True:
-            try:
-                idt = self.pipe.recv()
-            except EOFError:
-                break
-            with self.lock:
-                cb,args,kwargs = self.timers.pop(idt, (None, None, None))
-            if cb:
+            for targettime,idt,cb,args,kwargs in self.expired():
+                if Metrics.enabled:
+                    Metrics.observe('sip_timer_lag_seconds', time.monotonic() - targettime)
                 try:
                     log.info("calling %s(*%s, **%s)", cb, args, kwargs)
                     cb(*args, **kwargs)
                 except Exception as e:
                     log.warning(e)
-        log.debug("Stoping timer thread")
 
-    # Process loop
-    @staticmethod
-    def processloop(pipe):
-        signal.signal(signal.SIGINT, signal.SIG_DFL)
-        sortedtimers = []
-        while True:
-            #
-            # Fire all passed timers
-            #
-            currenttime = time.monotonic()
-            while sortedtimers and currenttime >= sortedtimers[0][0]:
-                targettime,idt = sortedtimers.pop(0)
-                pipe.send(idt)
-
-            #
-            # Compute sleep duration
-            #  = time of first timer - current time
-            #
-            if not sortedtimers:
-                sleep = None
-            else:
-                sleep = sortedtimers[0][0] - currenttime
 
-            #
-            # Wait for a new timer demand coming from pipe (timeout=sleep)
-            #  if there is one:
-            #   convert duration to absolute time and place it in the sorted list of timers
-            #
-            if pipe.poll(sleep):
-                duration,idt = pipe.recv()
-                currenttime = time.monotonic()
-                targettime = currenttime + duration
-                sortedtimers.append((targettime, idt))
-                sortedtimers.sort()
-            
-        
 MANAGER = TimerManager()
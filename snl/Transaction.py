@@ -2,6 +2,10 @@
 # coding: utf-8
 
 import sys
+import re
+import time
+import collections
+import queue
 import threading
 import logging
 log = logging.getLogger('Transaction')
@@ -9,22 +13,35 @@ log = logging.getLogger('Transaction')
 from . import Message
 from . import Timer
 from . import Transport
+from .Transport import MultiplexedTransport
 from . import Dialog
 from . import Tags
+from . import Metrics
 
-class TransactionManager(threading.Thread):
+#
+# Transaction layer without any thread: matches the messages given to
+#  dispatch() with the live transactions and creates the server
+#  transactions. The transaction and ACKWaiter classes are attributes so
+#  that another engine (see Aio.py) can replace them. handle() runs the
+#  request handlers.
+#
+class TransactionLayer:
     modifybeforesend = None
     modifyafterreceive = None
     def __init__(self, transport, T1=None, T2=None, T4=None):
-        threading.Thread.__init__(self, daemon=True)
-        transportclass = transport.pop('klass', Transport)
-        self.transport = transportclass(**transport, errorcb=self.transporterror, sendcb=self.modifybeforesend, recvcb=self.modifyafterreceive)
+        self.transport = transport
         self.T1 = T1 or .5
         self.T2 = T2 or 4.
         self.T4 = T4 or 5.
         self.lock = threading.Lock()
-        self.transactions = []
-        self.ackwaiter = ACKWaiter(self.transport, self.T1, self.T2)
+        # Live transactions (dict transaction -> branch), indexed by
+        #  identifier and by branch (to find the transaction to CANCEL).
+        #  An index entry lists the transactions sharing the key, oldest
+        #  first. Terminated transactions remove themselves.
+        self.transactions = {}
+        self.transactionsbyid = {}
+        self.transactionsbybranch = {}
+        self.ackwaiter = self.ACKWaiter(self.transport, self.T1, self.T2)
         self.allow = set()
         for attr in dir(self):
             if attr.endswith('_handler'):
@@ -33,12 +50,6 @@ class TransactionManager(threading.Thread):
                     self.allow.add(method)
         if 'INVITE' in self.allow:
             self.allow.add('ACK')
-        self.start()
-
-    def destroy(self):
-        self.transport.stop()
-        del self.transport
-        # not enough to free self.transport since pending transactions and pending transaction timers have a reference on it...
 
     def transporterror(self, message, err):
         transaction = self.transactionmatching(message)
@@ -47,80 +58,128 @@ class TransactionManager(threading.Thread):
 
     def newservertransaction(self, request):
         if isinstance(request, Message.INVITE):
-            transactionclass = INVITEserverTransaction
+            transactionclass = self.INVITEserverTransaction
         else:
-            transactionclass = NonINVITEserverTransaction
+            transactionclass = self.NonINVITEserverTransaction
         transaction = transactionclass(request, self.transport, T1=self.T1, T2=self.T2, T4=self.T4)
-        with self.lock:
-            self.transactions.append(transaction)
+        self.addtransaction(transaction)
         return transaction
 
     def newclienttransaction(self, request, addr):
         if isinstance(request, Message.INVITE):
-            transactionclass = INVITEclientTransaction
+            transactionclass = self.INVITEclientTransaction
         else:
-            transactionclass = NonINVITEclientTransaction
+            transactionclass = self.NonINVITEclientTransaction
         if request.METHOD not in ('ACK', 'CANCEL') and self.allow:
             request.addheaders(
                 'Allow: {}'.format(', '.join(self.allow)),
                 ifmissing=True
             )
         transaction = transactionclass(request, self.transport, addr, T1=self.T1, T2=self.T2, T4=self.T4)
-        with self.lock:
-            self.transactions.append(transaction)
+        self.addtransaction(transaction)
         return transaction
 
+    def addtransaction(self, transaction):
+        transaction.terminatedcb = self.removetransaction
+        with self.lock:
+            if transaction.terminated:
+                return
+            branch = transaction.request.branch
+            self.transactions[transaction] = branch
+            self.transactionsbyid.setdefault(transaction.id, []).append(transaction)
+            self.transactionsbybranch.setdefault(branch, []).append(transaction)
+
+    def removetransaction(self, transaction):
+        with self.lock:
+            if transaction not in self.transactions:
+                return
+            branch = self.transactions.pop(transaction)
+            for index, key in ((self.transactionsbyid, transaction.id), (self.transactionsbybranch, branch)):
+                transactions = index[key]
+                transactions.remove(transaction)
+                if not transactions:
+                    del index[key]
+
     def transactionmatching(self, message, matchonlyonbranch=False):
+        # used to find a transaction to CANCEL
+        if matchonlyonbranch:
+            keys = ((self.transactionsbybranch, message.branch),)
+
+        # "normal" match algorithm: client transactions are identified
+        #  with ClientTransaction.identifier, server ones with ServerTransaction.identifier
+        else:
+            keys = ((self.transactionsbyid, ClientTransaction.identifier(message)),
+                    (self.transactionsbyid, ServerTransaction.identifier(message)))
+
         with self.lock:
-            for transaction in self.transactions:
-                # "normal" match algorithm
-                if not matchonlyonbranch and (transaction.id == transaction.identifier(message)):
-                    return transaction
+            for index, key in keys:
+                transactions = index.get(key)
+                if transactions:
+                    return transactions[0]
+
+    def dispatch(self, message):
+        transaction = self.transactionmatching(message)
+        if transaction:
+            transaction.eventmessage(message)
+            if isinstance(transaction, INVITEclientTransaction) \
+               and transaction.lastresponse \
+               and transaction.lastresponse.familycode == 2:
+                ack = transaction.request.ack(message)
+                addr = transaction.addr
+                newtransaction = self.ACKclientTransaction(ack, transaction.id, self.transport, addr, T1=self.T1, T2=self.T2, T4=self.T4)
+                self.addtransaction(newtransaction)
+        else:
+            if isinstance(message, Message.SIPResponse):
+                pass
+            elif message.METHOD != 'ACK':
+                transaction = self.newservertransaction(message)
+                handler = getattr(self, '{}_handler'.format(message.METHOD), None)
+                if handler is None:
+                    response = message.response(405)
+                    if self.allow:
+                        response.addheaders(
+                            'Allow: {}'.format(', '.join(self.allow))
+                        )
+                    transaction.eventmessage(response)
+                else:
+                    self.handle(Handler(self, handler, transaction, message))
+            else:
+                ack = message
+                self.ackwaiter.arrived(ack)
 
-                # used to find a transaction to CANCEL
-                if matchonlyonbranch and (transaction.request.branch == message.branch):
-                    return transaction
+    def handle(self, handler):
+        handler.run()
+
+class TransactionManager(TransactionLayer, threading.Thread):
+    # Retry-After of the 503 responses sent when the handlers are overloaded
+    retryafter = 1
+    def __init__(self, transport, T1=None, T2=None, T4=None, workers=16, queuesize=256):
+        threading.Thread.__init__(self, daemon=True)
+        transportclass = transport.pop('klass', MultiplexedTransport if 'multiplexer' in transport else Transport)
+        TransactionLayer.__init__(self, transportclass(**transport, errorcb=self.transporterror, sendcb=self.modifybeforesend, recvcb=self.modifyafterreceive), T1, T2, T4)
+        self.workers = WorkerPool(workers, queuesize)
+        self.start()
+
+    def destroy(self):
+        self.workers.stop()
+        self.transport.stop()
+        del self.transport
+        # not enough to free self.transport since pending transactions and pending transaction timers have a reference on it...
 
     def run(self):
         while True:
             message = self.transport.recv()
             if message is None: # happens when transport process is terminated
                 break
-            transaction = self.transactionmatching(message)
-            if transaction:
-                transaction.eventmessage(message)
-                if transaction.terminated:
-                    with self.lock:
-                        self.transactions.remove(transaction)
-                if isinstance(transaction, INVITEclientTransaction) \
-                   and transaction.lastresponse \
-                   and transaction.lastresponse.familycode == 2:
-                    ack = transaction.request.ack(message)
-                    addr = transaction.addr
-                    newtransaction = ACKclientTransaction(ack, transaction.id, self.transport, addr, T1=self.T1, T2=self.T2, T4=self.T4)
-                    with self.lock:
-                        self.transactions.append(newtransaction)
-            else:
-                if isinstance(message, Message.SIPResponse):
-                    pass
-                elif message.METHOD != 'ACK':
-                    transaction = self.newservertransaction(message)
-                    handler = getattr(self, '{}_handler'.format(message.METHOD), None)
-                    if handler is None:
-                        response = message.response(405)
-                        if self.allow:
-                            response.addheaders(
-                                'Allow: {}'.format(', '.join(self.allow))
-                            )
-                        transaction.eventmessage(response)
-                    else:
-                        Handler(self, handler, transaction, message)
-                else:
-                    ack = message
-                    self.ackwaiter.arrived(ack)
+            self.dispatch(message)
 
-            with self.lock:
-                self.transactions = [transaction for transaction in self.transactions if not transaction.terminated]
+    def handle(self, handler):
+        if not self.workers.submit(handler.run):
+            request = handler.request
+            log.warning("%s handlers overloaded, rejecting %s", self, request.METHOD)
+            response = request.response(503)
+            response.addheaders('Retry-After: {}'.format(self.retryafter))
+            handler.transaction.eventmessage(response)
 
 class ACKWaiter():
     # Class responsible for 200-OK (on INVITE) retransmission until ACK is received
@@ -133,6 +192,9 @@ class ACKWaiter():
         self.responses = {}
         self.lock = threading.Lock()
 
+    def arm(self, duration, cb, **kwargs):
+        return Timer.arm(duration, cb, **kwargs)
+
     def new(self, inviteokresponse):
         # A 200 OK response to an INVITE was just send
         #  * keep it indexed by dialog ID
@@ -142,7 +204,7 @@ class ACKWaiter():
             self.responses[dialogid] = inviteokresponse
 
         if self.initialcounter:
-            Timer.arm(self.T1, self.resend, **dict(dialogid=dialogid, delay=self.T1, counter=self.initialcounter))
+            self.arm(self.T1, self.resend, **dict(dialogid=dialogid, delay=self.T1, counter=self.initialcounter))
 
     def arrived(self, ack):
         # An ACK has arrived
@@ -167,30 +229,150 @@ class ACKWaiter():
 
         if response is not None:
             self.transport.send(response)
+            if Metrics.enabled:
+                Metrics.count('sip_retransmissions_total', 'ACKWaiter')
 
             delay *= 2
             counter -= 1
             if counter:
-                Timer.arm(delay, self.resend, **dict(dialogid=dialogid, delay=delay, counter=counter))
+                self.arm(delay, self.resend, **dict(dialogid=dialogid, delay=delay, counter=counter))
             else:
                 with self.lock:
                     self.responses.pop(dialogid, None)
 
 
-class Handler(threading.Thread):
+#
+# Threads running the request handlers
+# Jobs wait in a queue of at most queuesize jobs: submit() returns False
+#  when it is full. submit() is only called by the TransactionManager
+#  thread.
+# The handlers (and the functions they return to be called after the
+#  response is sent) are expected not to block: a handler waiting for
+#  another transaction or for the user holds a worker. When all the
+#  workers have been busy for stalltime seconds with jobs waiting, a
+#  spare thread is started (at most maxspares), that serves the queue
+#  until it stays idle for sparelife seconds. Handlers blocking for long
+#  should rather start their own thread.
+#
+class WorkerPool:
+    stalltime = .5
+    maxspares = 64
+    sparelife = 5.
+    def __init__(self, size, queuesize):
+        self.size = size
+        self.queuesize = queuesize
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        # thread ident -> start time of the job it runs
+        self.busy = {}
+        self.spares = self.sparesstarted = 0
+        self.checking = False
+        self.maxdepth = self.handled = self.rejected = 0
+        self.waittime = self.maxwaittime = 0.
+        self.latency = self.maxlatency = 0.
+        self.threads = [threading.Thread(target=self.work, daemon=True) for i in range(size)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, job):
+        depth = self.queue.qsize()
+        if depth >= self.queuesize:
+            with self.lock:
+                self.rejected += 1
+            return False
+        self.queue.put((time.monotonic(), job))
+        if depth + 1 > self.maxdepth:
+            self.maxdepth = depth + 1
+        if len(self.busy) >= self.size + self.spares:
+            with self.lock:
+                if not self.checking:
+                    self.checking = True
+                    Timer.arm(self.stalltime, self.checkstalled)
+        return True
+
+    # Timer callback: starts a spare thread if all the threads are stuck
+    #  in their job while others wait
+    def checkstalled(self):
+        with self.lock:
+            self.checking = False
+            if self.queue.empty() or len(self.busy) < self.size + self.spares:
+                return
+            delay = max(self.busy.values()) + self.stalltime - time.monotonic()
+            if delay <= 0:
+                if self.spares >= self.maxspares:
+                    log.warning("all %d request handler threads are blocked", self.size + self.spares)
+                    return
+                self.spares += 1
+                self.sparesstarted += 1
+                log.warning("request handlers blocked for %ss: spare thread #%d started", self.stalltime, self.spares)
+                threading.Thread(target=self.work, args=(True,), daemon=True).start()
+                delay = self.stalltime
+            self.checking = True
+        Timer.arm(delay, self.checkstalled)
+
+    def work(self, spare=False):
+        ident = threading.get_ident()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.sparelife if spare else None)
+            except queue.Empty:
+                break
+            if item is None:
+                break
+            submittime,job = item
+            starttime = time.monotonic()
+            with self.lock:
+                self.busy[ident] = starttime
+            try:
+                job()
+            except Exception:
+                log.exception("request handler failed")
+            endtime = time.monotonic()
+            with self.lock:
+                del self.busy[ident]
+                self.handled += 1
+                self.waittime += starttime - submittime
+                self.maxwaittime = max(self.maxwaittime, starttime - submittime)
+                self.latency += endtime - starttime
+                self.maxlatency = max(self.maxlatency, endtime - starttime)
+        if spare:
+            with self.lock:
+                self.spares -= 1
+
+    def stop(self):
+        for i in range(self.size + self.spares):
+            self.queue.put(None)
+
+    def stats(self):
+        with self.lock:
+            handled = self.handled or 1
+            return dict(workers=self.size,
+                        busy=len(self.busy),
+                        spares=self.spares,
+                        sparesstarted=self.sparesstarted,
+                        depth=self.queue.qsize(),
+                        maxdepth=self.maxdepth,
+                        handled=self.handled,
+                        rejected=self.rejected,
+                        meanwait=self.waittime / handled,
+                        maxwait=self.maxwaittime,
+                        meanlatency=self.latency / handled,
+                        maxlatency=self.maxlatency)
+
+class Handler():
     def __init__(self, transactionmanager, handler, transaction, request):
-        threading.Thread.__init__(self, daemon=True)
         self.transactionmanager = transactionmanager
         self.allow = transactionmanager.allow
         self.handler = handler
         self.transaction = transaction
         self.request = request
-        self.start()
     def run(self):
+        self.respond(self.handler(self.request))
+
+    def respond(self, ret):
         # handlers can return:
         #  a response alone or
         #  a response + some functions to be called after the response is sent
-        ret = self.handler(self.request)
         if isinstance(ret, (list, tuple)):
             response = ret[0]
             postfuncs = ret[1:]
@@ -221,7 +403,20 @@ class TransportError(Exception):
     def __str__(self):
         return "Transport error: {}".format(self.error)
 
+#
+# Name of the methods of the FSMs: <state>_<event> where event is the
+#  family of a response (1xx..6xx), Request, Error, Cancel or Timer<name>
+#
+FSM_METHOD_RE = re.compile('(?P<state>[A-Z][A-Za-z]*)_(?:(?P<family>[1-6])xx|(?P<event>Request|Error|Cancel)|Timer(?P<timer>[A-Za-z]+))$')
+
+# timers whose callback sends the request or the response again
+RETRANSMISSIONTIMERS = ('A', 'E', 'G')
+
 class Transaction:
+    # called with the transaction when it reaches the Terminated state
+    terminatedcb = None
+    # semaphore counting the events waiting for wait()
+    semaphoreclass = threading.Semaphore
     def __init__(self, request, transport, addr=None, *, T1, T2, T4):
         self.id = self.identifier(request)
         self.request = request
@@ -230,14 +425,41 @@ class Transaction:
         self.T1 = T1
         self.T2 = T2
         self.T4 = T4
+        self.fsm = self.__class__.__dict__.get('fsm') or self.compile()
         self.lock = threading.Lock()
         self.lastrequest = self.lastresponse = None
-        self.events = []
-        self.eventsemaphore = threading.Semaphore(0)
+        self.events = collections.deque()
+        self.eventsemaphore = self.semaphoreclass(0)
+        # EventSelectors waiting for the events of the transaction
+        self.selectors = []
+        self.created = time.monotonic() if Metrics.enabled else None
         log.info("%s <-- New transaction", self)
         with self.lock:
             self.init()
 
+    #
+    # Table of the FSM of the class, built once from its methods:
+    #  (state, family code) -> method for the responses
+    #  (state, 'Request'|'Error'|'Cancel') -> method
+    #  (state, 'Timer', name) -> method for the timers
+    #
+    @classmethod
+    def compile(cls):
+        fsm = {}
+        for attr in dir(cls):
+            m = FSM_METHOD_RE.match(attr)
+            if not m:
+                continue
+            if m.group('family'):
+                key = (m.group('state'), int(m.group('family')))
+            elif m.group('event'):
+                key = (m.group('state'), m.group('event'))
+            else:
+                key = (m.group('state'), 'Timer', m.group('timer'))
+            fsm[key] = getattr(cls, attr)
+        cls.fsm = fsm
+        return fsm
+
     def __str__(self):
         return "{}-{}".format("/".join(self.id), self.state)
 
@@ -245,11 +467,18 @@ class Transaction:
         return self.state == 'Terminated'
     terminated = property(_getterminated)
 
+    # The events are appended by the FSM (under the lock of the
+    #  transaction) and popped by the TU after acquiring the semaphore:
+    #  the deque needs no lock
     def wait(self):
         self.eventsemaphore.acquire()
-        with self.lock:
-            event = self.events.pop(0)
-        return event
+        return self.events.popleft()
+
+    def push(self, event):
+        self.events.append(event)
+        self.eventsemaphore.release()
+        for selector in self.selectors:
+            selector.notify(self)
 
     def armtimer(self, name, duration):
         Timer.arm(duration, self.eventtimer, name, self.state)
@@ -259,10 +488,10 @@ class Transaction:
             response = request = None
             if isinstance(message, Message.SIPResponse):
                 response = message
-                eventcb = getattr(self, '{}_{}xx'.format(self.state, response.familycode), None)
+                eventcb = self.fsm.get((self.state, response.familycode))
             else:
                 request = message
-                eventcb = getattr(self, '{}_Request'.format(self.state), None)
+                eventcb = self.fsm.get((self.state, 'Request'))
             if eventcb:
                 state = self.state
                 if response is not None:
@@ -271,44 +500,45 @@ class Transaction:
                 if request is not None:
                     log.info("%s <-- %s", self, request.METHOD)
                     self.lastrequest = request
-                informTU = eventcb()
+                    if Metrics.enabled and request.METHOD != 'ACK':
+                        Metrics.count('sip_requests_retransmitted_total', request.METHOD)
+                informTU = eventcb(self)
                 if informTU:
-                    self.events.append(message)
-                    self.eventsemaphore.release()
+                    self.push(message)
                 self.checkstate(state)
 
     def eventerror(self, err):
         with self.lock:
-            eventcb = getattr(self, '{}_Error'.format(self.state), None)
+            eventcb = self.fsm.get((self.state, 'Error'))
             if eventcb:
                 state = self.state
                 error = TransportError(err)
                 log.info("%s <-- %s", self, error)
-                informTU = eventcb()
+                informTU = eventcb(self)
                 if informTU:
-                    self.events.append(error)
-                    self.eventsemaphore.release()
+                    self.push(error)
                 self.checkstate(state)
 
     def eventtimer(self, name, state):
         with self.lock:
             if state == self.state:
-                eventcb = getattr(self, '{}_Timer{}'.format(self.state, name), None)
+                eventcb = self.fsm.get((state, 'Timer', name))
                 if eventcb:
                     log.info("%s <-- Timer %s", self, name)
-                    informTU = eventcb()
+                    if Metrics.enabled and name in RETRANSMISSIONTIMERS:
+                        Metrics.count('sip_retransmissions_total', 'Timer' + name)
+                    informTU = eventcb(self)
                     if informTU:
-                        self.events.append(Timeout(name))
-                        self.eventsemaphore.release()
+                        self.push(Timeout(name))
                     self.checkstate(state)
 
     def eventcancel(self):
         with self.lock:
-            eventcb = getattr(self, '{}_Cancel'.format(self.state), None)
+            eventcb = self.fsm.get((self.state, 'Cancel'))
             if eventcb:
                 state = self.state
                 log.info("%s <-- Cancel", self)
-                eventcb()
+                eventcb(self)
                 self.checkstate(state)
                 return self.lastresponse.totag
 
@@ -316,8 +546,93 @@ class Transaction:
         if self.state != previous:
             log.info(self)
             if self.state == 'Terminated':
-                self.events.append(None)
-                self.eventsemaphore.release()
+                if Metrics.enabled and self.created is not None:
+                    Metrics.observe('sip_transaction_duration_seconds', time.monotonic() - self.created, type(self).__name__)
+                self.push(None)
+                if self.terminatedcb:
+                    self.terminatedcb(self)
+
+#
+# Waiting for the events of many transactions at once, like a selector
+#  waits for many sockets: select() returns the list of (transaction,
+#  event) ready, at most maxevents, or an empty list on timeout. A
+#  transaction is unregistered once its last event (None) is returned.
+#  The events returned are not given to wait() anymore.
+#  For the threaded transactions only: the transactions of the event
+#  loop (Aio.py) are awaited with asyncio.wait()
+#
+# Example: sending n requests and handling the responses as they come
+#   selector = EventSelector(ua.newclienttransaction(request, addr) for request in requests)
+#   while selector.transactions:
+#       for transaction,event in selector.select():
+#           ...
+#
+class EventSelector:
+    def __init__(self, transactions=()):
+        self.transactions = {}
+        self.ready = collections.deque()
+        self.readyevent = threading.Event()
+        for transaction in transactions:
+            self.register(transaction)
+
+    def register(self, transaction):
+        with transaction.lock:
+            transaction.selectors.append(self)
+            self.transactions[transaction] = True
+            if transaction.events:
+                self.notify(transaction)
+
+    def unregister(self, transaction):
+        with transaction.lock:
+            if self.transactions.pop(transaction, None):
+                transaction.selectors.remove(self)
+
+    def close(self):
+        for transaction in list(self.transactions):
+            self.unregister(transaction)
+
+    # called by the transactions under their lock
+    def notify(self, transaction):
+        self.ready.append(transaction)
+        self.readyevent.set()
+
+    def select(self, timeout=None, maxevents=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        events = []
+        while True:
+            self.readyevent.clear()
+            while self.ready:
+                transaction = self.ready.popleft()
+                while transaction.eventsemaphore.acquire(blocking=False):
+                    event = transaction.events.popleft()
+                    events.append((transaction, event))
+                    if event is None:
+                        self.unregister(transaction)
+                    if len(events) == maxevents:
+                        # the other events of the transaction are for the next select()
+                        if transaction.events:
+                            self.ready.appendleft(transaction)
+                            self.readyevent.set()
+                        return events
+            if events:
+                return events
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return events
+            if not self.readyevent.wait(remaining):
+                return events
+
+#
+# Wait for the next event of any of the transactions: returns a tuple
+#  (transaction, event) or None on timeout
+#
+def waitany(transactions, timeout=None):
+    selector = EventSelector(transactions)
+    try:
+        events = selector.select(timeout, maxevents=1)
+    finally:
+        selector.close()
+    return events[0] if events else None
 
 class ClientTransaction(Transaction):
     @staticmethod
@@ -759,8 +1074,16 @@ class NonINVITEserverTransaction(ServerTransaction):
     Completed_Error = Proceeding_Error
 
 
+# classes instantiated by the transaction layer
+TransactionLayer.ACKWaiter = ACKWaiter
+TransactionLayer.INVITEclientTransaction = INVITEclientTransaction
+TransactionLayer.ACKclientTransaction = ACKclientTransaction
+TransactionLayer.NonINVITEclientTransaction = NonINVITEclientTransaction
+TransactionLayer.INVITEserverTransaction = INVITEserverTransaction
+TransactionLayer.NonINVITEserverTransaction = NonINVITEserverTransaction
+
+
 if __name__ == '__main__':
-    import time
     import snl
     snl.loggers['Transaction'].setLevel('INFO')
 
@@ -9,6 +9,7 @@ import multiprocessing.connection
 import time
 import socket
 import fcntl
+import termios
 import struct
 import logging
 import errno
@@ -18,13 +19,20 @@ import signal
 import ssl
 import os
 import itertools
-import functools
+import queue
+import select
+import collections
+import selectors
+import heapq
+from multiprocessing import shared_memory
 log = logging.getLogger('Transport')
 
 from . import Message
 from . import Header
 from . import Security
 from . import Utils
+from . import Mmsg
+from . import Metrics
 
 
 @atexit.register
@@ -32,6 +40,338 @@ def cleanup():
     for transport in Transport.instances:
         transport.stop()
 
+#
+# Candidate couples (port, address) for the local address of a transport
+#  built from parameters 'interface', 'address' and 'port', and the
+#  couple to use when all of them are already taken
+#
+def localcandidates(interface, address, port, protocol):
+    # build a list of candidate ip address from parameters 'interface' and 'address'
+    addresses = []
+    loopbackaddresses = []
+    interfaces,loopbackinterfaces = Utils.getinterfaces()
+    if interface and interface not in interfaces and interface not in loopbackinterfaces:
+        log.logandraise(Exception("unknown interface {}".format(interface)))
+    if interface in interfaces:
+        addresses = interfaces[interface]
+    elif interface in loopbackinterfaces:
+        addresses = loopbackinterfaces[interface]
+    else:
+        list(map(addresses.extend, interfaces.values()))
+    list(map(loopbackaddresses.extend, loopbackinterfaces.values()))
+
+    if isinstance(address, int):
+        if address < 0:
+            log.logandraise(Exception("bad integer value for address ({}). Expecting a positive value".format(address)))
+        elif address >= len(addresses):
+            log.logandraise(Exception("bad integer value for address ({}). Maximum value is {}".format(address, len(addresses)-1)))
+        else:
+            addresses = [addresses[address]]
+    elif address:
+        if not interface:
+            addresses += loopbackaddresses
+        if address not in addresses:
+            log.logandraise(Exception("unknown address {}. Possible values are {}".format(address, addresses)))
+        addresses = [address]
+    firstaddress = addresses[0]
+
+    # build a list of candidate ports
+    if port is not None and (not isinstance(port, int) or port<=0 or port>=65536):
+        log.logandraise(Exception("bad value for port ({})".format(port)))
+    if port is not None:
+        ports = [port]
+        firstport = port
+    else:
+        if protocol == 'TLS':
+            firstport = 5061
+        else:
+            firstport = 5060
+        ports = range(firstport,65536,2)
+
+    # candidate couples (port, address)
+    return itertools.product(ports,addresses), (firstport, firstaddress)
+
+#
+# Preparation of a message sent by a Transport or an AioTransport:
+#  transport parameter of the Contact, protocol and destination, Via of
+#  the requests, Content-Length on streams. The socket is chosen by
+#  transport.sendsocket(protocol, dstip, dstport, fd, isresponse), fd being
+#  the one a request was received on for its responses, which returns
+#  (fd, source port, Via port, protocol)
+# The message is logged with the logger of the module of the transport.
+#  Returns (fd, addr, packet) for the transport to write
+#
+def preparemessage(transport, log, message, addr=None):
+    issip = isinstance(message, Message.SIPMessage)
+    isrequest = isinstance(message, Message.SIPRequest)
+    isresponse = isinstance(message, Message.SIPResponse)
+
+    if issip and message.contacturi:
+        if transport.protocol == 'UDP+TCP':
+            message.contacturi.params.pop('transport', None)
+        else:
+            message.contacturi.params['transport'] = transport.protocol
+
+    fd = None
+    if (not issip) or isrequest:
+        assert addr
+        dstip,dstport = addr
+        protocol = transport.protocol
+        if protocol == 'UDP+TCP':
+            if transport.maxudp is not None and len(bytes(message)) > transport.maxudp:
+                protocol = 'TCP'
+            else:
+                protocol = 'UDP'
+    elif isresponse:
+        assert addr is None
+        via = message.header('via')
+        if via:
+            protocol = via.protocol
+            dstip = via.params.get('received', via.host)
+            dstport = via.params.get('rport', via.port)
+        else:
+            raise Exception("no address where to send response")
+        if transport.protocol == 'TLS':
+            protocol = 'TLS'
+        fd = message.fd
+    dstport = dstport or (5061 if protocol == 'TLS' else 5060)
+    if protocol in ('TCP', 'TLS') and issip:
+        message.length = len(message.body)
+
+    fd,srcport,viaport,protocol = transport.sendsocket(protocol, dstip, dstport, fd, isresponse)
+
+    via = message.header('via') if isrequest else None
+    if via:
+        via.protocol = protocol[:3]
+        if transport.behindnat:
+            via.host,via.port = transport.behindnat
+            via.params['rport']=None
+        else:
+            via.host = transport.localip
+            via.port = viaport if viaport!=5060 else None
+
+    if issip and transport.sendcb:
+        transport.sendcb(message)
+
+    log.info("%s:%d --%s-> %s:%d (fd=%d)\n%s", transport.localip, srcport, protocol, dstip, dstport, fd, message)
+    if Metrics.enabled and issip:
+        Metrics.countmessage('sent', message)
+    return fd, (dstip, dstport), bytes(message)
+
+#
+# Message channels between a Transport and its run loop, with the
+#  interface of multiprocessing.connection.Connection (send, recv, poll,
+#  fileno, close). Each direction is a Channel: items are stored by one
+#  end and a byte is written on a pipe to wake up the other end, which
+#  reads one byte per item.
+#  -mode 'thread': the run loop is a thread of the process and the items
+#   are passed as is in a deque (QueueChannel)
+#  -mode 'shm': the run loop is a child process and the items are packed
+#   in a ring buffer of shared memory (RingChannel), without pickling
+# (mode 'process' uses a multiprocessing.Pipe)
+#
+class Channel:
+    def __init__(self):
+        self.rfd,self.wfd = os.pipe()
+
+    def put(self, item):
+        self.store(item)
+        os.write(self.wfd, b'\0')
+
+    def get(self):
+        if not os.read(self.rfd, 1):
+            raise EOFError
+        return self.load()
+
+    def poll(self, timeout=0.):
+        return bool(select.select([self.rfd], [], [], timeout)[0])
+
+    # number of items waiting: one byte each in the pipe
+    def depth(self):
+        return struct.unpack('i', fcntl.ioctl(self.rfd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def closereader(self):
+        if self.rfd is not None:
+            os.close(self.rfd)
+            self.rfd = None
+
+    def closewriter(self):
+        if self.wfd is not None:
+            os.close(self.wfd)
+            self.wfd = None
+
+class QueueChannel(Channel):
+    def __init__(self, prepare=None):
+        super().__init__()
+        self.prepare = prepare
+        self.items = collections.deque()
+
+    def store(self, item):
+        if self.prepare:
+            item = self.prepare(item)
+        self.items.append(item)
+
+    def load(self):
+        return self.items.popleft()
+
+#
+# Single producer/single consumer ring of records (32 bits length +
+#  packed item). The reader publishes the position it has read up to in
+#  the first 8 bytes so that the writer knows the free space. The name
+#  of the shared memory is unlinked once the child process has been
+#  forked.
+# A writer finding the ring full sets the waiting byte that follows and
+#  blocks on a second pipe, on which the reader writes a byte once it
+#  has freed some space. The wait is bounded by FULLPOLL seconds (the
+#  flag and the position being read and written without a lock) and a
+#  warning is logged every FULLWARNING seconds while the ring stays full.
+#
+class RingChannel(Channel):
+    HEADER = 16
+    WAITING = 8
+    FULLPOLL = .1
+    FULLWARNING = 1.
+    def __init__(self, pack, unpack, size=1<<20):
+        super().__init__()
+        self.freedrfd,self.freedwfd = os.pipe()
+        os.set_blocking(self.freedrfd, False)
+        self.pack = pack
+        self.unpack = unpack
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER+size)
+        self.buf = self.shm.buf
+        struct.pack_into('!Q', self.buf, 0, 0)
+        self.buf[self.WAITING] = 0
+        self.head = self.tail = 0
+        # number of times the writer found the ring full
+        self.full = 0
+
+    def unlink(self):
+        self.shm.unlink()
+
+    def closereader(self):
+        super().closereader()
+        if self.freedwfd is not None:
+            os.close(self.freedwfd)
+            self.freedwfd = None
+
+    def closewriter(self):
+        super().closewriter()
+        if self.freedrfd is not None:
+            os.close(self.freedrfd)
+            self.freedrfd = None
+
+    def freespace(self):
+        return self.size - (self.tail - struct.unpack_from('!Q', self.buf, 0)[0])
+
+    def store(self, item):
+        parts = self.pack(item)
+        length = sum(len(part) for part in parts)
+        if 4 + length > self.size:
+            raise Exception("item of {} bytes does not fit in a ring of {} bytes".format(length, self.size))
+        if self.freespace() < 4 + length:
+            self.waitspace(4 + length)
+        self.write(struct.pack('!I', length))
+        for part in parts:
+            self.write(part)
+
+    def waitspace(self, length):
+        self.full += 1
+        start = warning = time.monotonic()
+        while True:
+            self.buf[self.WAITING] = 1
+            if self.freespace() >= length:
+                break
+            select.select([self.freedrfd], [], [], self.FULLPOLL)
+            try:
+                os.read(self.freedrfd, 4096)
+            except BlockingIOError:
+                pass
+            currenttime = time.monotonic()
+            if currenttime - warning >= self.FULLWARNING:
+                warning = currenttime
+                log.warning("ring of %d bytes full for %.1fs: the reader is stalled (%d times full)", self.size, currenttime - start, self.full)
+        self.buf[self.WAITING] = 0
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        position = self.HEADER + self.tail % self.size
+        first = min(len(data), self.HEADER + self.size - position)
+        self.buf[position:position+first] = data[:first]
+        if first < len(data):
+            self.buf[self.HEADER:self.HEADER+len(data)-first] = data[first:]
+        self.tail += len(data)
+
+    def load(self):
+        length, = struct.unpack('!I', self.read(4))
+        data = self.read(length)
+        struct.pack_into('!Q', self.buf, 0, self.head)
+        if self.buf[self.WAITING]:
+            self.buf[self.WAITING] = 0
+            os.write(self.freedwfd, b'\0')
+        return self.unpack(data)
+
+    def read(self, length):
+        position = self.HEADER + self.head % self.size
+        first = min(length, self.HEADER + self.size - position)
+        data = bytes(self.buf[position:position+first])
+        if first < length:
+            data += bytes(self.buf[self.HEADER:self.HEADER+length-first])
+        self.head += length
+        return data
+
+class ChannelConnection:
+    def __init__(self, inbox, outbox):
+        self.inbox = inbox
+        self.outbox = outbox
+
+    def send(self, item):
+        self.outbox.put(item)
+
+    def recv(self):
+        return self.inbox.get()
+
+    def poll(self, timeout=0.):
+        return self.inbox.poll(timeout)
+
+    def depth(self):
+        return self.inbox.depth()
+
+    def fileno(self):
+        return self.inbox.rfd
+
+    def close(self):
+        self.inbox.closereader()
+        self.outbox.closewriter()
+
+def ChannelPipe(tochild, toparent):
+    return ChannelConnection(toparent, tochild), ChannelConnection(tochild, toparent)
+
+# Received messages are detached from the receive buffer of the socket
+#  before being passed to another thread
+def detachincoming(item):
+    fd,protocol,addr,dstport,decodeinfo = item
+    return fd, protocol, addr, dstport, decodeinfo.detach()
+
+# Items packed in the rings: (fd, (ip, port), packet) sent by the parent
+def packoutgoing(item):
+    fd,(ip,port),packet = item
+    ip = ip.encode('ascii')
+    return struct.pack('!iHB', fd, port, len(ip)), ip, packet
+def unpackoutgoing(data):
+    fd,port,iplen = struct.unpack_from('!iHB', data)
+    return fd, (data[7:7+iplen].decode('ascii'), port), data[7+iplen:]
+
+# and (fd, protocol, (ip, port), dstport, decodeinfo) sent by the child:
+#  only the bytes of the message are passed, predecoded again by the parent
+def packincoming(item):
+    fd,protocol,(ip,port),dstport,decodeinfo = item
+    ip = ip.encode('ascii')
+    return struct.pack('!iHH3sB', fd, port, dstport, protocol.encode('ascii'), len(ip)), ip, memoryview(decodeinfo.buf)[decodeinfo.istart:decodeinfo.iend]
+def unpackincoming(data):
+    fd,port,dstport,protocol,iplen = struct.unpack_from('!iHH3sB', data)
+    return fd, protocol.decode('ascii'), (data[12:12+iplen].decode('ascii'), port), dstport, Message.SIPMessage.predecode(data, 12+iplen)
+
 class Transport(multiprocessing.Process):
     instances = weakref.WeakSet()
     def __new__(cls, *args, **kwargs):
@@ -39,66 +379,25 @@ class Transport(multiprocessing.Process):
         Transport.instances.add(instance)
         return instance
 
-    def __init__(self, *, interface=None, address=None, port=None, behindnat=None, protocol='UDP+TCP', maxudp=1300, cafile=None, hostname=None, errorcb=None, sendcb=None, recvcb=None):
+    def __init__(self, *, interface=None, address=None, port=None, behindnat=None, protocol='UDP+TCP', maxudp=1300, cafile=None, hostname=None, mode='process', batch=False, idletimeout=32, connecttimeout=2, keepalive=None, errorcb=None, sendcb=None, recvcb=None):
         self.started = False
 
         self.localip = self.localport = None
         self.protocol = protocol.upper()
         if not self.protocol in ('UDP', 'TCP', 'TLS', 'UDP+TCP'):
             log.logandraise(Exception("bad value for protocol transport: {}".format(protocol)))
-
-        # build a list of candidate ip address from parameters 'interface' and 'address'
-        addresses = []
-        loopbackaddresses = []
-        interfaces,loopbackinterfaces = Utils.getinterfaces()
-        if interface and interface not in interfaces and interface not in loopbackinterfaces:
-            log.logandraise(Exception("unknown interface {}".format(interface)))
-        if interface in interfaces:
-            addresses = interfaces[interface]
-        elif interface in loopbackinterfaces:
-            addresses = loopbackinterfaces[interface]
-        else:
-            list(map(addresses.extend, interfaces.values()))
-        list(map(loopbackaddresses.extend, loopbackinterfaces.values()))
-
-        if isinstance(address, int):
-            if address < 0:
-                log.logandraise(Exception("bad integer value for address ({}). Expecting a positive value".format(address)))
-            elif address >= len(addresses):
-                log.logandraise(Exception("bad integer value for address ({}). Maximum value is {}".format(address, len(addresses)-1)))
-            else:
-                addresses = [addresses[address]]
-        elif address:
-            if not interface:
-                addresses += loopbackaddresses
-            if address not in addresses:
-                log.logandraise(Exception("unknown address {}. Possible values are {}".format(address, addresses)))
-            addresses = [address]
-        firstaddress = addresses[0]
-
-        # build a list of candidate ports
-        if port is not None and (not isinstance(port, int) or port<=0 or port>=65536):
-            log.logandraise(Exception("bad value for port ({})".format(port)))
-        if port is not None:
-            ports = [port]
-            firstport = port
-        else:
-            if self.protocol == 'TLS':
-                firstport = 5061
-            else:
-                firstport = 5060
-            ports = range(firstport,65536,2)
-
-        # candidate couples (port, address)
-        candidates = itertools.product(ports,addresses)
+        self.mode = mode
+        if not self.mode in ('process', 'thread', 'shm'):
+            log.logandraise(Exception("bad value for transport mode: {}".format(mode)))
 
         # find the first candidate not already used by another transport instance
+        candidates,default = localcandidates(interface, address, port, self.protocol)
         reserved = [(t.localport, t.localip) for t in Transport.instances]
         for candidate in candidates:
             if candidate not in reserved:
                 break
         else:
-            candidate = (firstport, firstaddress)
+            candidate = default
         self.localport,self.localip = candidate
 
         if isinstance(behindnat, str):
@@ -110,17 +409,35 @@ class Transport(multiprocessing.Process):
         else:
             self.behindnat = behindnat
         self.maxudp = maxudp
+        self.batch = batch
+        self.idletimeout = idletimeout
+        self.connecttimeout = connecttimeout
+        self.keepalive = keepalive
         self.cafile = cafile
         self.hostname = hostname
         self.errorcb = errorcb
         self.sendcb = sendcb
         self.recvcb = recvcb
-        self.messagepipe,self.childmessagepipe = multiprocessing.Pipe()
+        if self.mode == 'thread':
+            self.messagepipe,self.childmessagepipe = ChannelPipe(QueueChannel(), QueueChannel(detachincoming))
+        elif self.mode == 'shm':
+            rings = (RingChannel(packoutgoing, unpackoutgoing), RingChannel(packincoming, unpackincoming))
+            self.messagepipe,self.childmessagepipe = ChannelPipe(*rings)
+        else:
+            self.messagepipe,self.childmessagepipe = multiprocessing.Pipe()
         self.commandpipe,self.childcommandpipe = multiprocessing.Pipe()
         multiprocessing.Process.__init__(self)
-        self.start()
-        self.started = True
-        log.info("%s starting process %d", self, self.pid)
+        if self.mode == 'thread':
+            threading.Thread(target=self.run, daemon=True).start()
+            self.started = True
+            log.info("%s starting thread", self)
+        else:
+            self.start()
+            self.started = True
+            log.info("%s starting process %d", self, self.pid)
+        if self.mode == 'shm':
+            for ring in rings:
+                ring.unlink()
 
         try:
             if 'UDP' in self.protocol:
@@ -142,113 +459,26 @@ class Transport(multiprocessing.Process):
         return "{}:{}".format(self.localip, self.localport)
 
     def send(self, message, addr=None):
-        issip = isinstance(message, Message.SIPMessage)
-        isrequest = isinstance(message, Message.SIPRequest)
-        isresponse = isinstance(message, Message.SIPResponse)
-
-        if issip and message.contacturi:
-            if self.protocol == 'UDP+TCP':
-                message.contacturi.params.pop('transport', None)
-            else:
-                message.contacturi.params['transport'] = self.protocol
-
-        if (not issip) or isrequest:
-            assert addr
-            dstip,dstport = addr
-            protocol = self.protocol
-            if protocol == 'TLS':
-                dstport = dstport or 5061
-                if issip:
-                    message.length = len(message.body)
-                fd,srcport = self.gettlssocket(dstip, dstport, cafile=self.cafile, hostname=self.hostname)
-                viaport = self.localport
-                addr = (dstip, dstport)
-            else:
-                dstport = dstport or 5060
-                if protocol == 'UDP+TCP':
-                    if self.maxudp is not None and len(bytes(message)) > self.maxudp:
-                        protocol = 'TCP'
-                    else:
-                        protocol = 'UDP'
-                if protocol == 'TCP' and issip:
-                    message.length = len(message.body)
-
-                if self.SAestablished:
-                    if protocol == 'TCP':
-                        fd = self.localsa['tcpc']
-                        srcport = self.localsa['portc']
-                        viaport = self.localsa['ports']
-                        addr = (dstip, dstport)
-                    elif protocol == 'UDP':
-                        fd = self.localsa['udpc']
-                        srcport = self.localsa['portc']
-                        viaport = self.localsa['ports']
-                        addr = (dstip, dstport)
-                    protocol = '{}/ESP'.format(protocol)
-                else:
-                    if protocol == 'TCP':
-                        fd,srcport = self.gettcpsocket(dstip, dstport)
-                        viaport = self.localport
-                        addr = (dstip, dstport)
-                    elif protocol == 'UDP':
-                        fd = self.mainudp
-                        viaport = srcport = self.localport
-                        addr = (dstip, dstport)
-
-            via = message.header('via') if issip else None
-            if via:
-                via.protocol = protocol[:3]
-                if self.behindnat:
-                     via.host,via.port = self.behindnat
-                     via.params['rport']=None
-                else:
-                    via.host = self.localip
-                    via.port = viaport if viaport!=5060 else None
-
-        elif isresponse:
-            assert addr is None
-            via = message.header('via')
-            if via:
-                protocol = via.protocol
-                dstip = via.params.get('received', via.host)
-                dstport = via.params.get('rport', via.port)
-            else:
-                raise Exception("no address where to send response")
-
-            if self.protocol == 'TLS':
-                dstport = dstport or 5061
-                message.length = len(message.body)
-                fd,srcport = self.gettlssocket(dstip, dstport, message.fd, self.cafile, self.hostname)
-                addr = (dstip, dstport)
-            else:
-                dstport = dstport or 5060
-                if protocol == 'TCP':
-                    message.length = len(message.body)
-
-                if self.SAestablished:
-                    if protocol == 'TCP':
-                        fd = self.localsa['tcps']
-                        srcport = self.localsa['ports']
-                        addr = (dstip, dstport)
-                    elif protocol == 'UDP':
-                        fd = self.localsa['udpc']
-                        srcport = self.localsa['portc']
-                        addr = (dstip, dstport)
-                    protocol = '{}/ESP'.format(protocol)
-                else:
-                    if protocol == 'TCP':
-                        fd,srcport = self.gettcpsocket(dstip, dstport, message.fd)
-                        addr = (dstip, dstport)
-                    elif protocol == 'UDP':
-                        fd = self.mainudp
-                        srcport = self.localport
-                        addr = (dstip, dstport)
-
-        if issip and self.sendcb:
-            self.sendcb(message)
-
-        log.info("%s:%d --%s-> %s:%d (fd=%d)\n%s", self.localip, srcport, protocol, dstip, dstport, fd, message)
-        self.messagepipe.send((fd, addr, bytes(message)))
+        self.messagepipe.send(preparemessage(self, log, message, addr))
+
+    # Socket where to send a message (see preparemessage)
+    def sendsocket(self, protocol, dstip, dstport, fd, isresponse):
+        if protocol == 'TLS':
+            fd,srcport = self.gettlssocket(dstip, dstport, fd, self.cafile, self.hostname)
+            return fd, srcport, self.localport, protocol
+        if self.SAestablished:
+            if protocol == 'TCP' and isresponse:
+                return self.localsa['tcps'], self.localsa['ports'], self.localsa['ports'], 'TCP/ESP'
+            if protocol == 'TCP':
+                return self.localsa['tcpc'], self.localsa['portc'], self.localsa['ports'], 'TCP/ESP'
+            if protocol == 'UDP':
+                return self.localsa['udpc'], self.localsa['portc'], self.localsa['ports'], 'UDP/ESP'
+        elif protocol == 'TCP':
+            fd,srcport = self.gettcpsocket(dstip, dstport, fd)
+            return fd, srcport, self.localport, protocol
+        elif protocol == 'UDP':
+            return self.mainudp, self.localport, self.localport, protocol
+        raise Exception("cannot send over {}".format(protocol))
 
     def recv(self, timeout=None):
         if self.messagepipe.poll(timeout):
@@ -256,7 +486,12 @@ class Transport(multiprocessing.Process):
                 fd,protocol,(srcip,srcport),dstport,decodeinfo = self.messagepipe.recv()
             except:
                 return None
-            message = decodeinfo.finish()
+            if Metrics.enabled:
+                start = time.perf_counter()
+                message = decodeinfo.finish()
+                Metrics.observe('sip_parse_seconds', time.perf_counter() - start)
+            else:
+                message = decodeinfo.finish()
             if message is not None:
                 message.fd = fd
                 if isinstance(message, Message.SIPRequest):
@@ -271,11 +506,20 @@ class Transport(multiprocessing.Process):
                 if self.SAestablished and srcip == self.remotesa['ip'] and dstport in (self.localsa['portc'],self.localsa['ports']):
                     esp = '/ESP'
                 log.info("%s:%s <-%s%s-- %s:%d (fd=%d)\n%s", self.localip, dstport, protocol, esp, srcip, srcport, fd, message)
+                if Metrics.enabled:
+                    Metrics.countmessage('received', message)
                 if self.recvcb:
                     self.recvcb(message)
                 return message
         return None
 
+    # number of received messages waiting for recv(), None when unknown
+    #  (the multiprocessing.Pipe of the process mode counts no items)
+    def queuedepth(self):
+        if not self.started or self.mode == 'process':
+            return None
+        return self.messagepipe.depth()
+
     def command(self, *args):
         self.commandpipe.send(args)
         ret = self.commandpipe.recv()
@@ -287,6 +531,13 @@ class Transport(multiprocessing.Process):
         if self.started:
             self.commandpipe.send(('stop',))
             self.started = False
+            if self.mode == 'thread':
+                # the run loop closes its own ends
+                self.commandpipe.recv()
+                self.messagepipe.close()
+                self.commandpipe.close()
+                log.info("%s thread stopped", self)
+                return
             self.messagepipe.close()
             self.childmessagepipe.close()
             self.commandpipe.close()
@@ -309,6 +560,18 @@ class Transport(multiprocessing.Process):
         fd,localport = self.command('gettls', (remoteip, remoteport), fd, cafile, hostname)
         return fd, localport
 
+    # Number and total duration (s) of the full and resumed TLS handshakes
+    def tlsstats(self):
+        return self.command('tlsstats')
+
+    # Open count connections to addr before sending anything to it: the
+    #  first one is used, the others are spares replacing it if it fails
+    def prewarm(self, addr, count):
+        if self.protocol == 'TLS':
+            self.command('prewarm', (addr[0], addr[1] or 5061), count, (self.cafile, self.hostname))
+        elif 'TCP' in self.protocol:
+            self.command('prewarm', (addr[0], addr[1] or 5060), count, None)
+
     def prepareSA(self, remoteip):
         self.localsa = self.command('sa', 'prepare', self.localip, remoteip)
         sa = {k:self.localsa[k] for k in ('spis', 'spic', 'ports', 'portc')}
@@ -323,40 +586,60 @@ class Transport(multiprocessing.Process):
         self.SAestablished = False
         self.localsa = self.remotesa = None
 
+    #
+    # Run loop: the sockets stay registered in one selector for their whole
+    #  life and are indexed by fd to send packets. Service sockets are kept
+    #  in a ConnectionPool
+    #
     def run(self):
-        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if self.mode != 'thread':
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
         localaddr = (self.localip, self.localport)
         tcplisteningsocket = None
         mainudp = None
-        servicesockets = []
         sa = None
+        udpsockets = {}
+        # batched I/O on the main UDP socket (see Mmsg)
+        batch = Mmsg.Batch() if self.batch else None
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.childcommandpipe, selectors.EVENT_READ, 'command')
+        selector.register(self.childmessagepipe, selectors.EVENT_READ, 'message')
+        pool = ConnectionPool(self, selector, self.idletimeout, self.connecttimeout, self.keepalive)
+
+        def addudp(sock):
+            udpsockets[sock.fileno()] = sock
+            selector.register(sock.fileno(), selectors.EVENT_READ, 'udp')
+
+        def removeudp(sock):
+            fd = sock.fileno()
+            if udpsockets.get(fd) is sock:
+                del udpsockets[fd]
+                selector.unregister(fd)
+                pool.closed.add(fd)
+
         while True:
-            sockets = [self.childcommandpipe, self.childmessagepipe] + servicesockets
-            if tcplisteningsocket:
-                sockets.append(tcplisteningsocket)
-            udpsockets = []
-            if mainudp:
-                udpsockets.append(mainudp)
-            if sa:
-                udpsockets.extend((sa.local.udpc, sa.local.udps))
-            sockets.extend(udpsockets)
-            for obj in multiprocessing.connection.wait(sockets, timeout=1):
+            pool.closed.clear()
+            for key,events in selector.select(pool.timeout()):
+                kind = key.data
+
                 # Command comming from main process
-                if obj == self.childcommandpipe:
+                if kind == 'command':
                     command = self.childcommandpipe.recv()
                     if command[0] == 'stop':
                         if tcplisteningsocket:
                             tcplisteningsocket.close()
                         if mainudp:
                             mainudp.close()
-                        for sock in servicesockets:
-                            sock.close()
+                        pool.closeall()
                         if sa:
                             sa.terminate()
+                        selector.close()
                         self.childcommandpipe.send(None)
-                        self.messagepipe.close()
+                        if self.mode != 'thread':
+                            self.messagepipe.close()
+                            self.commandpipe.close()
                         self.childmessagepipe.close()
-                        self.commandpipe.close()
                         self.childcommandpipe.close()
                         return
                     elif command[0] == 'main':
@@ -367,6 +650,7 @@ class Transport(multiprocessing.Process):
                                 tcplisteningsocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
                                 tcplisteningsocket.bind(localaddr)
                                 tcplisteningsocket.listen()
+                                selector.register(tcplisteningsocket, selectors.EVENT_READ, 'listen')
                                 self.childcommandpipe.send(tcplisteningsocket.fileno())
                             except Exception as err:
                                 extra = ". errno={}".format(errno.errorcode[err.errno]) if isinstance(err, OSError) else ''
@@ -378,74 +662,42 @@ class Transport(multiprocessing.Process):
                             try:
                                 mainudp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                                 mainudp.bind(localaddr)
+                                if batch:
+                                    mainudp.setblocking(False)
+                                addudp(mainudp)
                                 self.childcommandpipe.send(mainudp.fileno())
                             except Exception as err:
                                 extra = ". errno={}".format(errno.errorcode[err.errno]) if isinstance(err, OSError) else ''
                                 exc = Exception("cannot bind UDP socket to {}:{}{}".format(*localaddr, extra))
                                 self.childcommandpipe.send(exc)
                     elif command[0] in ('gettcp', 'gettls'):
-                        tls = bool(command[0] == 'gettls')
                         remoteaddr,fd = command[1:3]
-                        if tls:
-                            cafile,hostname = command[3:]
-
-                        # try to reuse existing socket
-                        found = None
-                        for sock in servicesockets:
-                            if fd==sock.fileno():
-                                found = sock
-                                break
-                        if not found:
-                            for sock in servicesockets:
-                                if remoteaddr==sock.getpeername():
-                                    found = sock
-                                    break
-                        if found:
-                            sock = found
-
-                        # connect a new socket
-                        else:
-                            if tls:
-                                try:
-                                    sslcontext = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH, cafile=cafile)
-                                except OSError as err:
-                                    exc = Exception("bad CA file {} {}".format(cafile, err))
-                                    self.childcommandpipe.send(exc)
-                                    continue
-                            try:
-                                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                                if tls:
-                                    sslcontext.check_hostname = bool(hostname)
-                                    sock = sslcontext.wrap_socket(sock, server_hostname=hostname)
-                                    sock = ServiceSSLSocket(sock)
-                                else:
-                                    sock = ServiceSocket(sock)
-                                sock.settimeout(2)
-                                sock.bind((self.localip, 0))
-                                sock.connect(remoteaddr)
-                                servicesockets.append(sock)
-                            except socket.timeout as err:
-                                exc = Exception("cannot connect to {}:{}. timeout".format(*remoteaddr))
-                                self.childcommandpipe.send(exc)
-                                continue
-                            except ssl.CertificateError as err:
-                                exc = Exception("cannot connect to {}:{}. {}".format(*remoteaddr, err))
-                                self.childcommandpipe.send(exc)
-                                continue
-                            except ssl.SSLError as err:
-                                exc = Exception("cannot connect to {}:{}. {} {}".format(*remoteaddr, err.library, err.reason))
-                                self.childcommandpipe.send(exc)
-                                continue
-                            except OSError as err:
-                                exc = Exception("cannot connect to {}:{}. errno={}".format(*remoteaddr, errno.errorcode[err.errno]))
-                                self.childcommandpipe.send(exc)
-                                continue
-                            log.info("%s: new service socket fd=%s", self, sock.fileno())
-                        self.childcommandpipe.send((sock.fileno(), sock.getsockname()[1]))
+                        tls = command[3:] if command[0] == 'gettls' else None
+                        # reuse an existing socket or start connecting a new one
+                        try:
+                            sock = pool.get(remoteaddr, fd, tls)
+                        except Exception as exc:
+                            self.childcommandpipe.send(exc)
+                            continue
+                        self.childcommandpipe.send((sock.fileno(), sock.localport))
+                    elif command[0] == 'tlsstats':
+                        self.childcommandpipe.send(dict(pool.tlsstats))
+                    elif command[0] == 'prewarm':
+                        remoteaddr,count,tls = command[1:]
+                        try:
+                            pool.prewarm(remoteaddr, count, tls)
+                            self.childcommandpipe.send(None)
+                        except Exception as exc:
+                            self.childcommandpipe.send(exc)
                     elif command[0] == 'sa':
                         try:
                             if command[1] == 'prepare':
+                                if sa:
+                                    removeudp(sa.local.udpc)
+                                    removeudp(sa.local.udps)
                                 sa = Security.SA(*command[2:])
+                                addudp(sa.local.udpc)
+                                addudp(sa.local.udps)
                                 local  = dict(ip=sa.local.ip,
                                               spis=sa.local.spis,  spic=sa.local.spic,
                                               ports=sa.local.ports,  portc=sa.local.portc,
@@ -458,6 +710,8 @@ class Transport(multiprocessing.Process):
                                 remote = dict(ip=sa.remote.ip, spis=sa.remote.spis, spic=sa.remote.spic, ports=sa.remote.ports, portc=sa.remote.portc)
                                 self.childcommandpipe.send(remote)
                             elif command[1] == 'terminate':
+                                removeudp(sa.local.udpc)
+                                removeudp(sa.local.udps)
                                 sa.terminate()
                                 sa = None
                                 self.childcommandpipe.send(None)
@@ -467,100 +721,604 @@ class Transport(multiprocessing.Process):
                         self.childcommandpipe.send(Exception("unknown command %s", ' '.join(command)))
 
                 # Message comming from main process --> send to remote address
-                elif obj == self.childmessagepipe:
-                    fd,remoteaddr,packet = self.childmessagepipe.recv()
-                    send = None
-                    for sock in udpsockets:
-                        if sock.fileno()==fd:
-                            send = functools.partial(sock.sendto, packet, remoteaddr)
-                            break
-                    if not send:
-                        for sock in servicesockets:
-                            if sock.fileno()==fd:
-                                send = functools.partial(sock.sendall, packet)
-                                break
-                    if send:
-                        try:
-                            send()
-                        except Exception as e:
-                            dispatcherror(*localaddr, *remoteaddr, str(e), packet)
-                    else:
-                        dispatcherror(*localaddr, *remoteaddr, "cannot find socket with fd={}".format(fd), packet)
-
-                # Incomming TCP connection --> new socket (will be read in the next result of poll)
-                elif obj == tcplisteningsocket:
-                    sock = ServiceSocket(obj.accept()[0])
-                    servicesockets.append(sock)
+                elif kind == 'message':
+                    items = [self.childmessagepipe.recv()]
+                    # with batched I/O, all the pending packets are taken and
+                    #  the ones for the main UDP socket are sent together
+                    udppackets = []
+                    if batch:
+                        while len(items) < batch.count and self.childmessagepipe.poll():
+                            items.append(self.childmessagepipe.recv())
+                    for fd,remoteaddr,packet in items:
+                        if batch and mainudp and fd==mainudp.fileno():
+                            udppackets.append((packet, remoteaddr))
+                            continue
+                        if fd in udpsockets:
+                            try:
+                                udpsockets[fd].sendto(packet, remoteaddr)
+                            except Exception as e:
+                                dispatcherror(*localaddr, *remoteaddr, str(e), packet)
+                        else:
+                            pool.send(fd, remoteaddr, packet)
+                    if udppackets:
+                        for packet,remoteaddr,err in batch.send(mainudp, udppackets):
+                            dispatcherror(*localaddr, *remoteaddr, err, packet)
+
+                # Incomming TCP connection --> new socket
+                elif kind == 'listen':
+                    sock = pool.add(ServiceSocket(tcplisteningsocket.accept()[0]))
                     log.info("%s: new service socket fd=%s", self, sock.fileno())
 
                 # Incomming packet --> decode and send to main process
-                elif obj in udpsockets:
-                    buf,remoteaddr = obj.recvfrom(65536)
-                    decodeinfo = Message.SIPMessage.predecode(buf)
-                    # Discard inconsistent messages
-                    if decodeinfo.status != 'OK':
+                elif kind == 'udp':
+                    if key.fd in pool.closed:
                         continue
+                    sock = udpsockets[key.fd]
+                    if batch and sock is mainudp:
+                        datagrams = batch.recv(sock)
+                    else:
+                        datagrams = [sock.recvfrom(65536)]
+                    for buf,remoteaddr in datagrams:
+                        decodeinfo = Message.SIPMessage.predecode(buf)
+                        # Discard inconsistent messages
+                        if decodeinfo.status != 'OK':
+                            continue
 
-                    self.childmessagepipe.send((obj.fileno(),'UDP',remoteaddr,obj.getsockname()[1],decodeinfo))
+                        self.childmessagepipe.send((key.fd,'UDP',remoteaddr,sock.getsockname()[1],decodeinfo))
 
-                elif obj in servicesockets:
-                    buf = obj.recv(65536)
-                    protocol = 'TCP'
-                    if isinstance(obj, ssl.SSLSocket):
-                        protocol = 'TLS'
-                    while True:
-                        decodeinfo = Message.SIPMessage.predecode(buf)
+                elif kind == 'service':
+                    if key.fd in pool.closed:
+                        continue
+                    sock = pool.ready(key.fd, events)
+                    if not sock:
+                        continue
+                    try:
+                        sock.recv(65536)
+                    except OSError as err:
+                        log.info("%s: service socket fd=%s: %s", self, key.fd, err)
+                        sock.close()
+                    for decodeinfo in sock.framing():
+                        self.childmessagepipe.send((key.fd,sock.protocol,sock.peer,sock.localport,decodeinfo))
+                    if sock.fileno() == -1:
+                        log.info("%s: service socket fd=%s closed after EOF", self, key.fd)
+                        pool.remove(key.fd)
+                    elif sock.pinged:
+                        sock.pinged = False
+                        pool.send(key.fd, sock.peer, ConnectionPool.PONG)
+
+            pool.expire()
+
+# Gauge of the depths of the queues of the Transports
+def queuedepths():
+    depths = {}
+    for transport in list(Transport.instances):
+        depth = transport.queuedepth()
+        if depth is not None:
+            depths[(str(transport),)] = depth
+    return depths
+Metrics.collect('sip_transport_queue_depth', queuedepths)
+
+#
+# Transport shared by many UAs: a single Transport process whose
+#  messages are demultiplexed by a thread to the MultiplexedTransport of
+#  each UA
+#  -responses go to the UA that sent the request, found in an index of
+#   the branches of the requests sent
+#  -retransmissions of requests, ACKs and CANCELs go to the UA that
+#   received the request, found in an index of the branches of the
+#   requests received
+#  -other requests go to the UA whose contact parameter 'mux' is found in
+#   the Request-URI, or else whose contact user is the Request-URI or To
+#   user
+# Two indexes are needed since UAs of the same Multiplexer may send
+#  requests to each other. Requests for no UA are answered with a 404.
+#  The branches are kept in the indexes for BRANCHLIFETIME seconds, more
+#  than the lifetime of a transaction (64*T1 + T4 with the default timers)
+#
+class Multiplexer(threading.Thread):
+    BRANCHLIFETIME = 64
+    def __init__(self, **transport):
+        threading.Thread.__init__(self, daemon=True)
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.channelsbyuser = {}
+        self.sentbranches = {}
+        self.receivedbranches = {}
+        self.counter = itertools.count(1)
+        self.transport = Transport(**transport, errorcb=self.transporterror, sendcb=self.modifybeforesend, recvcb=None)
+        self.localip = self.transport.localip
+        self.localport = self.transport.localport
+        self.start()
 
-                        # Erroneous messages or messages missing a Content-Length make the stream desynchronized
-                        if decodeinfo.status == 'ERROR' or (decodeinfo.status == 'OK' and not decodeinfo.framing):
-                            obj.close()
-                            break
+    def __str__(self):
+        return str(self.transport)
+
+    def attach(self, channel):
+        with self.lock:
+            channel.id = str(next(self.counter))
+            self.channels[channel.id] = channel
+
+    def detach(self, channel):
+        with self.lock:
+            self.channels.pop(channel.id, None)
+            for user,channels in list(self.channelsbyuser.items()):
+                if channel in channels:
+                    channels.remove(channel)
+                    if not channels:
+                        del self.channelsbyuser[user]
+
+    def adduser(self, channel, user):
+        with self.lock:
+            self.channelsbyuser.setdefault(user, []).append(channel)
+
+    def addbranch(self, branches, branch, channel):
+        currenttime = time.monotonic()
+        with self.lock:
+            branches.pop(branch, None)
+            branches[branch] = (channel, currenttime)
+            # forget the branches older than BRANCHLIFETIME (oldest first)
+            for oldbranch in list(branches):
+                if currenttime - branches[oldbranch][1] < self.BRANCHLIFETIME:
+                    break
+                del branches[oldbranch]
+
+    # A message being sent (sending=True) is routed to the UA sending it:
+    #  a request with the index of the requests sent, a response with the
+    #  index of the requests received
+    def route(self, message, sending=False):
+        isresponse = isinstance(message, Message.SIPResponse)
+        with self.lock:
+            branches = self.sentbranches if isresponse != sending else self.receivedbranches
+            entry = branches.get(message.branch)
+            if entry:
+                return entry[0]
+            if isresponse or sending:
+                return None
+            channel = self.channels.get(message.uri.params.get('mux'))
+            if channel:
+                return channel
+            for uri in (message.uri, message.toaddr):
+                channels = self.channelsbyuser.get(uri.user if uri else None)
+                if channels:
+                    return channels[0]
+
+    def send(self, message, addr, channel):
+        if isinstance(message, Message.SIPRequest) and message.branch:
+            self.addbranch(self.sentbranches, message.branch, channel)
+        self.transport.send(message, addr)
+
+    def modifybeforesend(self, message):
+        channel = self.route(message, sending=True)
+        if channel and channel.sendcb:
+            channel.sendcb(message)
+
+    def transporterror(self, message, err):
+        channel = self.route(message, sending=True)
+        if channel and channel.errorcb:
+            channel.errorcb(message, err)
 
-                        # Flush buffer if filled with CRLF
-                        if decodeinfo.status == 'EMPTY':
-                            if buf:
-                                log.info("%s:%s <-%s-- %s:%d (fd=%d)\n%s", obj.localip, protocol, obj.getsockname()[1], *remoteaddr, obj.fileno(), bytes(buf))
-                                del buf[:]
-                            break
+    def run(self):
+        while True:
+            message = self.transport.recv()
+            if message is None: # happens when transport process is terminated
+                break
+            channel = self.route(message)
+            if channel:
+                if isinstance(message, Message.SIPRequest) and message.branch:
+                    self.addbranch(self.receivedbranches, message.branch, channel)
+                channel.deliver(message)
+            elif isinstance(message, Message.SIPRequest) and message.METHOD != 'ACK':
+                log.info("%s no UA for %s", self, message.uri)
+                self.transport.send(message.response(404))
 
-                        # Ignore inconsistent messages, wait for the rest of the buffer
-                        if decodeinfo.status != 'OK':
-                            break
+    def stop(self):
+        self.transport.stop()
+
+#
+# Transport of a UA sharing the Transport of a Multiplexer, given to the
+#  TransactionManager with transport=dict(multiplexer=...)
+#
+class MultiplexedTransport:
+    def __init__(self, *, multiplexer, errorcb=None, sendcb=None, recvcb=None, **kwargs):
+        if kwargs:
+            log.logandraise(Exception("unexpected parameters for a multiplexed transport {}. They belong to the multiplexer".format(kwargs)))
+        self.multiplexer = multiplexer
+        self.localip = multiplexer.localip
+        self.localport = multiplexer.localport
+        self.protocol = multiplexer.transport.protocol
+        self.errorcb = errorcb
+        self.sendcb = sendcb
+        self.recvcb = recvcb
+        self.messages = queue.SimpleQueue()
+        multiplexer.attach(self)
+
+    def __str__(self):
+        return "{}#{}".format(self.multiplexer, self.id)
 
-                        self.childmessagepipe.send((obj.fileno(),protocol,obj.getpeername(),obj.getsockname()[1],decodeinfo))
-                        del buf[:decodeinfo.iend]
+    # the requests for this contact are routed to this transport
+    def addcontact(self, contacturi):
+        contacturi.params['mux'] = self.id
+        if contacturi.user:
+            self.multiplexer.adduser(self, contacturi.user)
 
-            # cleanup servicesockets
-            currenttime = time.monotonic()
-            for sock in servicesockets.copy():
-                if currenttime - sock.touchtime > 32:
-                    # service TCP socket that are idle for more than 64*T1 sec are closed
-                    sock.close()
-                    log.info("%s: service socket fd=%s closed for inactivity", self, sock.fileno())
-                    servicesockets.remove(sock)
-                elif sock.fileno() == -1:
-                    log.info("%s: service socket fd=%s closed after EOF", self, sock.fileno())
-                    servicesockets.remove(sock)
+    def send(self, message, addr=None):
+        self.multiplexer.send(message, addr, self)
+
+    def deliver(self, message):
+        if self.recvcb:
+            self.recvcb(message)
+        self.messages.put(message)
+
+    def recv(self, timeout=None):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        self.multiplexer.detach(self)
+        self.messages.put(None)
+
+#
+# SSLContexts of the TLS client connections shared by the process, one
+#  per CA file and hostname check: the CA file is loaded once
+#
+sslcontexts = {}
+def clientsslcontext(cafile, checkhostname):
+    sslcontext = sslcontexts.get((cafile, checkhostname))
+    if sslcontext is None:
+        sslcontext = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH, cafile=cafile)
+        sslcontext.check_hostname = checkhostname
+        sslcontext.sslsocket_class = ServiceSSLSocket
+        sslcontexts[(cafile, checkhostname)] = sslcontext
+    return sslcontext
+
+#
+# Service sockets of the run loop of a Transport, indexed by fd and by
+#  remote address. Everything sent to an address goes on its first
+#  connection, keeping the RFC 5626 flow and the order of the messages
+#  of the dialogs; the other ones (opened by prewarm() or by the peer)
+#  are spares, the next one taking over when the first one is closed
+#  -connections are opened with non-blocking connects and TLS handshakes:
+#   the packets sent in the meantime are queued, and reported as errors
+#   if the connection fails or is not ready within connecttimeout seconds
+#  -the sockets stay non-blocking once connected: the packets a socket
+#   does not accept at once stay queued and are written when it becomes
+#   writable, so that a slow peer never blocks the run loop. A packet that
+#   would make more than maxqueued bytes wait on a socket is reported as
+#   an error
+#  -connections idle for idletimeout seconds are closed, except the ones
+#   opened by the transport when keepalive is set: they have TCP keepalive
+#   enabled and a CRLF ping is sent on them after keepalive seconds of
+#   silence (RFC 5626)
+#  -TLS connections use the SSLContexts shared by the process (see
+#   clientsslcontext) and resume the last session of their remote address
+#   (the session tickets are saved when the sockets are read or closed).
+#   The number and duration of the full and resumed handshakes are
+#   counted in tlsstats
+#  -the deadlines of the sockets are kept in a heap of [deadline, idt,
+#   fd, sock] entries, an entry being pushed again when its deadline has
+#   moved since it was pushed. Only the last entry pushed for a socket is
+#   valid (sock.entry)
+#
+class ConnectionPool:
+    PING = b'\r\n\r\n'
+    PONG = b'\r\n'
+    maxqueued = 1 << 20
+
+    def __init__(self, transport, selector, idletimeout=32, connecttimeout=2, keepalive=None):
+        self.transport = transport
+        self.localaddr = (transport.localip, transport.localport)
+        self.selector = selector
+        self.idletimeout = idletimeout
+        self.connecttimeout = connecttimeout
+        self.keepalive = keepalive
+        self.sockets = {}
+        self.peers = {}
+        self.deadlines = []
+        self.counter = itertools.count()
+        # error of the last connection of an fd, for the packets that come
+        #  after the connection has failed
+        self.failures = {}
+        # last TLS session of each (remote address, cafile, hostname)
+        self.sessions = {}
+        self.tlsstats = dict(handshakes=0, handshaketime=0., resumed=0, resumedtime=0., failed=0)
+        # fds closed during an iteration of the run loop: their pending
+        #  events are ignored as the fd may already be reused
+        self.closed = set()
+
+    def add(self, sock, peer=None, state='connected', tls=None):
+        fd = sock.fileno()
+        sock.tls = tls
+        sock.peer = peer or sock.getpeername()
+        sock.localport = sock.getsockname()[1]
+        sock.state = state
+        sock.setblocking(False)
+        # packets to write, sentbytes of the first one being already written
+        sock.queued = collections.deque()
+        sock.queuedbytes = 0
+        sock.sentbytes = 0
+        sock.outgoing = state != 'connected'
+        sock.deadline = time.monotonic() + self.connecttimeout
+        self.failures.pop(fd, None)
+        self.sockets[fd] = sock
+        self.peers.setdefault(sock.peer, collections.deque()).append(sock)
+        self.selector.register(fd, selectors.EVENT_WRITE if state == 'connecting' else selectors.EVENT_READ, 'service')
+        self.schedule(sock)
+        return sock
+
+    def remove(self, fd, err=None):
+        sock = self.sockets.pop(fd)
+        self.selector.unregister(fd)
+        if sock.state == 'connected':
+            self.savesession(sock)
+        elif sock.state == 'handshake':
+            self.tlsstats['failed'] += 1
+        peers = self.peers[sock.peer]
+        peers.remove(sock)
+        if not peers:
+            del self.peers[sock.peer]
+        sock.close()
+        self.closed.add(fd)
+        if err:
+            self.failures[fd] = err
+        for packet in sock.queued:
+            if packet not in (self.PING, self.PONG):
+                dispatcherror(*self.localaddr, *sock.peer, err or "connection closed", packet)
+
+    def closeall(self):
+        for sock in self.sockets.values():
+            sock.close()
+
+    # Socket for fd (the socket a request was received on) or for remoteaddr
+    def get(self, remoteaddr, fd=None, tls=None):
+        sock = self.sockets.get(fd)
+        if sock:
+            return sock
+        peers = self.peers.get(remoteaddr)
+        if peers:
+            return peers[0]
+        return self.connect(remoteaddr, tls)
+
+    # Open count connections to remoteaddr, counting the existing ones
+    def prewarm(self, remoteaddr, count, tls=None):
+        for i in range(count - len(self.peers.get(remoteaddr, ()))):
+            self.connect(remoteaddr, tls)
+
+    def connect(self, remoteaddr, tls=None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            sock.bind((self.localaddr[0], 0))
+            err = sock.connect_ex(remoteaddr)
+            if err not in (0, errno.EINPROGRESS):
+                raise OSError(err, os.strerror(err))
+        except OSError as err:
+            sock.close()
+            raise Exception("cannot connect to {}:{}. errno={}".format(*remoteaddr, errno.errorcode[err.errno]))
+        if self.keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for option,value in (('TCP_KEEPIDLE', self.keepalive), ('TCP_KEEPINTVL', self.keepalive), ('TCP_KEEPCNT', 3)):
+                if hasattr(socket, option):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), max(1, int(value)))
+        sock = ServiceSocket(sock)
+        log.info("%s: connecting service socket fd=%s to %s:%s", self.transport, sock.fileno(), *remoteaddr)
+        return self.add(sock, remoteaddr, 'connecting', tls)
+
+    def send(self, fd, remoteaddr, packet):
+        sock = self.sockets.get(fd)
+        if not sock:
+            dispatcherror(*self.localaddr, *remoteaddr, self.failures.get(fd) or "cannot find socket with fd={}".format(fd), packet)
+        elif sock.queuedbytes + len(packet) > self.maxqueued:
+            dispatcherror(*self.localaddr, *remoteaddr, "send buffer full. {} bytes queued on fd={}".format(sock.queuedbytes, fd), packet)
+        else:
+            sock.queued.append(packet)
+            sock.queuedbytes += len(packet)
+            if sock.state == 'connected' and len(sock.queued) == 1:
+                self.flush(sock)
+
+    # Write the queued packets of a connected socket until it would block,
+    #  and wait for it to be writable while some are left
+    def flush(self, sock):
+        fd = sock.fileno()
+        queued = sock.queued
+        try:
+            while queued:
+                packet = queued[0]
+                sent = sock.send(memoryview(packet)[sock.sentbytes:])
+                sock.sentbytes += sent
+                sock.queuedbytes -= sent
+                if sock.sentbytes < len(packet):
+                    break
+                queued.popleft()
+                sock.sentbytes = 0
+        except (BlockingIOError, ssl.SSLWantWriteError, ssl.SSLWantReadError):
+            pass
+        except OSError as err:
+            log.info("%s: service socket fd=%s closed. %s", self.transport, fd, err)
+            self.remove(fd, str(err))
+            return
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if queued else selectors.EVENT_READ
+        if self.selector.get_key(fd).events != events:
+            self.selector.modify(fd, events, 'service')
+
+    # Event on the socket of fd: go on with its connection or with its
+    #  queued packets, or return it when it is connected and has data to
+    #  read
+    def ready(self, fd, events=selectors.EVENT_READ):
+        sock = self.sockets[fd]
+        if sock.state == 'connected':
+            if events & selectors.EVENT_WRITE:
+                self.flush(sock)
+                if self.sockets.get(fd) is not sock or not events & selectors.EVENT_READ:
+                    return None
+            self.savesession(sock)
+            return sock
+        if sock.state == 'connecting':
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                log.info("%s: cannot connect service socket fd=%s to %s:%s. errno=%s", self.transport, fd, *sock.peer, errno.errorcode.get(err, err))
+                self.remove(fd, "cannot connect. errno={}".format(errno.errorcode.get(err, err)))
+                return None
+            if not sock.tls:
+                self.connected(sock)
+                return None
+            cafile,hostname = sock.tls
+            try:
+                sslcontext = clientsslcontext(cafile, bool(hostname))
+            except OSError as err:
+                self.remove(fd, "bad CA file {} {}".format(cafile, err))
+                return None
+            session = self.sessions.get((sock.peer, cafile, hostname))
+            tlssock = sslcontext.wrap_socket(sock, server_hostname=hostname, do_handshake_on_connect=False, session=session)
+            tlssock.setup()
+            tlssock.handshakestart = time.monotonic()
+            for attr in ('peer', 'localport', 'queued', 'queuedbytes', 'sentbytes', 'outgoing', 'deadline', 'tls'):
+                setattr(tlssock, attr, getattr(sock, attr))
+            tlssock.state = 'handshake'
+            self.sockets[fd] = tlssock
+            peers = self.peers[sock.peer]
+            peers[peers.index(sock)] = tlssock
+            sock = tlssock
+            self.schedule(sock)
+        try:
+            sock.do_handshake()
+        except ssl.SSLWantReadError:
+            self.selector.modify(fd, selectors.EVENT_READ, 'service')
+        except ssl.SSLWantWriteError:
+            self.selector.modify(fd, selectors.EVENT_WRITE, 'service')
+        except ssl.CertificateError as err:
+            self.remove(fd, "cannot connect. {}".format(err))
+        except ssl.SSLError as err:
+            self.remove(fd, "cannot connect. {} {}".format(err.library, err.reason))
+        except OSError as err:
+            self.remove(fd, "cannot connect. {}".format(err))
+        else:
+            self.connected(sock)
+        return None
 
+    def connected(self, sock):
+        fd = sock.fileno()
+        sock.state = 'connected'
+        sock.touchtime = time.monotonic()
+        self.selector.modify(fd, selectors.EVENT_READ, 'service')
+        self.schedule(sock)
+        if sock.tls:
+            duration = time.monotonic() - sock.handshakestart
+            if sock.session_reused:
+                self.tlsstats['resumed'] += 1
+                self.tlsstats['resumedtime'] += duration
+            else:
+                self.tlsstats['handshakes'] += 1
+                self.tlsstats['handshaketime'] += duration
+            self.savesession(sock)
+            log.info("%s: TLS handshake fd=%s %s in %.1f ms", self.transport, fd, 'resumed' if sock.session_reused else 'full', duration * 1e3)
+        log.info("%s: new service socket fd=%s", self.transport, fd)
+        self.flush(sock)
+
+    def schedule(self, sock, deadline=None):
+        sock.entry = [deadline or self.deadline(sock), next(self.counter), sock.fileno(), sock]
+        heapq.heappush(self.deadlines, sock.entry)
+
+    def savesession(self, sock):
+        if sock.tls and sock.session is not None:
+            self.sessions[(sock.peer, *sock.tls)] = sock.session
+
+    def deadline(self, sock):
+        if sock.state != 'connected':
+            return sock.deadline
+        if sock.outgoing and self.keepalive:
+            return sock.touchtime + self.keepalive
+        return sock.touchtime + self.idletimeout
+
+    # Seconds until the first deadline
+    def timeout(self):
+        if not self.deadlines:
+            return None
+        return max(0., self.deadlines[0][0] - time.monotonic())
+
+    # Fail the connections not ready in time, close the idle ones and ping
+    #  the ones kept alive
+    def expire(self):
+        currenttime = time.monotonic()
+        while self.deadlines and self.deadlines[0][0] <= currenttime:
+            entry = heapq.heappop(self.deadlines)
+            deadline,idt,fd,sock = entry
+            if self.sockets.get(fd) is not sock or sock.entry is not entry:
+                continue
+            deadline = self.deadline(sock)
+            if deadline <= currenttime:
+                if sock.state != 'connected':
+                    log.info("%s: cannot connect service socket fd=%s to %s:%s. timeout", self.transport, fd, *sock.peer)
+                    self.remove(fd, "cannot connect. timeout")
+                    continue
+                if not (sock.outgoing and self.keepalive):
+                    log.info("%s: service socket fd=%s closed for inactivity", self.transport, fd)
+                    self.remove(fd)
+                    continue
+                # no ping behind packets that are still waiting
+                sock.touchtime = currenttime
+                if not sock.queued:
+                    self.send(fd, sock.peer, self.PING)
+                    if self.sockets.get(fd) is not sock:
+                        continue
+                deadline = self.deadline(sock)
+            self.schedule(sock, deadline)
+
+#
+# Stream socket framing the received bytes with a Message.StreamFramer
+#
 class ServiceSocketMixin:
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.setup()
+
+    # SSL sockets are not built by their constructor: setup() is called
+    #  on the socket returned by SSLContext.wrap_socket()
+    def setup(self):
         self.touchtime = time.monotonic()
-        self.recvbuf = bytearray()
+        self.framer = Message.StreamFramer()
+        self.pinged = False
 
     def recv(self, *args, **kwargs):
         newbuf = super().recv(*args, **kwargs)
         self.touchtime = time.monotonic()
         if not newbuf:
             self.close()
-        self.recvbuf += newbuf
-        return self.recvbuf
+        self.framer.feed(newbuf)
+        return newbuf
 
-    def sendall(self, *args, **kwargs):
+    def send(self, *args, **kwargs):
         self.touchtime = time.monotonic()
-        return super().sendall(*args, **kwargs)
+        return super().send(*args, **kwargs)
+
+    #
+    # Yield the DecodeInfo of each complete message received
+    #
+    def framing(self):
+        framer = self.framer
+        try:
+            while True:
+                decodeinfo = framer.next()
+                if decodeinfo is None:
+                    return
+
+                # Erroneous messages or messages missing a Content-Length make the stream desynchronized
+                if decodeinfo.status == 'ERROR':
+                    self.close()
+                    return
+
+                yield decodeinfo
+        finally:
+            if framer.crlf and self.fileno() != -1:
+                log.info("%s:%d <-%s-- %s:%d (fd=%d)\n%s", *self.getsockname(), self.protocol, *self.getpeername(), self.fileno(), framer.crlf)
+                # keepalive ping (RFC 5626): the run loop answers with a pong
+                if ConnectionPool.PING in framer.crlf:
+                    self.pinged = True
+            framer.crlf = b''
 
 class ServiceSocket(ServiceSocketMixin, socket.socket):
+    protocol = 'TCP'
     def __init__(self, sock):
         assert(sock.type & socket.SOCK_STREAM)
         super().__init__(family=sock.family,
@@ -570,18 +1328,25 @@ class ServiceSocket(ServiceSocketMixin, socket.socket):
         self.settimeout(sock.gettimeout())
         sock.detach()
 
+# Built by a SSLContext whose sslsocket_class is ServiceSSLSocket
+# Records without application data (TLS 1.3 session tickets) make the
+#  socket readable: it is read without blocking, up to the end of the
+#  data already decrypted by SSL
 class ServiceSSLSocket(ServiceSocketMixin, ssl.SSLSocket):
-    def __init__(self, sock):
-        assert(sock.type & socket.SOCK_STREAM)
-        super().__init__(sock=sock,
-                         family=sock.family,
-                         type=sock.type,
-                         proto=sock.proto,
-                         fileno=sock.fileno(),
-                         _context=sock.context
-        )
-        self.settimeout(sock.gettimeout())
-        sock.detach()
+    protocol = 'TLS'
+    def recv(self, *args, **kwargs):
+        timeout = self.gettimeout()
+        self.settimeout(0.)
+        try:
+            while True:
+                super().recv(*args, **kwargs)
+                if self.fileno() == -1 or not self.pending():
+                    break
+        except ssl.SSLWantReadError:
+            pass
+        finally:
+            if self.fileno() != -1:
+                self.settimeout(timeout)
 
 
 class ErrorDispatcher(threading.Thread):
@@ -603,7 +1368,7 @@ class ErrorDispatcher(threading.Thread):
                 message = Message.SIPMessage.frombytes(data)
                 if message:
                     for transport in Transport.instances:
-                        if transport.localip == srcip and transport.localport == srcport:
+                        if transport.started and transport.localip == srcip and transport.localport == srcport:
                             log.info("%s <-%s- %s:%d %s\n%s", transport, protocol, dstip, dstport, err, message)
                             if transport.errorcb:
                                 transport.errorcb(message, err)
@@ -32,7 +32,10 @@ class UAbase(Transaction.TransactionManager):
         if 'sec-agree' in self.extensions:
             transport['protocol'] = 'udp'
         super().__init__(transport, **transaction)
+        self.configure(ua, identity)
 
+    # proxy and identity of the UA
+    def configure(self, ua, identity):
         ua = dict(ua)
         proxy = ua.pop('proxy', None)
         try:
@@ -49,6 +52,10 @@ class UAbase(Transaction.TransactionManager):
                 self.proxy = (proxy.exploded, None)
         except:
             log.logandraise(Exception('invalid proxy definition {!r}'.format(proxy)))
+        # connections opened to the proxy in advance (TCP and TLS)
+        prewarm = ua.pop('prewarm', 0)
+        if prewarm and proxy and hasattr(self.transport, 'prewarm'):
+            self.transport.prewarm(self.proxy, prewarm)
         if ua:
             raise ValueError('unexpected UA parameters {}'.format(ua))
 
@@ -103,6 +110,9 @@ class UAbase(Transaction.TransactionManager):
         if self.contacturi:
             self.contacturi.host = self.transport.localip
             self.contacturi.port = self.transport.localport
+            # a transport shared with other UAs routes the requests for the contact to this UA
+            if hasattr(self.transport, 'addcontact'):
+                self.transport.addcontact(self.contacturi)
 
     def __str__(self):
         return str(self.contacturi)
@@ -181,6 +191,20 @@ def unregisterphones():
 
 class RegistrationManager:
     def __init__(self, registration={}, **kwargs):
+        self.configureregistration(registration)
+        super().__init__(**kwargs)
+        self.registered = False
+        self.registermessage = None
+        self.regtimer = None
+
+        if self.autoreg and self.addressofrecord:
+            self.register()
+
+        global tobeunregistered
+        if self.autounreg and self.addressofrecord:
+            tobeunregistered.add(self)
+
+    def configureregistration(self, registration):
         registration = dict(registration)
         self.autoreg = registration.pop('autoreg', True)
         self.autounreg = registration.pop('autounreg', self.autoreg)
@@ -197,17 +221,21 @@ class RegistrationManager:
             raise TypeError('expecting a dict for contactparams not {!r}'.format(self.contactparams))
         if registration:
             raise ValueError('unexpecting registration parameters {}'.format(registration))
-        super().__init__(**kwargs)
-        self.registered = False
-        self.registermessage = None
-        self.regtimer = None
 
-        if self.autoreg and self.addressofrecord:
-            self.register()
-
-        global tobeunregistered
-        if self.autounreg and self.addressofrecord:
-            tobeunregistered.add(self)
+    def registerrequest(self, expires, *headers):
+        if self.registermessage is None:
+            self.registermessage = Message.REGISTER(self.domain, *headers)
+            self.registermessage.addheaders(
+                Header.From(self.addressofrecord),
+                Header.To(self.addressofrecord),
+                Header.Contact(self.contacturi, params=self.contactparams),
+                ifmissing=True
+            )
+        else:
+            self.registermessage.addheaders(*headers, replace=True)
+            self.registermessage.seq += 1
+        self.registermessage.addheaders(Header.Expires(delta=expires), replace=True)
+        return self.registermessage
 
     def register(self, expires=None, *headers, asynch=False):
         expires = expires if expires is not None else self.expires
@@ -223,18 +251,7 @@ class RegistrationManager:
         else:
             log.info("%s unregistering", self)
 
-        if self.registermessage is None:
-            self.registermessage = Message.REGISTER(self.domain, *headers)
-            self.registermessage.addheaders(
-                Header.From(self.addressofrecord),
-                Header.To(self.addressofrecord),
-                Header.Contact(self.contacturi, params=self.contactparams),
-                ifmissing=True
-            )
-        else:
-            self.registermessage.addheaders(*headers, replace=True)
-            self.registermessage.seq += 1
-        self.registermessage.addheaders(Header.Expires(delta=expires), replace=True)
+        self.registerrequest(expires, *headers)
         for result,event in self.sendmessage(self.registermessage):
             if result.success:
                 gotexpires = 0
@@ -382,8 +399,8 @@ class SessionManager:
     def popsession(self, key):
         return self.getsession(key, pop=True)
 
-    def invite(self, touri, *headers):
-        if isinstance(touri, UAbase):
+    def inviterequest(self, touri, *headers):
+        if hasattr(touri, 'addressofrecord'):
             touri = touri.addressofrecord
         invite = Message.INVITE(touri, *headers)
         invite.addheaders(
@@ -394,6 +411,10 @@ class SessionManager:
         media = self.mediaclass(ua=self, **self.mediaargs)
         invite.setbody(*media.getlocaloffer())
         log.info("%s inviting %s", self, touri)
+        return invite,media
+
+    def invite(self, touri, *headers):
+        invite,media = self.inviterequest(touri, *headers)
         for result,event in self.sendmessage(invite):
             if result.success:
                 log.info("%s invitation ok", self)
@@ -456,7 +477,7 @@ class SessionManager:
             log.info("%s invalid invitation by %s", self, invite.fromaddr)
             return invite.response(481)
 
-    def bye(self, key):
+    def byerequest(self, key):
         try:
             session,media = self.popsession(key)
         except Exception as e:
@@ -471,6 +492,12 @@ class SessionManager:
                           Header.To(session.remoteuri, params=dict(tag=session.remotetag)),
                           Header.CSeq(seq=session.localseq, method='BYE'))
         media.stop()
+        return bye
+
+    def bye(self, key):
+        bye = self.byerequest(key)
+        if bye is None:
+            return
         for result,event in self.sendmessage(bye):
             if result.success:
                 log.info("%s closing ok", self)
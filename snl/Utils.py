@@ -1,12 +1,13 @@
 #coding: utf-8
 
 import re
-import collections
 import socket
 import fcntl
 import struct
 import array
 import sys
+import copy
+import weakref
 
 ESCAPE_RE=re.compile('\\\\[\r\n]')
 def unquote(string):
@@ -33,11 +34,134 @@ def quote(string,forcequote=False):
     return string
 
 
-class ParameterDict:
+#
+# Base class of the parts of a SIP message (message, headers, URIs and
+#  parameters) that notify the parts owning them of any modification,
+#  up to the message which drops its cached serialization.
+# A part assigned to attributes of several parts (for instance the same
+#  URI given as address to two headers) is shared, as any Python object,
+#  and notifies all of them: _owner is the weak reference of its owner
+#  or a tuple of weak references. The owners are neither copied nor
+#  pickled, and an owner the part has been removed from may still be
+#  notified, which only drops a cache. (Headers given to addheaders()
+#  are copied, not shared.)
+# The attributes listed in UNTRACKED do not change the serialization and
+#  are set without notification.
+# Parts may store their attributes in __slots__, in __dict__ or both.
+#
+class Owned:
+    __slots__ = ('_owner', '__weakref__')
+    UNTRACKED = frozenset()
+
+    def _adoptedby(self, owner):
+        current = getattr(self, '_owner', None)
+        if current is None:
+            owners = weakref.ref(owner)
+        elif type(current) is tuple:
+            if any(ref() is owner for ref in current):
+                return self
+            owners = tuple(ref for ref in current if ref() is not None) + (weakref.ref(owner),)
+        else:
+            previous = current()
+            if previous is owner:
+                return self
+            owners = weakref.ref(owner) if previous is None else (current, weakref.ref(owner))
+        object.__setattr__(self, '_owner', owners)
+        return self
+
+    def _changed(self):
+        owner = getattr(self, '_owner', None)
+        if owner is None:
+            return
+        for ref in (owner if type(owner) is tuple else (owner,)):
+            owner = ref()
+            if owner is not None:
+                owner._changed()
+
+    def __setattr__(self, name, value):
+        if name[0] == '_' or name in self.UNTRACKED:
+            if isinstance(value, Owned):
+                value = value._adoptedby(self)
+            object.__setattr__(self, name, value)
+            return
+        if isinstance(value, Owned):
+            value = value._adoptedby(self)
+        if name in Owned.properties(type(self)):
+            # properties notify the changes themselves
+            object.__setattr__(self, name, value)
+            return
+        old = getattr(self, name, Owned)
+        object.__setattr__(self, name, value)
+        if old is not value and (type(old) is not type(value) or old != value):
+            self._changed()
+
+    # Names of the properties of each class
+    PROPERTIES = {}
+    @staticmethod
+    def properties(cls):
+        properties = Owned.PROPERTIES.get(cls)
+        if properties is None:
+            properties = Owned.PROPERTIES[cls] = frozenset(name for name in dir(cls) if isinstance(getattr(cls, name, None), property))
+        return properties
+
+    # Slot descriptors of each class, except _owner and __weakref__
+    #  (a slot may be shadowed by a class attribute of a subclass)
+    SLOTS = {}
+    @staticmethod
+    def slots(cls):
+        slots = Owned.SLOTS.get(cls)
+        if slots is None:
+            slots = {}
+            for klass in cls.__mro__:
+                for name in klass.__dict__.get('__slots__', ()):
+                    if name not in ('_owner', '__weakref__', '__dict__'):
+                        slots.setdefault(name, klass.__dict__[name])
+            slots = Owned.SLOTS[cls] = slots
+        return slots
+
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', ()))
+        for name, slot in Owned.slots(type(self)).items():
+            try:
+                state[name] = slot.__get__(self)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        slots = Owned.slots(type(self))
+        for name, value in state.items():
+            if isinstance(value, Owned):
+                value = value._adoptedby(self)
+            if name in slots:
+                slots[name].__set__(self, value)
+            else:
+                object.__setattr__(self, name, value)
+
+    #
+    # Copy sharing the immutable attributes, and copying the parts and
+    #  the other attributes
+    #
+    IMMUTABLES = (str, bytes, int, float, bool, type(None))
+    @staticmethod
+    def copyvalue(value):
+        if isinstance(value, Owned):
+            return value.copy()
+        if isinstance(value, Owned.IMMUTABLES):
+            return value
+        return copy.deepcopy(value)
+
+    def copy(self):
+        part = self.__class__.__new__(self.__class__)
+        part.__setstate__({name: Owned.copyvalue(value) for name, value in self.__getstate__().items()})
+        return part
+
+
+class ParameterDict(Owned):
     """Dictionary, that has ordered case-insensitive keys.
 
     from http://code.activestate.com/recipes/66315-case-insensitive-dictionary/
-    + change dict to OrderedDict
+    + keys kept in insertion order (plain dict)
     
     Keys are retained in their original form
     when queried with .keys() or .items().
@@ -47,14 +171,29 @@ class ParameterDict:
     against the lowercase keys, but all methods that expose
     keys to the user retrieve the original keys."""
     
+    __slots__ = ('_dict',)
+
+    # Table shared by the empty dictionaries until their first update
+    EMPTY = {}
+
     def __init__(self, dictorlist=None):
         """Create an empty dictionary, or update from 'dict'."""
-        self._dict = collections.OrderedDict()
         if isinstance(dictorlist, dict):
-            self.update(dictorlist)
-        elif dictorlist is not None:
+            dictorlist = dictorlist.items()
+        d = ParameterDict.EMPTY
+        if dictorlist is not None:
             for k,v in dictorlist:
-                self[k] = v
+                if d is ParameterDict.EMPTY:
+                    d = {}
+                d[k.lower()] = (k, v)
+        object.__setattr__(self, '_dict', d)
+
+    def copy(self):
+        """Copy of the dictionary, keys and values being immutable."""
+        parameterdict = ParameterDict.__new__(ParameterDict)
+        d = self._dict
+        object.__setattr__(parameterdict, '_dict', d.copy() if d else ParameterDict.EMPTY)
+        return parameterdict
 
     def __bool__(self):
         return bool(self._dict)
@@ -68,12 +207,16 @@ class ParameterDict:
         """Associate 'value' with 'key'. If 'key' already exists, but
         in different case, it will be replaced."""
         k = key.lower()
-        self._dict[k] = (key, value)
+        if self._dict.get(k) != (key, value):
+            if self._dict is ParameterDict.EMPTY:
+                self._dict = {}
+            self._dict[k] = (key, value)
+            self._changed()
 
     def has_key(self, key):
         """Case insensitive test wether 'key' exists."""
         k = key.lower()
-        return self._dict.has_key(k)
+        return k in self._dict
 
     def keys(self):
         """List of keys in their original case."""
@@ -102,7 +245,10 @@ class ParameterDict:
     def pop(self, key, default=None):
         """If key is in the dictionary, remove it and return its value, else return default."""
         k = key.lower()
-        return self._dict.pop(k, default)
+        if k not in self._dict:
+            return default
+        self._changed()
+        return self._dict.pop(k)
 
     def setdefault(self, key, default):
         """If 'key' doesn't exists, associate it with the 'default' value.
@@ -222,3 +368,80 @@ def getinterfaces():
 
     s.close()
     return interfaces, loopbackinterfaces
+
+#
+# Histogram of durations (in seconds) with log-linear buckets, in the
+#  manner of HdrHistogram: the values are counted in integer multiples
+#  of unit, exactly up to 2**precision units then in buckets whose width
+#  is a 2**-(precision-1) fraction of their value, so that the relative
+#  error stays below 1% (precision 7) whatever the range
+#  -record(value) counts a value
+#  -percentile(p) returns the value under which p% of the values are
+#  -merge(histogram) adds the counts of another histogram with the same
+#   unit and precision
+#
+class Histogram:
+    def __init__(self, unit=1e-6, precision=7):
+        self.unit = unit
+        self.precision = precision
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.
+        self.min = self.max = None
+
+    def record(self, value):
+        units = int(value / self.unit)
+        if units < 0:
+            units = 0
+        shift = units.bit_length() - self.precision
+        if shift <= 0:
+            index = units
+        else:
+            index = (shift << (self.precision - 1)) + (units >> shift)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    # middle of the values counted in a bucket
+    def bucketvalue(self, index):
+        half = 1 << (self.precision - 1)
+        if index < 2 * half:
+            return index * self.unit
+        shift = index // half - 1
+        low = (index - shift * half) << shift
+        return (low + ((1 << shift) - 1) / 2) * self.unit
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = max(1, p * self.count / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(max(self.bucketvalue(index), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def merge(self, histogram):
+        assert (histogram.unit, histogram.precision) == (self.unit, self.precision)
+        for index,count in histogram.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += histogram.count
+        self.total += histogram.total
+        for value in (histogram.min, histogram.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def summary(self):
+        return dict(count=self.count, mean=self.mean, min=self.min,
+                    p50=self.percentile(50), p90=self.percentile(90), p99=self.percentile(99),
+                    max=self.max)
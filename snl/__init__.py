@@ -1,7 +1,6 @@
 import sys
 import logging
 import types
-import re
 
 assert sys.version_info >= (3,5)
 
@@ -21,9 +20,13 @@ def excepthook(type, value, traceback):
     sys.__excepthook__(type, value, traceback)
 sys.excepthook = excepthook
 
+#
+# The messages logged with a SIP message after their first line have
+#  their start line highlighted. It is recognized with str methods
+#  rather than regular expressions, and single line messages are left
+#  untouched, the formatter being called for every message logged.
+#
 class ColoredFormatter(logging.Formatter):
-    STATUS_LINE_RE = re.compile('SIP/2.0 (?P<code>[1-7]\d\d) (?P<reason>.+)', re.IGNORECASE)
-    REQUEST_LINE_RE = re.compile('''(?P<method>[A-Za-z0-9.!%*_+`'~-]+) (?P<requesturi>[^ ]+) SIP/2.0''', re.IGNORECASE)
     default_time_format = "%H:%M:%S"
     escapecodes = {'CRITICAL':('2;91;41','97'),
                    'ERROR':('2;91','2;91'),
@@ -36,16 +39,21 @@ class ColoredFormatter(logging.Formatter):
         record.color1,record.color2 = ColoredFormatter.escapecodes[record.levelname]
         return logging.Formatter.format(self, record)
     def indentmessage(self, message):
+        if '\n' not in message and '\r' not in message:
+            return message
         lines = message.splitlines()
         if len(lines) > 1:
             lines[0] += '\x1b[m'
         if len(lines) > 2:
-            requestline = ColoredFormatter.REQUEST_LINE_RE.search(lines[1])
-            statusline = ColoredFormatter.STATUS_LINE_RE.search(lines[1])
-            if requestline:
-                lines[1] = "\x1b[92m{method} {requesturi}\x1b[m SIP/2.0".format(**requestline.groupdict())
-            elif statusline:
-                lines[1] = "\x1b[mSIP/2.0 \x1b[92m{code} {reason}\x1b[m".format(**statusline.groupdict())
+            line = lines[1]
+            if line[:8].upper() == 'SIP/2.0 ':
+                code,_,reason = line[8:].partition(' ')
+                if len(code) == 3 and code.isdigit() and reason:
+                    lines[1] = "\x1b[mSIP/2.0 \x1b[92m{} {}\x1b[m".format(code, reason)
+            elif line[-8:].upper() == ' SIP/2.0':
+                method,_,requesturi = line[:-8].partition(' ')
+                if method and requesturi and ' ' not in requesturi:
+                    lines[1] = "\x1b[92m{} {}\x1b[m SIP/2.0".format(method, requesturi)
         return '\n   '.join(lines)
 
 
@@ -62,6 +70,9 @@ for submodule,level in (('Header',      'WARNING'),
                         ('MSRP',        'WARNING'),
                         ('Dialog',      'INFO'),
                         ('Transport',   'INFO'),
+                        ('Aio',         'INFO'),
+                        ('Load',        'INFO'),
+                        ('Metrics',     'INFO'),
                         ('UA',          'INFO')):
     log = logging.getLogger(submodule)
     log.setLevel(level)
@@ -81,7 +92,9 @@ log.error("{:#^66}".format("< SIPandLove >"))
 
 from .SIPBNF import URI
 from .Message import SIPMessage,SIPResponse,SIPRequest,REGISTER,INVITE,ACK,BYE,CANCEL,OPTIONS
-from .Transport import Transport
+from .Transport import Transport,Multiplexer
+from .Shard import ShardedTransport
+from .Responder import Responder
 from .UA import SIPPhoneClass
 from .Media import Media
 from .MSRP import MSRP